@@ -0,0 +1,94 @@
+import os
+import shutil
+import key_pool
+
+# Work accepted while queued (not yet started) files/bytes stay under these limits (0 = unlimited)
+ADMISSION_MAX_QUEUED_FILES = int(os.getenv("ADMISSION_MAX_QUEUED_FILES", "0"))
+ADMISSION_MAX_QUEUED_BYTES = int(os.getenv("ADMISSION_MAX_QUEUED_BYTES", "0"))
+# Uploads are refused when the input volume has less free space than this
+ADMISSION_MIN_FREE_DISK_BYTES = int(os.getenv("ADMISSION_MIN_FREE_DISK_BYTES", str(512 * 1024 * 1024)))
+# Refuse new work while every API key is cooling down after 429s
+ADMISSION_REJECT_WHEN_THROTTLED = os.getenv("ADMISSION_REJECT_WHEN_THROTTLED", "true").lower() == "true"
+
+MIN_RETRY_AFTER = 5
+MAX_RETRY_AFTER = 900
+DEFAULT_RETRY_AFTER = 30
+
+
+def _clamp(seconds):
+    return int(min(MAX_RETRY_AFTER, max(MIN_RETRY_AFTER, seconds)))
+
+
+def free_disk_bytes(path):
+    try:
+        return shutil.disk_usage(path).free
+    except OSError:
+        return None
+
+
+def load_estimate(queued_files, queued_bytes, files_per_second, path):
+    """Current load, returned with every refusal so clients can decide how long to back off."""
+    return {
+        'queued_files': queued_files,
+        'queued_bytes': queued_bytes,
+        'files_per_second': round(files_per_second, 3) if files_per_second else None,
+        'estimated_wait_seconds': round(queued_files / files_per_second) if files_per_second else None,
+        'free_disk_bytes': free_disk_bytes(path),
+        'api_keys_throttled': key_pool.pool.cooldown_remaining() > 0,
+    }
+
+
+def admitted(queued_files, queued_bytes, sizes, max_files=None, max_bytes=None):
+    """How many of several incoming files (their sizes, in order) the queue limits accept.
+
+    Each file is checked as if it came in its own request, so an archive
+    can't put thousands of entries past the limits at once. max_files and
+    max_bytes default to ADMISSION_MAX_QUEUED_FILES/BYTES (0 = unlimited).
+    """
+    max_files = ADMISSION_MAX_QUEUED_FILES if max_files is None else max_files
+    max_bytes = ADMISSION_MAX_QUEUED_BYTES if max_bytes is None else max_bytes
+    count = 0
+    for size in sizes:
+        if (max_files and queued_files >= max_files) or (max_bytes and queued_bytes >= max_bytes):
+            break
+        queued_files += 1
+        queued_bytes += size
+        count += 1
+    return count
+
+
+def evaluate(queued_files, queued_bytes, incoming_files, incoming_bytes, upload_bytes, path,
+             files_per_second=None):
+    """Decide whether new work is admitted.
+
+    incoming_files/incoming_bytes are about to be queued; upload_bytes are
+    about to be written to disk. Queue limits refuse new work once the
+    backlog has reached them, so one request can overshoot by its own size
+    (bounded by MAX_REQUEST_SIZE) but a batch larger than the limit is never
+    refused forever. Returns None when admitted, otherwise
+    (status code, error message, retry after seconds, load). Queue limits
+    answer 429 (the client should slow down); low disk and a throttled
+    upstream answer 503.
+    """
+    def refuse(status, message, retry_after):
+        return status, message, _clamp(retry_after), load_estimate(
+            queued_files, queued_bytes, files_per_second, path)
+
+    if ADMISSION_REJECT_WHEN_THROTTLED and incoming_files:
+        cooldown = key_pool.pool.cooldown_remaining()
+        if cooldown > 0:
+            return refuse(503, 'Todas las API keys están en pausa por límite de API', cooldown)
+
+    free = free_disk_bytes(path)
+    if free is not None and free - upload_bytes < ADMISSION_MIN_FREE_DISK_BYTES:
+        return refuse(503, 'Espacio en disco insuficiente', DEFAULT_RETRY_AFTER * 2)
+
+    over_files = ADMISSION_MAX_QUEUED_FILES and queued_files >= ADMISSION_MAX_QUEUED_FILES
+    over_bytes = ADMISSION_MAX_QUEUED_BYTES and queued_bytes >= ADMISSION_MAX_QUEUED_BYTES
+    if incoming_files and (over_files or over_bytes):
+        # Time for the queue to drain back under the limit
+        excess = max(queued_files - (ADMISSION_MAX_QUEUED_FILES or queued_files) + 1, 1)
+        retry_after = excess / files_per_second if files_per_second else DEFAULT_RETRY_AFTER
+        return refuse(429, 'Cola de procesamiento llena', retry_after)
+
+    return None
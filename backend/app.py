@@ -1,5 +1,8 @@
 import os
+import io
 import json
+import shutil
+import hashlib
 import threading
 import time
 from flask import Flask, request, jsonify, send_file
@@ -7,6 +10,24 @@ from flask_cors import CORS
 from werkzeug.utils import secure_filename
 import file_to_md
 import consolidar_md
+import output_store
+import preflight
+import key_pool
+import scheduler
+import watcher
+import leases
+import bulk_upload
+import chunk_export
+import janitor
+import image_prep
+import hedging
+import admission
+import planner
+import page_dedup
+import retry_queue
+import storage
+import micro_batch
+import tenants
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -16,7 +37,7 @@ app = Flask(__name__)
 CORS(app)
 
 # Configuration
-app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max file size
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv("MAX_REQUEST_SIZE", str(100 * 1024 * 1024)))  # 100MB max request size (also bounds bulk uploads)
 app.config['UPLOAD_FOLDER'] = os.getenv("INPUT_DIR", "InputFiles")
 app.config['OUTPUT_FOLDER'] = os.getenv("OUTPUT_DIR", "OutputFiles")
 
@@ -24,6 +45,11 @@ app.config['OUTPUT_FOLDER'] = os.getenv("OUTPUT_DIR", "OutputFiles")
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
 
+# Where inputs and outputs are kept (STORAGE_BACKEND); with an object store the
+# folders above are only the working copies conversions read and write
+inputs = storage.open_storage('input', app.config['UPLOAD_FOLDER'])
+outputs = storage.open_storage('output', app.config['OUTPUT_FOLDER'])
+
 # Global state for processing status
 processing_status = {
     'is_processing': False,
@@ -31,11 +57,126 @@ processing_status = {
     'progress': 0,
     'total_files': 0,
     'processed_files': 0,
+    'total_pages': 0,
+    'processed_pages': 0,
+    'pages_reused': 0,
+    'bytes_saved': 0,
+    'estimated_work_seconds': 0,
+    'eta_seconds': None,
+    'file_results': {},
+    'active_files': [],
     'errors': [],
     'start_time': None,
     'end_time': None
 }
 
+# Pending work, shared fairly between tenants and ordered by the configured
+# scheduling policy within each one (see scheduler.py and tenants.py). Jobs are
+# tagged with their composite parse group when queued; stored inputs are fetched
+# one at a time, so only local ones are batched
+work_queue = scheduler.WorkQueue(weight=tenants.weight, max_active=tenants.max_active,
+                                 group=None if inputs.remote else micro_batch.group_of)
+
+# Per-tenant wait times and throughput for the status and metrics endpoints
+tenant_stats = tenants.TenantStats()
+
+# Guards starting the background worker and its transition to idle
+worker_lock = threading.Lock()
+
+# Guards counters and lists in processing_status updated by worker threads
+status_lock = threading.Lock()
+
+# Files converted in parallel; parses per API key are capped by the key pool
+MAX_CONCURRENT_FILES = int(os.getenv("MAX_CONCURRENT_FILES", "3"))
+
+# Input folder watcher (enabled with WATCH_INPUT_DIR=true)
+folder_watcher = None
+
+# Bookkeeping of the running processing run (see process_files_background)
+current_run = None
+
+# "local" converts in this process; "fleet" only queues work in the shared
+# lease store and separate worker.py processes (on any host) convert it
+PROCESSING_MODE = os.getenv("PROCESSING_MODE", "local").lower()
+lease_store = leases.open_store() if PROCESSING_MODE == 'fleet' else None
+
+def is_pending(filename):
+    """Check if a file is waiting to be converted (local queue or fleet lease store)"""
+    if lease_store is not None:
+        return lease_store.state(filename) in ('pending', 'leased')
+    return filename in work_queue or retries.is_waiting(filename)
+
+def on_evicted(area, filename):
+    """Forget the priority and tenant of inputs removed by the disk janitor"""
+    if area == 'input':
+        scheduler.set_priority([filename], None)
+        tenants.assign([filename], None)
+
+def queue_depth():
+    """Files and bytes waiting to be converted"""
+    if lease_store is not None:
+        fleet = lease_store.status()
+        return fleet['counts']['pending'], fleet['pending_bytes']
+    jobs = work_queue.snapshot()
+    return len(jobs), sum(job['size'] for job in jobs)
+
+def files_per_second():
+    """Throughput of the current run, or None before the first file finishes"""
+    with status_lock:
+        start_time = processing_status['start_time']
+        processed = processing_status['processed_files']
+        running = processing_status['is_processing']
+    if not running or not start_time or not processed:
+        return None
+    return processed / max(time.time() - start_time, 1e-6)
+
+def admission_refusal(incoming_files=0, incoming_bytes=0, upload_bytes=0, tenant=None):
+    """429/503 response with Retry-After if new work would overload the pipeline or
+    exceed the tenant's queue quota, else None"""
+    queued_files, queued_bytes = queue_depth()
+    decision = admission.evaluate(queued_files, queued_bytes, incoming_files, incoming_bytes,
+                                  upload_bytes, app.config['UPLOAD_FOLDER'], files_per_second())
+    if decision is None and tenant is not None and lease_store is None:
+        jobs = [job for job in work_queue.snapshot() if job['tenant'] == tenant]
+        decision = tenants.quota_refusal(tenant, len(jobs), sum(job['size'] for job in jobs),
+                                         incoming_files, tenant_stats.files_per_second(tenant))
+    if decision is None:
+        return None
+    status, message, retry_after, load = decision
+    response = jsonify({'error': message, 'retry_after': retry_after, 'load': load})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, status
+
+def admitted_entries(sizes, tenant):
+    """How many of the files extracted from a bulk upload (sizes, in order) fit the queue limits and tenant quota"""
+    queued_files, queued_bytes = queue_depth()
+    count = admission.admitted(queued_files, queued_bytes, sizes)
+    if lease_store is None:
+        jobs = [job for job in work_queue.snapshot() if job['tenant'] == tenant]
+        max_files, max_bytes = tenants.queue_quota(tenant)
+        count = min(count, admission.admitted(len(jobs), sum(job['size'] for job in jobs), sizes,
+                                              max_files, max_bytes))
+    return count
+
+# Disk quotas for inputs, outputs and the prepared image cache (QUOTA_*_BYTES)
+disk_janitor = janitor.Janitor(
+    app.config['UPLOAD_FOLDER'],
+    app.config['OUTPUT_FOLDER'],
+    image_prep.PREP_DIR,
+    is_pending=is_pending,
+    on_evict=on_evicted,
+    # Sharded folders are listed through their index
+    stores={'input': inputs, 'output': outputs} if inputs.sharded else None
+)
+
+def on_retry_due(filename, path):
+    """Retry queue callback: put a failed file back in the work queue once its backoff ends"""
+    if inputs.exists(filename):
+        enqueue_input(filename)
+
+# Failed files wait here with backoff; those given up on go to the dead-letter list
+retries = retry_queue.RetryQueue(on_due=on_retry_due)
+
 # Supported file extensions
 SUPPORTED_EXTENSIONS = {'.pdf', '.docx', '.doc', '.txt', '.pptx', '.xlsx', '.epub', '.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff', '.webp'}
 
@@ -44,6 +185,27 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in [ext[1:] for ext in SUPPORTED_EXTENSIONS]
 
+def supported_inputs():
+    """Sizes of the stored input files the converter supports: {filename: bytes}"""
+    supported = file_to_md.supported_extensions()
+    return {entry['name']: entry['size'] for entry in inputs.list()
+            if os.path.splitext(entry['name'])[1].lower() in supported}
+
+def list_outputs():
+    """Stored markdown outputs as [{'name', 'size', 'modified'}]"""
+    if outputs.remote or outputs.sharded:
+        return [entry for entry in outputs.list() if entry['name'].endswith('.md')]
+    entries = []
+    # Outputs stored only compressed keep their .md name
+    for filename in output_store.list_markdown(app.config['OUTPUT_FOLDER']):
+        size, modified = output_store.stat_markdown(os.path.join(app.config['OUTPUT_FOLDER'], filename))
+        entries.append({'name': filename, 'size': size, 'modified': modified})
+    return entries
+
+def publish_output(output_filename):
+    """Record a markdown output just written (uploaded with remote storage, indexed when sharded)"""
+    output_store.publish(outputs, outputs.path(output_filename))
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -53,6 +215,23 @@ def health_check():
 def upload_file():
     """Upload file to InputFiles directory"""
     try:
+        try:
+            tenant = tenants.identify(request.headers)
+        except tenants.TenantError as e:
+            return jsonify({'error': str(e)}), e.status
+        
+        # Backpressure: refuse while the queue (or the tenant's share) is full, the disk is low or the API
+        # is throttled. Decided from the headers, before request.files makes Flask read the whole body
+        size = request.content_length or 0
+        refusal = admission_refusal(
+            incoming_files=1 if watcher.WATCH_INPUT_DIR else 0,
+            incoming_bytes=size if watcher.WATCH_INPUT_DIR else 0,
+            upload_bytes=size,
+            tenant=tenant
+        )
+        if refusal:
+            return refusal
+        
         if 'file' not in request.files:
             return jsonify({'error': 'No file part'}), 400
         
@@ -67,52 +246,115 @@ def upload_file():
             }), 400
         
         filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         
         # Check if file already exists
-        if os.path.exists(file_path):
+        if inputs.exists(filename):
             return jsonify({'error': 'File already exists'}), 409
         
+        # Optional explicit priority (higher is processed first), checked before anything is stored
+        priority = request.form.get('priority')
+        if priority is not None:
+            try:
+                priority = int(priority)
+            except ValueError:
+                return jsonify({'error': 'Priority must be an integer'}), 400
+        
+        file_path = inputs.target(filename)
         file.save(file_path)
+        inputs.publish(filename)
+        if priority is not None:
+            scheduler.set_priority([filename], priority)
+        tenants.assign([filename], tenant)
+        disk_janitor.wake()
+        
+        # Parse on arrival instead of waiting for a manual start
+        if watcher.WATCH_INPUT_DIR:
+            enqueue_input(filename)
         
         return jsonify({
             'message': 'File uploaded successfully',
             'filename': filename,
-            'size': os.path.getsize(file_path)
+            'tenant': tenant,
+            'size': os.path.getsize(file_path),
+            'preflight': preflight.analyze(file_path)
         }), 201
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/files/upload-bulk', methods=['POST'])
+def upload_files_bulk():
+    """Upload several files, or .zip/.tar.gz archives, in one request"""
+    try:
+        try:
+            tenant = tenants.identify(request.headers)
+        except tenants.TenantError as e:
+            return jsonify({'error': str(e)}), e.status
+        
+        # Decided from the headers before the body is read: the file count isn't known yet, so at least one
+        size = request.content_length or 0
+        refusal = admission_refusal(
+            incoming_files=1 if watcher.WATCH_INPUT_DIR else 0,
+            incoming_bytes=size if watcher.WATCH_INPUT_DIR else 0,
+            upload_bytes=size,
+            tenant=tenant
+        )
+        if refusal:
+            return refusal
+        
+        uploads = request.files.getlist('files')
+        if not uploads or all(upload.filename == '' for upload in uploads):
+            return jsonify({'error': 'No files selected'}), 400
+        
+        priority = request.form.get('priority')
+        if priority is not None:
+            try:
+                priority = int(priority)
+            except ValueError:
+                return jsonify({'error': 'Priority must be an integer'}), 400
+        
+        # Archives are extracted entry by entry from the spooled upload
+        extractor = bulk_upload.Extractor(app.config['UPLOAD_FOLDER'], allowed_file, store=inputs)
+        for upload in uploads:
+            if upload.filename:
+                extractor.add_upload(upload)
+        extractor.finish()
+        
+        # Every extracted entry counts towards the queue limits, not the archive as a single file
+        if watcher.WATCH_INPUT_DIR and extractor.saved:
+            sizes = {result['filename']: result['size'] for result in extractor.results
+                     if result['status'] == 'uploaded'}
+            count = admitted_entries([sizes[filename] for filename in extractor.saved], tenant)
+            extractor.withdraw(extractor.saved[count:], 'Cola de procesamiento llena')
+        
+        for filename in extractor.saved:
+            inputs.publish(filename)
+        if extractor.saved:
+            if priority is not None:
+                scheduler.set_priority(extractor.saved, priority)
+            tenants.assign(extractor.saved, tenant)
+            disk_janitor.wake()
+        for filename in extractor.saved:
+            if watcher.WATCH_INPUT_DIR:
+                enqueue_input(filename)
+        
+        return jsonify({
+            'message': f'{len(extractor.saved)} archivos subidos',
+            'uploaded': len(extractor.saved),
+            'tenant': tenant,
+            'total_bytes': extractor.total_bytes,
+            'results': extractor.results
+        }), 201 if extractor.saved else 400
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/files/list', methods=['GET'])
 def list_files():
     """List all files in InputFiles and OutputFiles directories"""
     try:
-        input_files = []
-        output_files = []
-        
-        # List input files
-        if os.path.exists(app.config['UPLOAD_FOLDER']):
-            for filename in os.listdir(app.config['UPLOAD_FOLDER']):
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                if os.path.isfile(file_path):
-                    input_files.append({
-                        'name': filename,
-                        'size': os.path.getsize(file_path),
-                        'modified': os.path.getmtime(file_path)
-                    })
-        
-        # List output files
-        if os.path.exists(app.config['OUTPUT_FOLDER']):
-            for filename in os.listdir(app.config['OUTPUT_FOLDER']):
-                if filename.endswith('.md'):
-                    file_path = os.path.join(app.config['OUTPUT_FOLDER'], filename)
-                    if os.path.isfile(file_path):
-                        output_files.append({
-                            'name': filename,
-                            'size': os.path.getsize(file_path),
-                            'modified': os.path.getmtime(file_path)
-                        })
+        input_files = list(inputs.list())
+        output_files = list_outputs()
         
         return jsonify({
             'input_files': sorted(input_files, key=lambda x: x['modified'], reverse=True),
@@ -126,12 +368,15 @@ def list_files():
 def delete_file(filename):
     """Delete file from InputFiles directory"""
     try:
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
-        if not os.path.exists(file_path):
+        if not inputs.delete(filename):
             return jsonify({'error': 'File not found'}), 404
         
-        os.remove(file_path)
+        work_queue.remove(filename)
+        retries.discard(filename)
+        if lease_store is not None:
+            lease_store.forget(filename)
+        scheduler.set_priority([filename], None)
+        tenants.assign([filename], None)
         
         return jsonify({'message': 'File deleted successfully'})
         
@@ -143,39 +388,66 @@ def start_processing():
     """Start processing files"""
     global processing_status
     
-    if processing_status['is_processing']:
-        return jsonify({'error': 'Processing already in progress'}), 409
+    try:
+        tenant = tenants.identify(request.headers)
+    except tenants.TenantError as e:
+        return jsonify({'error': str(e)}), e.status
     
     try:
-        # Get list of files to process
-        input_files = []
-        if os.path.exists(app.config['UPLOAD_FOLDER']):
-            for filename in os.listdir(app.config['UPLOAD_FOLDER']):
-                if allowed_file(filename):
-                    input_files.append(filename)
+        # Get list of the tenant's files to process
+        assignments = tenants.load_assignments()
+        sizes = {name: size for name, size in supported_inputs().items()
+                 if tenants.tenant_of(name, assignments) == tenant}
+        input_files = list(sizes)
         
         if not input_files:
             return jsonify({'error': 'No files to process'}), 400
         
-        # Start processing in background thread
-        processing_status.update({
-            'is_processing': True,
-            'current_file': None,
-            'progress': 0,
-            'total_files': len(input_files),
-            'processed_files': 0,
-            'errors': [],
-            'start_time': time.time(),
-            'end_time': None
-        })
+        # Backpressure on the files this request adds to the queue
+        new_files = [name for name in input_files if not is_pending(name)]
+        refusal = admission_refusal(
+            incoming_files=len(new_files),
+            incoming_bytes=sum(sizes[name] for name in new_files),
+            tenant=tenant
+        )
+        if refusal:
+            return refusal
         
-        thread = threading.Thread(target=process_files_background, args=(input_files,))
-        thread.daemon = True
-        thread.start()
+        priorities = scheduler.load_priorities()
+        if lease_store is not None:
+            # Fleet mode: the workers pick the files up from the lease store
+            for filename in input_files:
+                enqueue_fleet(filename, priorities)
+            return jsonify({
+                'message': 'Processing queued for workers',
+                'total_files': len(input_files),
+                'mode': PROCESSING_MODE
+            })
+        
+        # While a run is in progress only new or changed files join it, sharing
+        # the workers with the other tenants' files
+        if processing_status['is_processing']:
+            with status_lock:
+                active = set(processing_status['active_files'])
+            input_files = [name for name in new_files if name not in active and needs_processing(name)]
+            if not input_files:
+                return jsonify({'error': 'Processing already in progress'}), 409
+        
+        # Queue the files; the scheduler decides the order they run in
+        for filename in input_files:
+            work_queue.put(filename, inputs.path(filename), scheduler.priority_of(filename, priorities), tenant)
+        
+        if not start_worker():
+            return jsonify({
+                'message': 'Files queued in the running processing',
+                'total_files': len(input_files),
+                'tenant': tenant
+            }), 202
         
         return jsonify({
             'message': 'Processing started',
-            'total_files': len(input_files)
+            'total_files': len(input_files),
+            'tenant': tenant
         })
         
     except Exception as e:
@@ -184,7 +456,124 @@ def start_processing():
 @app.route('/api/process/status', methods=['GET'])
 def get_processing_status():
     """Get current processing status"""
-    return jsonify(processing_status)
+    if lease_store is not None:
+        return jsonify(fleet_status())
+    with status_lock:
+        if processing_status['is_processing'] and current_run is not None:
+            refresh_progress(current_run)
+        status = {**processing_status, 'queued_files': len(work_queue)}
+        status['active_pages'] = active_pages(processing_status['active_files'])
+        status['retrying'] = retries.waiting()
+        status['api_keys'] = key_pool.pool.stats()
+        status['tenants'] = tenant_stats.snapshot(work_queue.snapshot(), work_queue.active())
+        return jsonify(status)
+
+@app.route('/api/files/partial/<filename>', methods=['GET'])
+def tail_partial_output(filename):
+    """Follow a markdown output while it is converted (tail-style, from a byte offset).
+
+    Returns the pages appended to its .partial since `offset`; with `wait`
+    (seconds, at most 30) the request is held until new pages arrive.
+    'done' is true once the final .md has replaced the .partial.
+    """
+    try:
+        output_path = outputs.path(filename)
+        offset = max(0, request.args.get('offset', 0, type=int))
+        deadline = time.time() + min(max(0.0, request.args.get('wait', 0, type=float)), 30.0)
+        
+        while True:
+            partial = output_store.read_partial(output_path, offset)
+            if partial is None:
+                if output_store.exists(output_path):
+                    return jsonify({'file': filename, 'offset': offset, 'next_offset': offset,
+                                    'data': '', 'done': True})
+                return jsonify({'error': 'No hay conversión en curso para este archivo'}), 404
+            if partial['data'] or time.time() >= deadline:
+                return jsonify({'file': filename, **partial, 'done': False})
+            time.sleep(0.25)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Operational metrics: queue, workers and API key health"""
+    metrics = {
+        'queue': {
+            'queued_files': len(work_queue),
+            'active_files': len(processing_status['active_files']),
+            'max_concurrent_files': MAX_CONCURRENT_FILES
+        },
+        'api_keys': key_pool.pool.stats(),
+        'disk': disk_janitor.stats(),
+        'hedging': hedging.stats(),
+        'latency_model': planner.model_stats(),
+        'page_dedup': page_dedup.stats(),
+        'retries': retries.stats(),
+        'micro_batch': micro_batch.stats(),
+        'tenants': tenant_stats.snapshot(work_queue.snapshot(), work_queue.active())
+    }
+    if lease_store is not None:
+        metrics['fleet'] = lease_store.status()
+    return jsonify(metrics)
+
+@app.route('/api/process/plan', methods=['GET'])
+def plan_processing():
+    """Dry run: estimated duration and upstream credits of processing the input files"""
+    try:
+        input_files = list(supported_inputs())
+        if request.args.get('changed', 'false').lower() == 'true':
+            input_files = [name for name in input_files if needs_processing(name)]
+        
+        # Estimates read the files, so stored inputs are fetched to their working copies
+        input_files = [name for name in input_files if inputs.fetch(name)]
+        
+        # Same order the scheduler would run them in
+        ordered = scheduler.order_files(input_files, app.config['UPLOAD_FOLDER'], locate=inputs.path)
+        result = planner.plan(
+            [inputs.path(name) for name in ordered],
+            concurrency=MAX_CONCURRENT_FILES,
+            delay=1,  # worker pause between files
+            routing=request.args.get('routing', 'true').lower() == 'true'
+        )
+        if request.args.get('items', 'true').lower() != 'true':
+            result.pop('items')
+        return jsonify(result)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/process/dead-letter', methods=['GET'])
+def get_dead_letters():
+    """Files given up on (last error and attempts) and the retries still waiting"""
+    return jsonify({
+        'dead_letters': retries.dead_letters(),
+        'retrying': retries.waiting(),
+        'max_attempts': retry_queue.RETRY_MAX_ATTEMPTS
+    })
+
+@app.route('/api/process/requeue', methods=['POST'])
+def requeue_dead_letters():
+    """Queue dead-lettered files again with a fresh attempt count (body {"files": [...]}, all if omitted)"""
+    try:
+        data = request.get_json(silent=True) or {}
+        requeued = retries.requeue(data.get('files'))
+        if not requeued:
+            return jsonify({'error': 'No hay archivos en la lista de fallidos para reencolar'}), 404
+        
+        missing = [name for name in requeued if not inputs.exists(name)]
+        for filename in requeued:
+            if filename not in missing:
+                enqueue_input(filename)
+        
+        return jsonify({
+            'message': f'Se reencolaron {len(requeued) - len(missing)} archivos',
+            'requeued': [name for name in requeued if name not in missing],
+            'missing': missing
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/api/process/consolidate', methods=['POST'])
 def consolidate_files():
@@ -193,11 +582,29 @@ def consolidate_files():
         if processing_status['is_processing']:
             return jsonify({'error': 'Cannot consolidate while processing'}), 409
         
+        # Outputs converted on other nodes are downloaded to the working cache first
+        paths = {}
+        for entry in list_outputs():
+            path = outputs.path(entry['name'])
+            if outputs.remote and not output_store.exists(path):
+                path = outputs.fetch(entry['name'])
+            if path:
+                paths[entry['name']] = path
+        
         # Run consolidation
-        success = consolidar_md.consolidar_markdowns(
-            app.config['OUTPUT_FOLDER'],
-            os.path.join(app.config['OUTPUT_FOLDER'], 'Consolidated.md')
-        )
+        consolidated_path = os.path.join(app.config['OUTPUT_FOLDER'], 'Consolidated.md')
+        success = consolidar_md.consolidar_markdowns(app.config['OUTPUT_FOLDER'], consolidated_path, rutas=paths)
+        
+        if success and outputs.remote:
+            # Shared with the other nodes: the shard(s) and their index
+            index_path = consolidar_md.ruta_indice(consolidated_path)
+            shards = consolidar_md.cargar_indice(consolidated_path)['fragmentos']
+            for name in shards:
+                outputs.publish(name)
+            outputs.publish(os.path.basename(index_path))
+            for entry in list_outputs():
+                if consolidar_md.es_salida_consolidada(entry['name'], consolidated_path) and entry['name'] not in shards:
+                    outputs.delete(entry['name'])
         
         if success:
             return jsonify({'message': 'Files consolidated successfully'})
@@ -207,145 +614,450 @@ def consolidate_files():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def load_consolidated_index():
+    """Index of the consolidation, refreshed from the object store when it may come from another node"""
+    consolidated_path = os.path.join(app.config['OUTPUT_FOLDER'], 'Consolidated.md')
+    if outputs.remote:
+        outputs.fetch(os.path.basename(consolidar_md.ruta_indice(consolidated_path)))
+    return consolidar_md.cargar_indice(consolidated_path)
+
+@app.route('/api/consolidated/index', methods=['GET'])
+def get_consolidated_index():
+    """Get the table of contents (shard and byte range of each source) of the consolidation"""
+    try:
+        index = load_consolidated_index()
+        if index is None:
+            return jsonify({'error': 'No hay consolidación disponible'}), 404
+        return jsonify(index)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/consolidated/section/<filename>', methods=['GET'])
+def get_consolidated_section(filename):
+    """Serve a single source document out of the (possibly sharded) consolidation"""
+    try:
+        index = load_consolidated_index()
+        if outputs.remote and index is not None:
+            # Only the shard holding the section is downloaded
+            for section in index['secciones']:
+                if section['fuente'] == filename:
+                    outputs.fetch(section['fragmento'])
+                    break
+        content = consolidar_md.leer_seccion(
+            os.path.join(app.config['OUTPUT_FOLDER'], 'Consolidated.md'),
+            filename
+        )
+        if content is None:
+            return jsonify({'error': 'Sección no encontrada en la consolidación'}), 404
+        return app.response_class(content, mimetype='text/markdown')
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/files/download/<filename>', methods=['GET'])
 def download_file(filename):
-    """Download file from OutputFiles directory"""
+    """Download file from OutputFiles directory.
+
+    Serves a precompressed sidecar with Content-Encoding when the client accepts it,
+    with a strong content ETag so If-None-Match and Range requests are honoured.
+    """
     try:
-        file_path = os.path.join(app.config['OUTPUT_FOLDER'], filename)
+        file_path = outputs.path(filename)
         
-        if not os.path.exists(file_path):
+        if not output_store.exists(file_path):
+            if outputs.remote and outputs.exists(filename):
+                # Converted on another node: stream it from the object store
+                response = app.response_class(storage.iter_chunks(outputs.open(filename)),
+                                              mimetype='text/markdown')
+                response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+                return response
             return jsonify({'error': 'File not found'}), 404
+        disk_janitor.touch(file_path)
+        
+        serve_path, encoding = output_store.choose_representation(file_path, request.accept_encodings)
+        if serve_path is None:
+            # Only a compressed copy exists and the client can't decode it
+            content = output_store.read_markdown(file_path).encode('utf-8')
+            etag = hashlib.sha256(content).hexdigest()[:32]
+            response = send_file(
+                io.BytesIO(content),
+                mimetype='text/markdown',
+                as_attachment=True,
+                download_name=filename,
+                etag=etag
+            )
+        else:
+            response = send_file(
+                os.path.abspath(serve_path),
+                mimetype='text/markdown',
+                as_attachment=True,
+                download_name=filename,
+                etag=output_store.strong_etag(serve_path)
+            )
+            if encoding and response.status_code != 304:
+                response.headers['Content-Encoding'] = encoding
         
-        return send_file(file_path, as_attachment=True)
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-def process_files_background(input_files):
-    """Process files in background thread with real-time progress updates"""
+def start_worker():
+    """Start the background worker unless it is already running.
+
+    Returns True if a new processing run was started.
+    """
     global processing_status
     
-    try:
-        # Initialize processing state
+    with worker_lock:
+        if processing_status['is_processing'] or not len(work_queue):
+            return False
+        
         processing_status.update({
+            'is_processing': True,
             'current_file': 'Iniciando procesamiento...',
             'progress': 0,
-            'total_files': len(input_files),
-            'processed_files': 0
+            'total_files': len(work_queue),
+            'processed_files': 0,
+            'total_pages': work_queue.pending_pages(),
+            'processed_pages': 0,
+            'pages_reused': 0,
+            'bytes_saved': 0,
+            'estimated_work_seconds': work_queue.pending_work(planner.work),
+            'eta_seconds': None,
+            'file_results': {},
+            'active_files': [],
+            'errors': [],
+            'start_time': time.time(),
+            'end_time': None
         })
         
-        # Get supported files from input directory
-        input_files_to_process = file_to_md.get_supported_files(file_to_md.input_dir)
+        thread = threading.Thread(target=process_files_background)
+        thread.daemon = True
+        thread.start()
+        return True
+
+def needs_processing(filename):
+    """Check if an input has no output yet or changed after its output was written"""
+    output_filename = f"{os.path.splitext(filename)[0]}.md"
+    if outputs.remote:
+        output_info = outputs.stat(output_filename)
+        output_modified = output_info and output_info['modified']
+    else:
+        output_path = outputs.path(output_filename)
+        output_modified = output_store.exists(output_path) and output_store.stat_markdown(output_path)[1]
+    if not output_modified:
+        return True
+    input_info = inputs.stat(filename)
+    return input_info is not None and input_info['modified'] > output_modified
+
+def enqueue_fleet(filename, priorities=None):
+    """Queue an input file in the shared lease store for the worker fleet"""
+    lease_store.enqueue(filename,
+                        priority=scheduler.priority_of(filename, priorities),
+                        size=inputs.stat(filename)['size'])
+
+def fleet_status():
+    """Processing status built from the lease store (same shape as the local status)"""
+    fleet = lease_store.status()
+    counts = fleet['counts']
+    total_files = sum(counts.values())
+    finished = counts['done'] + counts['failed']
+    active_files = [lease['file'] for lease in fleet['leases']]
+    is_processing = bool(counts['pending'] or counts['leased'])
+    
+    if active_files:
+        current_file = active_files[0]
+    elif is_processing:
+        current_file = f"{counts['pending']} archivos en espera de un worker"
+    else:
+        current_file = 'Procesamiento completado' if total_files else None
+    
+    return {
+        'is_processing': is_processing,
+        'current_file': current_file,
+        'progress': (finished / total_files) * 100 if total_files else 0,
+        'total_files': total_files,
+        'processed_files': counts['done'],
+        'active_files': active_files,
+        'errors': fleet['errors'],
+        'queued_files': counts['pending'],
+        'mode': PROCESSING_MODE,
+        'fleet': fleet,
+        'start_time': None,
+        'end_time': None
+    }
+
+def enqueue_input(filename):
+    """Queue an input file and make sure a worker picks it up"""
+    if lease_store is not None:
+        enqueue_fleet(filename)
+        return
+    work_queue.put(filename, inputs.path(filename), tenant=tenants.tenant_of(filename))
+    start_worker()
+
+def on_input_ready(filename):
+    """Watcher callback: queue new or changed supported files as they land"""
+    if os.path.splitext(filename)[1].lower() not in file_to_md.supported_extensions():
+        return
+    # Uploads are queued by their endpoint: don't queue them (or files being converted) a second time
+    with status_lock:
+        converting = filename in processing_status['active_files']
+    if converting or is_pending(filename):
+        return
+    if needs_processing(filename):
+        enqueue_input(filename)
+
+def start_watcher():
+    """Start watching the input folder if WATCH_INPUT_DIR is enabled"""
+    global folder_watcher
+    
+    if watcher.WATCH_INPUT_DIR and folder_watcher is None:
+        folder_watcher = watcher.FolderWatcher(app.config['UPLOAD_FOLDER'], on_input_ready).start()
+        print(f"👀 Vigilando {app.config['UPLOAD_FOLDER']} ({folder_watcher.mode})")
+
+def record_error(filename, error):
+    """Append an error to the processing status"""
+    with status_lock:
+        processing_status['errors'].append({
+            'file': filename,
+            'error': error
+        })
+
+def active_pages(filenames):
+    """Pages streamed so far of the files being converted: {filename: {'done', 'total'}}"""
+    pages = {}
+    for filename in filenames:
+        output_path = outputs.path(f"{os.path.splitext(filename)[0]}.md")
+        progress = output_store.partial_progress(output_path)
+        if progress is not None:
+            pages[filename] = {'done': progress[0], 'total': progress[1]}
+    return pages
+
+def refresh_progress(run):
+    """Update progress and ETA weighted by estimated work, not file count (hold status_lock)"""
+    now = time.time()
+    # Observed seconds per estimated second in this run corrects the model's estimates
+    speed = (run['actual_done'] / run['work_done'] if run['work_done'] else 1.0) or 1.0
+    running = list(run['running'].values())
+    pages = active_pages(run['running'])
+    total = run['work_done'] + sum(work for _, work in running) + work_queue.pending_work(planner.work)
+    done = run['work_done']
+    for filename, (started, work) in run['running'].items():
+        # The larger of elapsed time and pages already streamed, never the whole file before it ends
+        streamed = pages[filename]['done'] / pages[filename]['total'] if pages.get(filename, {}).get('total') else 0
+        done += min(max((now - started) / speed, work * streamed), work * planner.MAX_PARTIAL)
+    processing_status.update({
+        'progress': max(processing_status['progress'], (done / total) * 90) if total else 90,  # Reserve 10% for completion
+        'estimated_work_seconds': round(total * speed, 1),
+        'eta_seconds': planner.eta(total - done, planner.parallelism(MAX_CONCURRENT_FILES), speed)
+    })
+
+def record_failure(job, error, rate_limited=False):
+    """Report a failed attempt and hand the file to the retry queue"""
+    error_class, delay = retries.failed(job['filename'], job['path'], error, rate_limited)
+    if delay is not None:
+        record_error(job['filename'], f"{error} (reintento en {delay:.0f}s)")
+    else:
+        record_error(job['filename'], str(error) if error_class == retry_queue.PERMANENT
+                     else f"{error} (sin más reintentos)")
+
+def output_name(filename):
+    return f"{os.path.splitext(filename)[0]}.md"
+
+def finish_job(job, result):
+    """Record a file's conversion result (or the exception it raised). Returns 'ok', 'failed' or 'rate_limited'"""
+    filename = job['filename']
+    
+    if isinstance(result, preflight.PreflightError):
+        # Rejected locally before any upstream call: permanent, straight to the dead-letter list
+        record_failure(job, result)
+        return 'failed'
+    
+    if isinstance(result, Exception):
+        rate_limited = file_to_md.is_rate_limit_error(result)
+        record_failure(job, result, rate_limited)
+        return 'rate_limited' if rate_limited else 'failed'
+    
+    with status_lock:
+        processing_status['processed_pages'] += result['pages']
+        processing_status['pages_reused'] += result['pages_reused']
+        processing_status['bytes_saved'] += result['bytes_saved']
+        processing_status['file_results'][filename] = {
+            'pages': result['pages'],
+            'bytes_saved': result['bytes_saved'],
+            'routing': result['routing']
+        }
+    
+    # Verify file was created and has content
+    if not result['has_content']:
+        record_failure(job, retry_queue.EmptyOutputError('Archivo creado pero está vacío'))
+        return 'failed'
+    try:
+        publish_output(output_name(filename))
+    except Exception as e:
+        record_failure(job, e)
+        return 'failed'
+    retries.succeeded(filename)
+    return 'ok'
+
+def process_job(job):
+    """Convert one queued file. Returns 'ok', 'failed' or 'rate_limited'"""
+    try:
+        # Preflight, parse and write the markdown (and compressed sidecar if enabled)
+        result = file_to_md.convert_file(job['path'], outputs.target(output_name(job['filename'])))
+    except Exception as e:
+        result = e
+    return finish_job(job, result)
+
+def process_batch(jobs):
+    """Convert small queued files with one composite parse. Returns {filename: outcome}"""
+    try:
+        results = file_to_md.convert_batch(
+            [(job['path'], outputs.target(output_name(job['filename']))) for job in jobs])
+    except Exception as e:
+        results = {job['path']: e for job in jobs}
+    return {job['filename']: finish_job(job, results[job['path']]) for job in jobs}
+
+def take_companions(job):
+    """Queued small files that can share job's composite parse (hold disk_janitor.lock)"""
+    group = job['group']
+    if group is None:
+        return []
+    batch = {'files': 1, 'bytes': job['size']}
+    
+    def accept(candidate):
+        if (candidate['group'] != group
+                or candidate['tenant'] != job['tenant']
+                or not micro_batch.fits(group, batch['files'], batch['bytes'], candidate['size'])):
+            return False
+        batch['files'] += 1
+        batch['bytes'] += candidate['size']
+        return True
+    
+    return work_queue.take(accept, micro_batch.MICRO_BATCH_MAX_FILES - 1, micro_batch.MICRO_BATCH_SCAN_JOBS)
+
+def worker_loop(run):
+    """Worker thread: take jobs from the queue until it is empty or the run stops"""
+    while processing_status['is_processing'] and not run['stop'].is_set():
+        # Taking a job and holding it against eviction happen atomically
+        with disk_janitor.lock:
+            job = work_queue.get(block=False)
+            if job is not None:
+                # Small files next in line ride along in one composite parse (MICRO_BATCH_ENABLED)
+                jobs = [job] + take_companions(job)
+                for queued in jobs:
+                    disk_janitor.hold(queued['filename'])
+        if job is None:
+            if not len(work_queue):
+                return
+            # Every tenant with queued files is at its TENANT_MAX_ACTIVE cap: wait for a slot
+            work_queue.wait(1)
+            continue
+        filename = job['filename']
+        for queued in jobs:
+            tenant_stats.started(queued['tenant'], time.time() - queued['enqueued_at'])
+        
+        # Stored inputs are converted from a local working copy
+        if inputs.remote:
+            try:
+                job['path'] = inputs.fetch(filename) or job['path']
+            except Exception as e:
+                print(f"⚠️  No se pudo descargar {filename}: {e}")
         
-        if not input_files_to_process:
+        for queued in jobs:
+            if queued.get('work') is None:
+                queued['work'] = planner.work(queued['path'])
+        
+        with status_lock:
+            run['started'] += len(jobs)
+            for queued in jobs:
+                run['running'][queued['filename']] = (time.time(), queued['work'])
+                processing_status['active_files'].append(queued['filename'])
+            total_files = run['started'] + len(work_queue)  # Files may be queued while running
             processing_status.update({
-                'current_file': 'No hay archivos para procesar',
-                'errors': [{'file': 'system', 'error': 'No se encontraron archivos válidos para procesar'}]
+                'current_file': filename if len(jobs) == 1 else f"{filename} (+{len(jobs) - 1} en el mismo lote)",
+                'total_files': total_files,
+                'total_pages': processing_status['processed_pages'] + work_queue.pending_pages(*jobs)
             })
+            refresh_progress(run)
+        
+        try:
+            outcomes = process_batch(jobs) if len(jobs) > 1 else {filename: process_job(job)}
+        finally:
+            work_queue.done(job)
+            for queued in jobs:
+                disk_janitor.release(queued['filename'])
+        
+        with status_lock:
+            for queued in jobs:
+                tenant_stats.finished(queued['tenant'], outcomes[queued['filename']] == 'ok')
+            for queued_filename, outcome in outcomes.items():
+                run['finished'] += 1
+                started, work = run['running'].pop(queued_filename)
+                run['work_done'] += work
+                run['actual_done'] += time.time() - started
+                processing_status['active_files'].remove(queued_filename)
+                if outcome == 'ok':
+                    processing_status['processed_files'] += 1
+                else:
+                    run['failed'] += 1
+            refresh_progress(run)
+        
+        # Every key is throttled: stop the run; the file's retry restarts it once the keys cool down
+        if 'rate_limited' in outcomes.values():
+            processing_status['current_file'] = 'Error de límite de API detectado - Deteniendo procesamiento'
+            record_error('system', 'Límite de API excedido en todas las keys. El procesamiento se reanuda con el reintento programado.')
+            run['stop'].set()
             return
         
-        # Update total files count
-        processing_status['total_files'] = len(input_files_to_process)
-        processing_status['current_file'] = f'Procesando {len(input_files_to_process)} archivos...'
+        # Small delay to prevent overwhelming the system and API
+        time.sleep(1)
+
+def process_files_background():
+    """Process queued files with MAX_CONCURRENT_FILES worker threads and real-time progress updates"""
+    global processing_status, current_run
+    
+    run = {'stop': threading.Event(), 'started': 0, 'finished': 0, 'failed': 0,
+           'running': {}, 'work_done': 0.0, 'actual_done': 0.0}
+    current_run = run
+    try:
+        processing_status['current_file'] = f'Procesando {len(work_queue)} archivos...'
         processing_status['progress'] = 5
         
-        # Process files one by one with progress tracking
-        successful_files = 0
-        failed_files = []
-        
-        for i, filename in enumerate(input_files_to_process, 1):
-            if not processing_status['is_processing']:
-                break
-                
-            processing_status.update({
-                'current_file': filename,
-                'progress': (i / len(input_files_to_process)) * 90,  # Reserve 10% for completion
-                'processed_files': i - 1
-            })
-            
-            try:
-                # Process single file using file_to_md logic
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                
-                # Use LlamaParse directly
-                documents = file_to_md.LlamaParse(
-                    result_type="markdown",
-                    auto_mode=True,
-                    auto_mode_trigger_on_image_in_page=True,
-                    auto_mode_trigger_on_table_in_page=True,
-                ).load_data(file_path)
-                
-                # Generate output file path
-                input_filename = os.path.splitext(filename)[0]
-                output_filename = f"{input_filename}.md"
-                output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
-                
-                # Combine all document content into markdown format
-                markdown_content = ""
-                for j, doc in enumerate(documents):
-                    if j > 0:
-                        markdown_content += "\n\n---\n\n"
-                    markdown_content += doc.text
-                
-                # Write markdown content to output file
-                with open(output_path, 'w', encoding='utf-8') as f:
-                    f.write(markdown_content)
-                
-                # Verify file was created and has content
-                if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-                    successful_files += 1
-                    processing_status['processed_files'] = successful_files
-                else:
-                    failed_files.append(filename)
-                    processing_status['errors'].append({
-                        'file': filename,
-                        'error': 'Archivo creado pero está vacío'
-                    })
-                
-            except Exception as e:
-                error_msg = str(e)
-                failed_files.append(filename)
-                processing_status['errors'].append({
-                    'file': filename,
-                    'error': error_msg
-                })
-                
-                # Check for rate limiting errors
-                if file_to_md.is_rate_limit_error(e):
-                    processing_status.update({
-                        'current_file': 'Error de límite de API detectado - Deteniendo procesamiento',
-                        'errors': processing_status['errors'] + [{
-                            'file': 'system',
-                            'error': 'Límite de API excedido. Espera 15-30 minutos antes de reintentar.'
-                        }]
-                    })
-                    break
-            
-            # Small delay to prevent overwhelming the system and API
-            time.sleep(1)
+        workers = [
+            threading.Thread(target=worker_loop, args=(run,), daemon=True)
+            for _ in range(max(1, MAX_CONCURRENT_FILES))
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
         
         # Final status update
         processing_status.update({
             'current_file': 'Procesamiento completado',
             'progress': 100,
-            'processed_files': successful_files
+            'eta_seconds': 0
         })
         
-        if failed_files:
-            processing_status['current_file'] = f'Completado con {len(failed_files)} errores'
+        if run['failed']:
+            processing_status['current_file'] = f'Completado con {run["failed"]} errores'
         
     except Exception as e:
-        processing_status.update({
-            'current_file': 'Error en procesamiento',
-            'errors': processing_status['errors'] + [{
-                'file': 'system',
-                'error': f"Error crítico: {str(e)}"
-            }]
-        })
+        record_error('system', f"Error crítico: {str(e)}")
+        processing_status['current_file'] = 'Error en procesamiento'
     
     finally:
-        processing_status['is_processing'] = False
-        processing_status['end_time'] = time.time()
+        with worker_lock:
+            processing_status['is_processing'] = False
+            processing_status['end_time'] = time.time()
+        
+        # Files queued while this run was finishing start a new run
+        if not run['stop'].is_set():
+            start_worker()
 
 @app.route('/api/files/download-all', methods=['GET'])
 def download_all_processed_files():
@@ -358,7 +1070,7 @@ def download_all_processed_files():
         if not os.path.exists(app.config['OUTPUT_FOLDER']):
             return jsonify({'error': 'No hay archivos procesados'}), 404
         
-        output_files = [f for f in os.listdir(app.config['OUTPUT_FOLDER']) if f.endswith('.md')]
+        output_files = [entry['name'] for entry in list_outputs()]
         
         if not output_files:
             return jsonify({'error': 'No hay archivos procesados para descargar'}), 404
@@ -367,8 +1079,15 @@ def download_all_processed_files():
         zip_buffer = io.BytesIO()
         with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
             for filename in output_files:
-                file_path = os.path.join(app.config['OUTPUT_FOLDER'], filename)
-                zip_file.write(file_path, filename)
+                file_path = outputs.path(filename)
+                if outputs.remote:
+                    # Streamed from the object store into the archive
+                    with outputs.open(filename) as source, zip_file.open(filename, 'w') as target:
+                        shutil.copyfileobj(source, target, storage.CHUNK_SIZE)
+                elif os.path.isfile(file_path):
+                    zip_file.write(file_path, filename)
+                else:
+                    zip_file.writestr(filename, output_store.read_markdown(file_path))
         
         zip_buffer.seek(0)
         
@@ -389,7 +1108,7 @@ def delete_all_input_files():
         if not os.path.exists(app.config['UPLOAD_FOLDER']):
             return jsonify({'error': 'No hay archivos de entrada'}), 404
         
-        input_files = [f for f in os.listdir(app.config['UPLOAD_FOLDER']) if os.path.isfile(os.path.join(app.config['UPLOAD_FOLDER'], f))]
+        input_files = [entry['name'] for entry in inputs.list()]
         
         if not input_files:
             return jsonify({'error': 'No hay archivos de entrada para borrar'}), 404
@@ -397,12 +1116,12 @@ def delete_all_input_files():
         deleted_count = 0
         for filename in input_files:
             try:
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                os.remove(file_path)
+                inputs.delete(filename)
                 deleted_count += 1
             except Exception as e:
                 # Continue with other files even if one fails
                 continue
+        tenants.assign(input_files, None)
         
         return jsonify({
             'message': f'Se borraron {deleted_count} archivos de entrada',
@@ -416,12 +1135,13 @@ def delete_all_input_files():
 def delete_output_file(filename):
     """Delete processed file from OutputFiles directory"""
     try:
-        file_path = os.path.join(app.config['OUTPUT_FOLDER'], filename)
+        file_path = outputs.path(filename)
         
-        if not os.path.exists(file_path):
+        removed = output_store.remove_markdown(file_path)
+        removed = outputs.delete(filename) or removed
+        if not removed:
             return jsonify({'error': 'Archivo procesado no encontrado'}), 404
-        
-        os.remove(file_path)
+        chunk_export.remove(file_path)
         
         return jsonify({'message': 'Archivo procesado eliminado exitosamente'})
         
@@ -435,8 +1155,7 @@ def delete_all_output_files():
         if not os.path.exists(app.config['OUTPUT_FOLDER']):
             return jsonify({'error': 'No hay archivos procesados'}), 404
         
-        output_files = [f for f in os.listdir(app.config['OUTPUT_FOLDER']) 
-                       if f.endswith('.md') and os.path.isfile(os.path.join(app.config['OUTPUT_FOLDER'], f))]
+        output_files = [entry['name'] for entry in list_outputs()]
         
         if not output_files:
             return jsonify({'error': 'No hay archivos procesados para borrar'}), 404
@@ -444,8 +1163,10 @@ def delete_all_output_files():
         deleted_count = 0
         for filename in output_files:
             try:
-                file_path = os.path.join(app.config['OUTPUT_FOLDER'], filename)
-                os.remove(file_path)
+                file_path = outputs.path(filename)
+                output_store.remove_markdown(file_path)
+                outputs.delete(filename)
+                chunk_export.remove(file_path)
                 deleted_count += 1
             except Exception as e:
                 # Continue with other files even if one fails
@@ -460,4 +1181,11 @@ def delete_all_output_files():
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
+    # With the debug reloader only the child process (WERKZEUG_RUN_MAIN) serves requests
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_watcher()
+        disk_janitor.start()
     app.run(debug=True, host='0.0.0.0', port=5000)
+else:
+    start_watcher()
+    disk_janitor.start()
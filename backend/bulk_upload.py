@@ -0,0 +1,187 @@
+import os
+import tarfile
+import zipfile
+import tempfile
+from werkzeug.utils import secure_filename
+import preflight
+import storage
+
+# Zip-bomb limits applied to every archive entry while it is extracted
+BULK_MAX_ENTRIES = int(os.getenv("BULK_MAX_ENTRIES", "5000"))
+BULK_MAX_ENTRY_SIZE = int(os.getenv("BULK_MAX_ENTRY_SIZE", str(preflight.MAX_FILE_SIZE)))
+BULK_MAX_TOTAL_SIZE = int(os.getenv("BULK_MAX_TOTAL_SIZE", str(2 * 1024 * 1024 * 1024)))
+# Largest uncompressed/compressed size ratio accepted for a zip entry
+BULK_MAX_COMPRESSION_RATIO = int(os.getenv("BULK_MAX_COMPRESSION_RATIO", "100"))
+
+ARCHIVE_SUFFIXES = ('.zip', '.tar.gz', '.tgz')
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+class EntryTooLarge(Exception):
+    """An entry went over a size limit while being copied."""
+
+
+def is_archive(filename):
+    """Check if an upload is an archive to be extracted."""
+    return filename.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+class Extractor:
+    """Save uploaded files and archive entries into the input folder.
+
+    Every entry goes through secure_filename and the extension filter, is
+    copied in chunks (never held in memory) to a temporary file in the
+    destination and renamed into place only once all limits were respected.
+    Names already taken are looked up in the input storage (store), so a
+    remote input is never overwritten by its local working copy.
+    Results are collected per entry in `results`, tagged with the upload
+    (`source`) they came from. Once BULK_MAX_ENTRIES entries were taken
+    the rest are not read at all: finish() reports them in one result.
+    """
+
+    def __init__(self, dest_dir, allowed, store=None):
+        self.dest_dir = dest_dir
+        self.allowed = allowed
+        self.store = store or storage.LocalStorage(dest_dir)
+        self.results = []
+        self.saved = []
+        self.total_bytes = 0
+        self.entries = 0
+        self.skipped = 0
+        self.truncated = []  # archives whose remaining entries were not read
+        self.source = None
+
+    @property
+    def full(self):
+        return self.entries >= BULK_MAX_ENTRIES
+
+    def _result(self, entry, status, filename=None, error=None, size=None):
+        result = {'source': self.source, 'entry': entry, 'status': status}
+        if filename:
+            result['filename'] = filename
+        if size is not None:
+            result['size'] = size
+        if error:
+            result['error'] = error
+        self.results.append(result)
+        return result
+
+    def _copy(self, source, target, limit):
+        copied = 0
+        with open(target, 'wb') as out:
+            while True:
+                chunk = source.read(_CHUNK_SIZE)
+                if not chunk:
+                    return copied
+                copied += len(chunk)
+                if copied > limit:
+                    raise EntryTooLarge(f"supera el límite de {limit} bytes")
+                out.write(chunk)
+
+    def add(self, entry, source, compressed_size=None):
+        """Save one entry from a readable stream. Returns its result dict (None once full)."""
+        if self.full:
+            self.skipped += 1
+            return None
+        self.entries += 1
+
+        filename = secure_filename(os.path.basename(entry.replace('\\', '/')))
+        if not filename:
+            return self._result(entry, 'rejected', error='Nombre de archivo inválido')
+        if not self.allowed(filename):
+            return self._result(entry, 'skipped', filename, error='File type not supported')
+
+        if filename in self.saved or self.store.exists(filename):
+            return self._result(entry, 'exists', filename, error='File already exists')
+
+        limit = min(BULK_MAX_ENTRY_SIZE, BULK_MAX_TOTAL_SIZE - self.total_bytes)
+        if compressed_size:
+            limit = min(limit, max(compressed_size, 1) * BULK_MAX_COMPRESSION_RATIO)
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.dest_dir, prefix='.bulk-')
+        os.close(fd)
+        try:
+            size = self._copy(source, tmp_path, limit)
+            os.replace(tmp_path, self.store.target(filename))
+        except EntryTooLarge as e:
+            os.remove(tmp_path)
+            return self._result(entry, 'rejected', filename, error=f'Entrada demasiado grande: {e}')
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+        self.total_bytes += size
+        self.saved.append(filename)
+        return self._result(entry, 'uploaded', filename, size=size)
+
+    def add_zip(self, fileobj):
+        """Extract a zip entry by entry (zipfile reads the spooled upload, not memory)."""
+        with zipfile.ZipFile(fileobj) as archive:
+            infos = [info for info in archive.infolist() if not info.is_dir()]
+            for position, info in enumerate(infos):
+                if self.full:
+                    self.skipped += len(infos) - position
+                    break
+                if info.flag_bits & 0x1:
+                    self._result(info.filename, 'rejected', error='Entrada cifrada')
+                    continue
+                # The declared size is checked up front; _copy enforces the real one
+                if info.file_size > BULK_MAX_ENTRY_SIZE:
+                    self._result(info.filename, 'rejected', error='Entrada demasiado grande')
+                    continue
+                with archive.open(info) as source:
+                    self.add(info.filename, source, compressed_size=info.compress_size)
+
+    def add_tar(self, fileobj):
+        """Extract a tar.gz as a stream (mode "r|gz": no seeking, single pass)."""
+        with tarfile.open(fileobj=fileobj, mode='r|gz') as archive:
+            for member in archive:
+                if not member.isfile():
+                    continue  # directories, links and devices are never written
+                if self.full:
+                    # Counting the rest would mean decompressing it: stop here
+                    self.skipped += 1
+                    self.truncated.append(self.source)
+                    break
+                if member.size > BULK_MAX_ENTRY_SIZE:
+                    self._result(member.name, 'rejected', error='Entrada demasiado grande')
+                    continue
+                source = archive.extractfile(member)
+                self.add(member.name, source)
+
+    def add_upload(self, storage):
+        """Save a werkzeug FileStorage, extracting it first if it is an archive."""
+        name = storage.filename or ''
+        self.source = name
+        if not is_archive(name):
+            return self.add(name, storage.stream)
+        try:
+            if name.lower().endswith('.zip'):
+                self.add_zip(storage.stream)
+            else:
+                self.add_tar(storage.stream)
+        except (zipfile.BadZipFile, tarfile.TarError, EOFError, OSError) as e:
+            self._result(name, 'rejected', error=f'Archivo comprimido inválido: {e}')
+
+    def withdraw(self, filenames, error):
+        """Remove saved entries again (e.g. refused by the queue limits), marking their results rejected."""
+        filenames = set(filenames)
+        for result in self.results:
+            if result['status'] == 'uploaded' and result.get('filename') in filenames:
+                os.remove(self.store.target(result['filename']))
+                result.update(status='rejected', error=error)
+                self.total_bytes -= result['size']
+        self.saved = [filename for filename in self.saved if filename not in filenames]
+
+    def finish(self):
+        """Add the summary result of the entries left out by BULK_MAX_ENTRIES, if any."""
+        if not self.skipped:
+            return
+        error = f'Más de {BULK_MAX_ENTRIES} archivos en la solicitud: {self.skipped} no se procesaron'
+        if self.truncated:
+            error += f" (y el resto de {', '.join(self.truncated)})"
+        self.source = None
+        result = self._result(None, 'rejected', error=error)
+        result['skipped'] = self.skipped
+
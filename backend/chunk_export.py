@@ -0,0 +1,312 @@
+import os
+import re
+import sys
+import json
+import hashlib
+import threading
+import output_store
+import storage
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # without pyarrow only JSONL is written
+    pa = None
+    pq = None
+
+try:
+    import tiktoken
+except ImportError:  # without tiktoken token counts are estimated
+    tiktoken = None
+
+# Chunk formats written after each conversion: comma separated "jsonl", "parquet", "arrow" (empty disables)
+CHUNK_EXPORT = [fmt.strip() for fmt in os.getenv("CHUNK_EXPORT", "").lower().split(',') if fmt.strip()]
+# "page" (one chunk per page) or "heading" (pages split further at markdown headings)
+CHUNK_BY = os.getenv("CHUNK_BY", "page").lower()
+# Where chunk files go (mirroring the output tree); by default a chunks/ folder next to each markdown output
+CHUNK_DIR = os.getenv("CHUNK_DIR", "")
+CHUNK_TOKEN_ENCODING = os.getenv("CHUNK_TOKEN_ENCODING", "cl100k_base")
+# Chunks per write call
+CHUNK_BATCH_SIZE = int(os.getenv("CHUNK_BATCH_SIZE", "500"))
+
+# Same page separator as file_to_md.documents_to_markdown
+PAGE_SEPARATOR = "\n\n---\n\n"
+CHANGES_FILE = "_changes.jsonl"
+
+_HEADING_RE = re.compile(r'^#{1,6}\s+(.+?)\s*#*\s*$', re.MULTILINE)
+
+_encoder = None
+_warned = set()
+_encoder_lock = threading.Lock()
+_changes_lock = threading.Lock()
+
+
+def _get_encoder():
+    global _encoder
+    with _encoder_lock:
+        if _encoder is None:
+            _encoder = False
+            if tiktoken is not None:
+                try:
+                    _encoder = tiktoken.get_encoding(CHUNK_TOKEN_ENCODING)
+                except Exception as e:
+                    print(f"⚠️  No se pudo cargar la codificación {CHUNK_TOKEN_ENCODING}: {e}")
+        return _encoder
+
+
+def _warn_once(key, message):
+    if key not in _warned:
+        _warned.add(key)
+        print(message)
+
+
+def count_tokens(text):
+    """Token count with tiktoken, or a ~4 characters per token estimate without it."""
+    encoder = _get_encoder()
+    if encoder:
+        return len(encoder.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def source_name(output_path, root=None):
+    """Name of an output in its chunks: its path under root ("/" separated, shard levels left out).
+
+    Without root (a flat output folder) it is the file name.
+    """
+    filename = os.path.basename(output_path)
+    if root is None:
+        return filename
+    directory = storage.unsharded(os.path.dirname(os.path.abspath(output_path)))
+    return os.path.relpath(os.path.join(directory, filename), os.path.abspath(root)).replace(os.sep, '/')
+
+
+def chunk_path(output_path, extension, root=None):
+    """Chunk file of a markdown output: in the chunks/ folder next to it, or under CHUNK_DIR by its source name."""
+    stem = os.path.splitext(source_name(output_path, root))[0]
+    if CHUNK_DIR:
+        return os.path.join(CHUNK_DIR, *f"{stem}{extension}".split('/'))
+    return os.path.join(os.path.dirname(output_path), 'chunks', f"{os.path.basename(stem)}{extension}")
+
+
+def _split_headings(text):
+    """Split a page at markdown headings. Yields (char offset, heading, text)."""
+    starts = [match.start() for match in _HEADING_RE.finditer(text)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    for i, start in enumerate(starts):
+        end = starts[i + 1] if i + 1 < len(starts) else len(text)
+        section = text[start:end]
+        match = _HEADING_RE.match(section)
+        yield start, match.group(1) if match else None, section
+
+
+def build_chunks(source, pages, by=None):
+    """Chunk the pages of one markdown output.
+
+    Offsets are UTF-8 byte offsets into the .md file written from the same
+    pages (joined with PAGE_SEPARATOR). Chunk ids depend on the source, the
+    chunk's position and its content, so they are stable across reprocessing
+    and change only when the chunk does.
+    """
+    by = by or CHUNK_BY
+    separator_bytes = len(PAGE_SEPARATOR.encode('utf-8'))
+    chunks = []
+    page_offset = 0
+    for page_number, page in enumerate(pages, 1):
+        sections = _split_headings(page) if by == 'heading' else [(0, None, page)]
+        for index, (char_offset, heading, text) in enumerate(sections):
+            if not text.strip():
+                continue
+            content_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+            chunks.append({
+                'id': hashlib.sha256(f"{source}\0{page_number}\0{index}\0{content_hash}".encode('utf-8')).hexdigest()[:32],
+                'source': source,
+                'page': page_number,
+                'chunk': index,
+                'heading': heading,
+                'offset': page_offset + len(page[:char_offset].encode('utf-8')),
+                'length': len(text.encode('utf-8')),
+                'tokens': count_tokens(text),
+                'content_hash': content_hash,
+                'text': text,
+            })
+        page_offset += len(page.encode('utf-8')) + separator_bytes
+    return chunks
+
+
+def _batches(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _write_atomic(path, write):
+    tmp_path = f"{path}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def write_jsonl(path, chunks):
+    """Write chunks as JSON lines, CHUNK_BATCH_SIZE lines per write call."""
+    def write(tmp_path):
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for batch in _batches(chunks, CHUNK_BATCH_SIZE):
+                f.write(''.join(json.dumps(chunk, ensure_ascii=False) + "\n" for chunk in batch))
+    _write_atomic(path, write)
+
+
+def _record_batch(batch, schema):
+    return pa.RecordBatch.from_pylist(batch, schema=schema)
+
+
+def _schema():
+    return pa.schema([
+        ('id', pa.string()),
+        ('source', pa.string()),
+        ('page', pa.int32()),
+        ('chunk', pa.int32()),
+        ('heading', pa.string()),
+        ('offset', pa.int64()),
+        ('length', pa.int64()),
+        ('tokens', pa.int32()),
+        ('content_hash', pa.string()),
+        ('text', pa.large_string()),
+    ])
+
+
+def write_parquet(path, chunks):
+    """Write chunks to Parquet, one row group per batch."""
+    schema = _schema()
+
+    def write(tmp_path):
+        with pq.ParquetWriter(tmp_path, schema, compression='zstd') as writer:
+            for batch in _batches(chunks, CHUNK_BATCH_SIZE):
+                writer.write_batch(_record_batch(batch, schema))
+    _write_atomic(path, write)
+
+
+def write_arrow(path, chunks):
+    """Write chunks to an Arrow IPC file, one record batch per batch."""
+    schema = _schema()
+
+    def write(tmp_path):
+        with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+            for batch in _batches(chunks, CHUNK_BATCH_SIZE):
+                writer.write_batch(_record_batch(batch, schema))
+    _write_atomic(path, write)
+
+
+WRITERS = {
+    'jsonl': ('.jsonl', write_jsonl),
+    'parquet': ('.parquet', write_parquet),
+    'arrow': ('.arrow', write_arrow),
+}
+
+
+def _dump_json(path, data):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+
+
+def _load_manifest(output_path, root=None):
+    try:
+        with open(chunk_path(output_path, '.manifest.json', root), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def changes_path(output_path, root=None):
+    """Change feed of an output; an output tree (nested or sharded) keeps a single feed at its top."""
+    if CHUNK_DIR:
+        return os.path.join(CHUNK_DIR, CHANGES_FILE)
+    return os.path.join(root or storage.unsharded(os.path.dirname(output_path)), 'chunks', CHANGES_FILE)
+
+
+def chunk_stem(filename):
+    """Output stem a chunk file belongs to (None for the change feed and unknown files)."""
+    if filename == CHANGES_FILE:
+        return None
+    for extension in ['.manifest.json'] + [ext for ext, _ in WRITERS.values()]:
+        if filename.endswith(extension):
+            return filename[:-len(extension)]
+    return None
+
+
+def _append_changes(output_path, records, root=None):
+    """Append upserts/deletes to the change feed that incremental ingestion follows."""
+    path = changes_path(output_path, root)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with _changes_lock, open(path, 'a', encoding='utf-8') as f:
+        for batch in _batches(records, CHUNK_BATCH_SIZE):
+            f.write(''.join(json.dumps(record, ensure_ascii=False) + "\n" for record in batch))
+
+
+def export(output_path, pages, formats=None, root=None):
+    """Export the chunks of a converted file.
+
+    Compares the chunk ids with the previous export (a manifest next to the
+    chunk files). When nothing changed no file is rewritten; otherwise the
+    per-file chunk files are rewritten and only new or removed chunks are
+    appended to the change feed. root is the top of a nested output tree:
+    chunks are then keyed by the path under it (see source_name), so
+    outputs with the same name in different folders don't collide.
+    Returns counts, or None when disabled.
+    """
+    formats = [fmt for fmt in (formats or CHUNK_EXPORT) if fmt in WRITERS]
+    if not formats:
+        return None
+    if pa is None and any(fmt != 'jsonl' for fmt in formats):
+        _warn_once('pyarrow', "⚠️  pyarrow no está instalado: solo se exportan chunks JSONL")
+        formats = [fmt for fmt in formats if fmt == 'jsonl']
+
+    os.makedirs(os.path.dirname(chunk_path(output_path, '.manifest.json', root)), exist_ok=True)
+    source = source_name(output_path, root)
+    chunks = build_chunks(source, pages)
+    previous = _load_manifest(output_path, root)
+    current = {chunk['id']: chunk['content_hash'] for chunk in chunks}
+
+    added = [chunk for chunk in chunks if chunk['id'] not in previous]
+    removed = [chunk_id for chunk_id in previous if chunk_id not in current]
+    missing_files = [fmt for fmt in formats if not os.path.exists(chunk_path(output_path, WRITERS[fmt][0], root))]
+    result = {'chunks': len(chunks), 'added': len(added), 'removed': len(removed),
+              'unchanged': len(chunks) - len(added)}
+    if not added and not removed and not missing_files:
+        return result
+
+    for fmt in formats:
+        extension, writer = WRITERS[fmt]
+        writer(chunk_path(output_path, extension, root), chunks)
+    if added or removed:
+        _append_changes(output_path, [{'op': 'upsert', **chunk} for chunk in added]
+                        + [{'op': 'delete', 'id': chunk_id, 'source': source} for chunk_id in removed], root)
+    _write_atomic(chunk_path(output_path, '.manifest.json', root),
+                  lambda tmp_path: _dump_json(tmp_path, current))
+    return result
+
+
+def remove(output_path, root=None):
+    """Delete the chunk files of an output and record its chunks as deleted."""
+    previous = _load_manifest(output_path, root)
+    if previous:
+        source = source_name(output_path, root)
+        _append_changes(output_path, [{'op': 'delete', 'id': chunk_id, 'source': source} for chunk_id in previous],
+                        root)
+    for extension in [ext for ext, _ in WRITERS.values()] + ['.manifest.json']:
+        try:
+            os.remove(chunk_path(output_path, extension, root))
+        except FileNotFoundError:
+            pass
+
+
+def export_existing(output_dir, formats=None):
+    """Backfill: export the chunks of markdown outputs already on disk."""
+    for filename in output_store.list_markdown(output_dir):
+        output_path = os.path.join(output_dir, filename)
+        pages = output_store.read_markdown(output_path).split(PAGE_SEPARATOR)
+        result = export(output_path, pages, formats, root=output_dir)
+        print(f"🧩 {filename}: {result}")
+
+
+if __name__ == "__main__":
+    export_existing(sys.argv[1] if len(sys.argv) > 1 else os.getenv("OUTPUT_DIR", "OutputFiles"),
+                    sys.argv[2].split(',') if len(sys.argv) > 2 else CHUNK_EXPORT or ['jsonl'])
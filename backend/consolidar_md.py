@@ -1,8 +1,14 @@
 import os
 import re
+import json
+import mmap
+import output_store
 
 directorio_entrada = os.getenv("OUTPUT_DIR", "OutputFiles")
 archivo_salida = os.getenv("CONSOLIDATED_DIR", "Consolidated.md")
+# Fragmentar la consolidación por tamaño (bytes) o cantidad de archivos (0 = sin límite)
+max_bytes_fragmento = int(os.getenv("CONSOLIDATED_MAX_BYTES", "0"))
+max_archivos_fragmento = int(os.getenv("CONSOLIDATED_MAX_FILES", "0"))
 
 
 def natural_sort_key(text):
@@ -19,7 +25,39 @@ def natural_sort_key(text):
     return [convert(c) for c in re.split('([0-9]+)', text)]
 
 
-def consolidar_markdowns(directorio_entrada, archivo_salida):
+def ruta_indice(archivo_salida):
+    """Ruta del índice JSON (tabla de contenidos con offsets en bytes) de una consolidación"""
+    return f"{os.path.splitext(archivo_salida)[0]}.index.json"
+
+
+def ruta_fragmento(archivo_salida, numero):
+    """Ruta del fragmento número `numero` (1..n) de una consolidación fragmentada"""
+    base, extension = os.path.splitext(archivo_salida)
+    return f"{base}_{numero:03d}{extension}"
+
+
+def es_salida_consolidada(nombre, archivo_salida):
+    """Indica si `nombre` es la consolidación o uno de sus fragmentos (para no re-consolidarlos)"""
+    base, extension = os.path.splitext(os.path.basename(archivo_salida))
+    patron = re.escape(base) + r'(_\d{3})?' + re.escape(extension)
+    return re.fullmatch(patron, nombre) is not None
+
+
+def consolidar_markdowns(directorio_entrada, archivo_salida, max_bytes=None, max_archivos=None, rutas=None):
+    """
+    Consolida los .md de `directorio_entrada` en `archivo_salida`.
+
+    `rutas` ({nombre: ruta}) reemplaza el listado del directorio cuando las
+    salidas no están todas en él (carpetas fragmentadas, ver storage.py).
+
+    Si se indica `max_bytes` o `max_archivos` la salida se divide en fragmentos
+    (Consolidated_001.md, Consolidated_002.md...). En ambos casos se escribe un
+    índice JSON con el fragmento y el rango de bytes de cada archivo fuente.
+    """
+    max_bytes = max_bytes if max_bytes is not None else max_bytes_fragmento
+    max_archivos = max_archivos if max_archivos is not None else max_archivos_fragmento
+    fragmentar = bool(max_bytes or max_archivos)
+
     # Verificar que el directorio de entrada existe
     if not os.path.exists(directorio_entrada):
         print(f"❌ Error: El directorio '{directorio_entrada}' no existe.")
@@ -31,9 +69,10 @@ def consolidar_markdowns(directorio_entrada, archivo_salida):
         os.makedirs(directorio_salida)
     
     # Buscar archivos .md en el directorio y ordenarlos naturalmente
+    # (incluye las salidas guardadas solo comprimidas, ver output_store)
     archivos_md = [
-        f for f in os.listdir(directorio_entrada)
-        if f.endswith('.md')
+        f for f in (rutas if rutas is not None else output_store.list_markdown(directorio_entrada))
+        if not es_salida_consolidada(f, archivo_salida)
     ]
     
     # Aplicar ordenamiento natural para manejar números correctamente
@@ -48,36 +87,110 @@ def consolidar_markdowns(directorio_entrada, archivo_salida):
     for i, archivo in enumerate(archivos_md, 1):
         print(f"  {i}. {archivo}")
     
+    # Eliminar fragmentos de consolidaciones anteriores
+    for nombre in os.listdir(directorio_salida or '.'):
+        ruta = os.path.join(directorio_salida, nombre)
+        mismo_archivo = os.path.abspath(ruta) == os.path.abspath(archivo_salida)
+        if es_salida_consolidada(nombre, archivo_salida) and (fragmentar or not mismo_archivo):
+            os.remove(ruta)
+
+    indice = {'fragmentos': [], 'secciones': []}
+    salida = None
     try:
-        with open(archivo_salida, 'w', encoding='utf-8') as salida:
-            salida.write("# Archivos Consolidados\n\n")
-            salida.write(f"*Consolidación de {len(archivos_md)} archivos markdown*\n\n")
-            
-            for i, archivo in enumerate(archivos_md, 1):
-                ruta_completa = os.path.join(directorio_entrada, archivo)
-                try:
-                    with open(ruta_completa, 'r', encoding='utf-8') as f:
-                        contenido = f.read()
-                    
-                    print(f"  {i}/{len(archivos_md)}: {archivo}")
-                    salida.write(f"\n---\n\n## {archivo}\n\n")
-                    salida.write(contenido)
-                    if not contenido.endswith('\n'):
-                        salida.write('\n')
-                    salida.write(f"\n\n*--- Fin de {archivo} ---*\n")
-                    
-                except Exception as e:
-                    print(f"⚠️  Error al leer {archivo}: {e}")
-                    continue
-
-        print(f"✅ Consolidación completa. Archivo generado: {archivo_salida}")
+        for i, archivo in enumerate(archivos_md, 1):
+            ruta_completa = rutas[archivo] if rutas is not None else os.path.join(directorio_entrada, archivo)
+            try:
+                contenido = output_store.read_markdown(ruta_completa).encode('utf-8')
+            except Exception as e:
+                print(f"⚠️  Error al leer {archivo}: {e}")
+                continue
+
+            encabezado = f"\n---\n\n## {archivo}\n\n".encode('utf-8')
+            pie = ('' if contenido.endswith(b'\n') else '\n') + f"\n\n*--- Fin de {archivo} ---*\n"
+            pie = pie.encode('utf-8')
+
+            # Abrir un nuevo fragmento si el actual ya alcanzó el límite
+            if salida is not None and fragmentar and secciones_fragmento > 0 and (
+                (max_archivos and secciones_fragmento >= max_archivos) or
+                (max_bytes and salida.tell() + len(encabezado) + len(contenido) + len(pie) > max_bytes)
+            ):
+                salida.close()
+                salida = None
+
+            if salida is None:
+                numero = len(indice['fragmentos']) + 1
+                ruta = ruta_fragmento(archivo_salida, numero) if fragmentar else archivo_salida
+                salida = open(ruta, 'wb')
+                indice['fragmentos'].append(os.path.basename(ruta))
+                secciones_fragmento = 0
+                parte = f" (parte {numero})" if fragmentar else ""
+                salida.write("# Archivos Consolidados\n\n".encode('utf-8'))
+                salida.write(f"*Consolidación de {len(archivos_md)} archivos markdown{parte}*\n\n".encode('utf-8'))
+
+            print(f"  {i}/{len(archivos_md)}: {archivo}")
+            salida.write(encabezado)
+            indice['secciones'].append({
+                'fuente': archivo,
+                'fragmento': indice['fragmentos'][-1],
+                'offset': salida.tell(),
+                'longitud': len(contenido)
+            })
+            salida.write(contenido)
+            salida.write(pie)
+            secciones_fragmento += 1
+
+        if salida is not None:
+            salida.close()
+
+        with open(ruta_indice(archivo_salida), 'w', encoding='utf-8') as f:
+            json.dump(indice, f, ensure_ascii=False, indent=2)
+
+        if fragmentar:
+            print(f"✅ Consolidación completa. {len(indice['fragmentos'])} fragmentos generados junto a: {archivo_salida}")
+        else:
+            print(f"✅ Consolidación completa. Archivo generado: {archivo_salida}")
         return True
         
     except Exception as e:
+        if salida is not None:
+            salida.close()
         print(f"❌ Error al escribir el archivo de salida: {e}")
         return False
 
 
+def cargar_indice(archivo_salida):
+    """Cargar el índice de una consolidación (None si no existe)"""
+    try:
+        with open(ruta_indice(archivo_salida), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def leer_seccion(archivo_salida, fuente):
+    """
+    Leer el contenido de un archivo fuente desde la consolidación usando el índice.
+
+    Solo se mapea en memoria el fragmento que contiene la sección, así que no
+    hace falta leer la consolidación completa. Devuelve bytes o None.
+    """
+    indice = cargar_indice(archivo_salida)
+    if indice is None:
+        return None
+    for seccion in indice['secciones']:
+        if seccion['fuente'] == fuente:
+            break
+    else:
+        return None
+
+    if seccion['longitud'] == 0:
+        return b''
+    ruta = os.path.join(os.path.dirname(archivo_salida), seccion['fragmento'])
+    with open(ruta, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as datos:
+            return datos[seccion['offset']:seccion['offset'] + seccion['longitud']]
+
+
 if __name__ == "__main__":
     print("🔄 Iniciando consolidación de archivos Markdown...")
     print(f"📂 Directorio de entrada: {directorio_entrada}")
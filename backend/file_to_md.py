@@ -1,20 +1,45 @@
 import nest_asyncio
 import os
+import sys
+import math
+import heapq
+import json
 import time
+import fnmatch
+import argparse
+import threading
+from datetime import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import redirect_stdout
 from dotenv import load_dotenv
 from llama_index.llms.openai import OpenAI
 from llama_index.embeddings.openai import OpenAIEmbedding
 from llama_index.core import VectorStoreIndex
 from llama_index.core import Settings
 from llama_cloud_services import LlamaParse
-from copy import deepcopy
-from llama_index.core.schema import TextNode
+from llama_index.core.schema import Document
 
 nest_asyncio.apply()
 
 # Load environment variables
 load_dotenv()
 
+# Local modules read their configuration from the environment on import
+import output_store
+import preflight
+import image_prep
+import page_router
+import scheduler
+import key_pool
+import chunk_export
+import hedging
+import planner
+import page_dedup
+import retry_queue
+import micro_batch
+import spreadsheet
+
 # API access to llama-cloud
 os.environ["LLAMA_CLOUD_API_KEY"] = os.getenv("LLAMA_CLOUD_API_KEY", "llx-xxx")
 
@@ -33,13 +58,15 @@ os.environ["LLAMA_CLOUD_API_KEY"] = os.getenv("LLAMA_CLOUD_API_KEY", "llx-xxx")
 input_dir = os.getenv("INPUT_DIR", "InputFiles")
 output_dir = os.getenv("OUTPUT_DIR", "OutputFiles")
 delay_between_files = int(os.getenv("DELAY_BETWEEN_FILES", "0"))
+# Pages per upstream job of a PDF (routed or whole-file), so its pages stream into the .partial sooner
+# (0 = one job per mode, or for the whole file)
+stream_page_batch = int(os.getenv("STREAM_PAGE_BATCH", "0"))
 
 # Ensure output directory exists
 os.makedirs(output_dir, exist_ok=True)
 
-def get_supported_files(input_dir):
-    """Get all supported files from input directory."""
-    # Get all files from input directory
+def supported_extensions():
+    """File extensions LlamaParse accepts."""
     # Supported file types based on LlamaParse official documentation
     # https://docs.cloud.llamaindex.ai/llamaparse/features/supported_document_types
     
@@ -75,8 +102,11 @@ def get_supported_files(input_dir):
     ]
     
     # Combine all supported extensions
-    supported_extensions = base_types + doc_pres_types + image_types + spreadsheet_types + audio_types
-    
+    return base_types + doc_pres_types + image_types + spreadsheet_types + audio_types
+
+def get_supported_files(input_dir):
+    """Get all supported files from input directory."""
+    supported = supported_extensions()
     input_files = []
 
     if os.path.exists(input_dir):
@@ -85,23 +115,343 @@ def get_supported_files(input_dir):
             if os.path.isfile(file_path):
                 # Check if file has supported extension
                 _, ext = os.path.splitext(filename)
-                if ext.lower() in supported_extensions:
+                if ext.lower() in supported:
                     input_files.append(filename)
     
     return input_files
 
-def get_page_nodes(docs, separator="\n---\n"):
-    """Split each document into page node, by separator."""
-    nodes = []
-    for doc in docs:
-        doc_chunks = doc.text.split(separator)
-        for doc_chunk in doc_chunks:
-            node = TextNode(
-                text=doc_chunk,
-                metadata=deepcopy(doc.metadata),
-            )
-            nodes.append(node)
-    return nodes
+def documents_to_markdown(documents):
+    """Combine parsed documents into a single markdown string."""
+    markdown_content = ""
+    for doc_idx, doc in enumerate(documents):
+        if doc_idx > 0:
+            markdown_content += "\n\n---\n\n"  # Page separator
+        markdown_content += doc.text
+    return markdown_content
+
+def parse_file(file_path, file_name=None, mode='premium', target_pages=None):
+    """Parse a file with LlamaParse using a key from the shared key pool.
+
+    mode 'premium' uses auto mode with the image/table triggers, 'fast' the
+    plain markdown mode. file_name overrides the name sent upstream, which
+    decides how the file is parsed (used to re-route files whose extension
+    doesn't match their content). target_pages limits the parse to those
+    0-based pages.
+
+    A rate limited key is put in cooldown and the parse is retried on the
+    next usable key; key_pool.RateLimitedError is raised once all of them
+    are cooling down.
+
+    The parse gets a deadline scaled by its page count (or size) and is
+    hedged with a duplicate when it straggles (see hedging.run);
+    hedging.ParseTimeoutError is raised when the deadline passes. The
+    key is acquired in the parse pool and the deadline only starts once it
+    is held: time spent waiting for a free key isn't parse time (the wait
+    is bounded by the deadline too).
+    """
+    size_bytes = os.path.getsize(file_path)
+    pages = len(target_pages.split(',')) if target_pages else preflight.analyze(file_path)['pages']
+    limit = hedging.deadline(pages, size_bytes)
+    return hedging.run(
+        lambda begin: _parse_with_keys(file_path, file_name, mode, target_pages, limit, begin),
+        hedging.size_class(mode, pages, size_bytes),
+        limit,
+        label=file_name or os.path.basename(file_path),
+        # A duplicate only helps if a key can take it now instead of queueing behind the original
+        can_hedge=key_pool.pool.has_capacity
+    )
+
+def _load_with_key(api_key, file_path, file_name, mode, target_pages, timeout):
+    """_load_data with a key already acquired, given back when the parse ends (even if its caller gave up)."""
+    try:
+        documents = _load_data(file_path, file_name, mode, target_pages, api_key, timeout)
+    except Exception as e:
+        key_pool.pool.release(api_key, rate_limited=is_rate_limit_error(e), failed=True)
+        raise
+    key_pool.pool.release(api_key)
+    return documents
+
+def _parse_with_keys(file_path, file_name, mode, target_pages, timeout, begin=None):
+    """Parse with a key from the pool, moving on to the next key on a rate limit.
+
+    Once a key is held begin() is called (see hedging.run); if it returns
+    False the caller gave up, and the key is given back without parsing.
+    """
+    attempts = len(key_pool.pool)
+    for attempt in range(1, attempts + 1):
+        try:
+            api_key = key_pool.pool.acquire()
+            if begin is not None and not begin():
+                key_pool.pool.release(api_key)
+                return None
+            return _load_with_key(api_key, file_path, file_name, mode, target_pages, timeout)
+        except Exception as e:
+            if attempt == attempts or not is_rate_limit_error(e) or isinstance(e, key_pool.RateLimitedError):
+                raise
+            print(f"🔁 Límite de API en una key, reintentando con otra ({attempt}/{attempts})")
+
+def _load_data(file_path, file_name, mode, target_pages, api_key, timeout=None):
+    """Run a single LlamaParse job with the given key.
+
+    timeout bounds the client's polling (max_timeout) so a job abandoned
+    after its deadline doesn't poll forever.
+    """
+    max_timeout = int(math.ceil(timeout)) if timeout else 2000
+    # Errors must propagate (not become empty results) so rate limits can be told apart
+    if mode == 'premium':
+        # https://docs.cloud.llamaindex.ai/llamaparse/presets_and_modes/auto_mode
+        parser = LlamaParse(
+            result_type="markdown",
+            auto_mode=True,
+            auto_mode_trigger_on_image_in_page=True,
+            auto_mode_trigger_on_table_in_page=True,
+            target_pages=target_pages,
+            api_key=api_key,
+            ignore_errors=False,
+            max_timeout=max_timeout,
+        )
+    else:
+        parser = LlamaParse(result_type="markdown", target_pages=target_pages,
+                            api_key=api_key, ignore_errors=False, max_timeout=max_timeout)
+    if file_name is None:
+        return parser.load_data(file_path)
+    with open(file_path, 'rb') as f:
+        return parser.load_data(f, extra_info={'file_name': file_name})
+
+def _page_batches(pages):
+    if stream_page_batch <= 0:
+        return [pages]
+    return [pages[start:start + stream_page_batch] for start in range(0, len(pages), stream_page_batch)]
+
+def parse_routed(file_path, routing_plan, file_name=None, partial=None):
+    """Parse each group of pages in the mode chosen by page_router and merge them in page order.
+
+    Local and reused pages are available at once; the others arrive per
+    mode (or per STREAM_PAGE_BATCH pages) and are appended to the partial
+    writer as they do. Returns (documents, routing summary). Raises
+    ValueError if the upstream returned a different number of pages than
+    requested.
+    """
+    texts = dict(routing_plan['local_text'])
+    if partial:
+        partial.write_pages(texts, total=len(routing_plan['pages']))
+    seconds_by_mode = {}
+    for mode in ('fast', 'premium'):
+        for pages in _page_batches(routing_plan['pages_by_mode'][mode]):
+            if not pages:
+                continue
+            started = time.time()
+            documents = parse_file(file_path, file_name, mode=mode,
+                                   target_pages=page_router.target_pages(pages))
+            seconds_by_mode[mode] = seconds_by_mode.get(mode, 0) + time.time() - started
+            if len(documents) != len(pages):
+                raise ValueError(f"se pidieron {len(pages)} páginas en modo {mode} y llegaron {len(documents)}")
+            arrived = dict(zip(pages, (doc.text for doc in documents)))
+            texts.update(arrived)
+            if partial:
+                partial.write_pages(arrived)
+
+    documents = [Document(text=texts[page], metadata={'page': page + 1}) for page in sorted(texts)]
+    return documents, page_router.record(routing_plan, seconds_by_mode)
+
+def parse_streamed(file_path, file_name, page_count, partial):
+    """Whole-file parse of a PDF in STREAM_PAGE_BATCH page jobs, appending each to the partial writer as it arrives.
+
+    Files that fit in one batch (or with STREAM_PAGE_BATCH off) are parsed
+    in one job. Raises ValueError if the upstream returned a different
+    number of pages than requested.
+    """
+    batches = _page_batches(list(range(page_count)))
+    if len(batches) <= 1:
+        return parse_file(file_path, file_name)
+    documents = []
+    for pages in batches:
+        batch = parse_file(file_path, file_name, target_pages=page_router.target_pages(pages))
+        if len(batch) != len(pages):
+            raise ValueError(f"se pidieron {len(pages)} páginas y llegaron {len(batch)}")
+        partial.write_pages(dict(zip(pages, (doc.text for doc in batch))))
+        documents.extend(batch)
+    return documents
+
+def convert_file(file_path, output_path, output_root=None):
+    """Convert one file to markdown, running the local preflight before the parse.
+
+    Pages are appended to the output's .partial companion as they arrive
+    (see output_store.PartialWriter) until the final .md is written.
+    output_root is the top of a nested output tree (see chunk_export.export).
+    Raises preflight.PreflightError for files that would fail upstream anyway.
+    Returns a dict with the preflight result, the page count, whether the
+    output has content and the chunk export counts (None if disabled).
+    """
+    started = time.time()
+    checked = preflight.check(file_path)
+    file_name = checked['parse_as']
+
+    # Spreadsheets are plain tabular data: converted locally, sheet by sheet (SPREADSHEET_LOCAL)
+    if spreadsheet.handles(file_name or file_path):
+        return convert_spreadsheet(file_path, output_path, checked, started, output_root)
+
+    routing = None
+
+    # Downscale/recompress images so less data goes upstream
+    prepared = image_prep.prepare(file_path, file_name or os.path.basename(file_path))
+    partial = output_store.PartialWriter(output_path, checked['pages'])
+    try:
+        if prepared is not None:
+            documents = parse_file(prepared['path'], prepared['file_name'])
+        else:
+            # Send only the PDF pages that need it to the premium mode
+            routing_plan = page_router.plan(file_path) if checked['kind'] == 'pdf' else None
+            # Near-duplicates of pages parsed before reuse their markdown (DEDUP_ENABLED)
+            page_dedup.apply(file_path, routing_plan, os.path.basename(file_path))
+            # Whole-file parses of PDFs still stream in STREAM_PAGE_BATCH page jobs
+            page_count = checked['pages'] if checked['kind'] == 'pdf' else 0
+            if page_router.worth_routing(routing_plan):
+                try:
+                    documents, routing = parse_routed(file_path, routing_plan, file_name, partial)
+                except ValueError as e:
+                    print(f"⚠️  Enrutado por página falló ({e}), se procesa el archivo completo")
+                    documents = parse_file(file_path, file_name)
+            else:
+                try:
+                    documents = parse_streamed(file_path, file_name, page_count, partial)
+                except ValueError as e:
+                    print(f"⚠️  Parseo por lotes de páginas falló ({e}), se procesa el archivo completo")
+                    documents = parse_file(file_path, file_name)
+            page_dedup.learn(routing_plan, documents, os.path.basename(file_path))
+        # Pages not streamed yet (whole-file parses) arrive all at once
+        partial.write_pages(dict(enumerate(doc.text for doc in documents)), total=len(documents))
+
+        output_store.write_markdown(output_path, documents_to_markdown(documents))
+    finally:
+        partial.close()
+        if prepared is not None:
+            image_prep.cleanup(prepared['path'])
+
+    # Page/heading chunks for RAG ingestion (CHUNK_EXPORT)
+    chunks = chunk_export.export(output_path, [doc.text for doc in documents], root=output_root)
+    pages = len(documents) or checked['pages']
+    # Teach the planner's latency model how long this type and size takes (in the preflight's page unit)
+    planner.record(file_name or os.path.basename(file_path), checked['pages'], time.time() - started)
+    return {
+        'preflight': checked,
+        'pages': pages,
+        'pages_reused': routing['pages'].get('reused', 0) if routing else 0,
+        'bytes_saved': prepared['bytes_saved'] if prepared else 0,
+        'routing': routing,
+        'has_content': output_store.has_content(output_path),
+        'chunks': chunks,
+    }
+
+def convert_spreadsheet(file_path, output_path, checked, started, output_root=None):
+    """convert_file for spreadsheets read locally by spreadsheet.py, without any upstream call.
+
+    Tables are streamed to the output (and its .partial) one at a time;
+    they are only kept in memory for the chunk export when it is enabled.
+    """
+    pages = []
+    count = 0
+    partial = output_store.PartialWriter(output_path)
+
+    def pieces():
+        nonlocal count
+        for index, text in enumerate(spreadsheet.iter_pages(file_path)):
+            partial.write_pages({index: text})
+            if chunk_export.CHUNK_EXPORT:
+                pages.append(text)
+            count += 1
+            yield (spreadsheet.PAGE_SEPARATOR if index else "") + text
+
+    try:
+        output_store.write_markdown_stream(output_path, pieces())
+    except spreadsheet.SpreadsheetError as e:
+        # A corrupt or mislabeled workbook won't parse any better on a retry
+        raise preflight.PreflightError(os.path.basename(file_path), str(e)) from e
+    finally:
+        partial.close()
+
+    chunks = chunk_export.export(output_path, pages, root=output_root)
+    planner.record(os.path.basename(file_path), checked['pages'], time.time() - started)
+    print(f"📊 {os.path.basename(file_path)}: {count} tablas convertidas localmente")
+    return {
+        'preflight': checked,
+        'pages': count or checked['pages'],
+        'pages_reused': 0,
+        'bytes_saved': 0,
+        'routing': None,
+        'has_content': output_store.has_content(output_path),
+        'chunks': chunks,
+    }
+
+def convert_batch(pairs, output_root=None):
+    """Convert small files of one micro_batch group with a single upstream parse.
+
+    pairs are (file_path, output_path). Each file still gets its own
+    preflight, markdown output and result: files rejected by the preflight
+    get their PreflightError, and if the composite parse fails every file
+    gets its exception. If the file boundaries can't be recovered from the
+    parse, each file is converted on its own. Returns {file_path: result
+    dict as convert_file's, or the exception}.
+    """
+    started = time.time()
+    outcomes = {}
+    accepted = []
+    for file_path, output_path in pairs:
+        try:
+            accepted.append((file_path, output_path, preflight.check(file_path)))
+        except Exception as e:
+            outcomes[file_path] = e
+    group = micro_batch.group_of(accepted[0][0]) if accepted else None
+
+    texts = None
+    composite = None
+    if len(accepted) > 1 and group is not None:
+        try:
+            composite = micro_batch.compose(group, [file_path for file_path, _, _ in accepted])
+        except Exception as e:
+            print(f"⚠️  No se pudo armar el lote de {len(accepted)} archivos ({e}), se procesan uno a uno")
+    if composite is not None:
+        try:
+            texts = micro_batch.split(group, parse_file(composite), len(accepted))
+        except ValueError as e:
+            print(f"⚠️  No se pudo separar el lote de {len(accepted)} archivos ({e}), se procesan uno a uno")
+            micro_batch.record(len(accepted), fallback=True)
+        except Exception as e:
+            for file_path, _, _ in accepted:
+                outcomes[file_path] = e
+            return outcomes
+        finally:
+            micro_batch.cleanup(composite)
+
+    if texts is None:
+        for file_path, output_path, _ in accepted:
+            try:
+                outcomes[file_path] = convert_file(file_path, output_path, output_root)
+            except Exception as e:
+                outcomes[file_path] = e
+        return outcomes
+
+    micro_batch.record(len(accepted))
+    print(f"📦 {len(accepted)} archivos pequeños procesados en un solo trabajo")
+    share = (time.time() - started) / len(accepted)
+    for (file_path, output_path, checked), text in zip(accepted, texts):
+        try:
+            output_store.write_markdown(output_path, text)
+            chunks = chunk_export.export(output_path, [text], root=output_root)
+            planner.record(os.path.basename(file_path), checked['pages'], share)
+            outcomes[file_path] = {
+                'preflight': checked,
+                'pages': 1,
+                'pages_reused': 0,
+                'bytes_saved': 0,
+                'routing': None,
+                'has_content': output_store.has_content(output_path),
+                'chunks': chunks,
+                'batched': len(accepted),
+            }
+        except Exception as e:
+            outcomes[file_path] = e
+    return outcomes
 
 def cleanup_empty_files(output_dir):
     """Remove files with 0 bytes from output directory."""
@@ -119,137 +469,433 @@ def cleanup_empty_files(output_dir):
 
 def is_rate_limit_error(error):
     """Check if the error is related to rate limiting (429 Too Many Requests)."""
+    if isinstance(error, key_pool.RateLimitedError):
+        return True
     error_str = str(error).lower()
     return ("429" in error_str or 
             "too many requests" in error_str or 
             "rate limit" in error_str or
             "httperror" in error_str)
 
-def wait_for_rate_limit_reset(wait_time=60):
-    """Wait for rate limit to reset with user notification."""
-    print(f"⏳ Esperando {wait_time} segundos para que se restablezca el límite de la API...")
-    print("💡 Tip: Considera usar una API key diferente o esperar más tiempo entre procesamientos.")
-    for i in range(wait_time, 0, -10):
-        print(f"   Tiempo restante: {i} segundos...")
-        time.sleep(10)
-    print("✅ Continuando con el procesamiento...")
-
-def process_files():
-    """Main function to process all files in the input directory."""
-    input_files = get_supported_files(input_dir)
-    
-    print(f"Archivos encontrados para procesar: {len(input_files)}")
+def _matches(rel_path, name, patterns):
+    return any(fnmatch.fnmatch(rel_path, pattern) or fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+def walk_input_files(root, recursive=False, include=(), exclude=()):
+    """Find supported files under root with os.scandir.
+
+    Returns paths relative to root with "/" separators. Include/exclude globs
+    match either that relative path or the bare file name; an excluded
+    directory is not descended into. Hidden directories are skipped.
+    """
+    supported = set(supported_extensions())
+    found = []
+    pending_dirs = ['']
+    while pending_dirs:
+        rel_dir = pending_dirs.pop()
+        try:
+            entries = os.scandir(os.path.join(root, rel_dir))
+        except OSError as e:
+            print(f"⚠️  No se pudo leer {os.path.join(root, rel_dir)}: {e}")
+            continue
+        with entries:
+            for entry in entries:
+                rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive and not entry.name.startswith('.') and not _matches(rel_path, entry.name, exclude):
+                        pending_dirs.append(rel_path)
+                elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in supported:
+                    if include and not _matches(rel_path, entry.name, include):
+                        continue
+                    if _matches(rel_path, entry.name, exclude):
+                        continue
+                    found.append(rel_path)
+    return sorted(found)
+
+def output_path_for(rel_path, output_root):
+    """Mirror an input's relative path in the output directory, with a .md extension."""
+    return os.path.join(output_root, *f"{os.path.splitext(rel_path)[0]}.md".split('/'))
+
+def is_changed(file_path, output_path):
+    """Check if an input has no output yet or was modified after it."""
+    if not output_store.exists(output_path):
+        return True
+    return os.path.getmtime(file_path) > output_store.stat_markdown(output_path)[1]
+
+_DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+def parse_since(value):
+    """Parse --since: "changed", a duration ago (30m, 12h, 7d) or an ISO date/datetime.
+
+    Returns "changed" or a Unix timestamp.
+    """
+    if value == 'changed':
+        return value
+    amount, unit = value[:-1], value[-1:].lower()
+    if unit in _DURATION_UNITS and amount.replace('.', '', 1).isdigit():
+        return time.time() - float(amount) * _DURATION_UNITS[unit]
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"valor inválido para --since: {value}")
+
+class ProgressBar:
+    """Single-line progress bar on stderr, used instead of the log in --quiet runs."""
+
+    def __init__(self, total, width=30):
+        self.total = total
+        self.width = width
+
+    def update(self, done, failed):
+        filled = int(self.width * done / self.total) if self.total else self.width
+        sys.stderr.write(f"\r[{'#' * filled}{'-' * (self.width - filled)}] {done}/{self.total} errores: {failed}")
+        sys.stderr.flush()
+
+    def close(self):
+        sys.stderr.write("\n")
+
+class SummaryWriter:
+    """Write per-file records and the run summary as JSON or JSONL ("-" is stdout).
+
+    JSONL records are written as each file finishes so an orchestrator can
+    follow the run; the last line is the summary.
+    """
+
+    def __init__(self, path, fmt=None, stdout=None):
+        self.fmt = fmt or ('jsonl' if path.endswith('.jsonl') else 'json')
+        self.to_stdout = path == '-'
+        self.stream = (stdout or sys.stdout) if self.to_stdout else open(path, 'w', encoding='utf-8')
+        self.records = []
+        self._lock = threading.Lock()
+
+    def record(self, record):
+        with self._lock:
+            self.records.append(record)
+            if self.fmt == 'jsonl':
+                self.stream.write(json.dumps({'type': 'file', **record}, ensure_ascii=False) + "\n")
+                self.stream.flush()
+
+    def close(self, summary):
+        if self.fmt == 'jsonl':
+            self.stream.write(json.dumps({'type': 'summary', **summary}, ensure_ascii=False) + "\n")
+        else:
+            json.dump({'summary': summary, 'files': self.records}, self.stream, ensure_ascii=False, indent=2)
+            self.stream.write("\n")
+        self.stream.flush()
+        if not self.to_stdout:
+            self.stream.close()
+
+def _new_record(rel_path, output_path, output_root):
+    return {
+        'file': rel_path,
+        'output': os.path.relpath(output_path, output_root),
+        'status': 'ok',
+        'seconds': 0.0,
+        'pages': 0,
+        'pages_reused': 0,
+        'bytes_saved': 0,
+        'routing': None,
+        'error': None,
+        'error_class': None,
+    }
+
+def _record_outcome(record, outcome):
+    """Fill a summary record from a convert_file result or the exception it raised."""
+    if isinstance(outcome, preflight.PreflightError):
+        # Rejected locally: nothing was sent upstream
+        record.update(status='rejected', error=outcome.reason, error_class=retry_queue.PERMANENT)
+    elif isinstance(outcome, Exception):
+        rate_limited = is_rate_limit_error(outcome)
+        record.update(status='rate_limited' if rate_limited else 'failed', error=str(outcome),
+                      error_class=retry_queue.classify(outcome, rate_limited))
+    else:
+        record.update(
+            pages=outcome['pages'],
+            pages_reused=outcome['pages_reused'],
+            bytes_saved=outcome['bytes_saved'],
+            routing=outcome['routing']['pages'] if outcome['routing'] else None
+        )
+        if not outcome['has_content']:
+            record.update(status='failed', error='Archivo creado pero está vacío',
+                          error_class=retry_queue.PERMANENT)
+    return record
+
+def convert_one(input_root, output_root, rel_path):
+    """Convert one file of a batch and return its record for the summary."""
+    file_path = os.path.join(input_root, rel_path)
+    output_path = output_path_for(rel_path, output_root)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    record = _new_record(rel_path, output_path, output_root)
+    started = time.time()
+    try:
+        # Preflight, parse and write the markdown (and compressed sidecar if enabled)
+        outcome = convert_file(file_path, output_path, output_root)
+    except Exception as e:
+        outcome = e
+    _record_outcome(record, outcome)
+    record['seconds'] = round(time.time() - started, 3)
+    return record
+
+def convert_many(input_root, output_root, rel_paths):
+    """Convert files of a batch, small ones packed into one parse (micro_batch). Returns their records."""
+    if len(rel_paths) == 1:
+        return [convert_one(input_root, output_root, rel_paths[0])]
+    paths = {}
+    for rel_path in rel_paths:
+        output_path = output_path_for(rel_path, output_root)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        paths[rel_path] = (os.path.join(input_root, rel_path), output_path)
+    started = time.time()
+    outcomes = convert_batch(list(paths.values()), output_root)
+    seconds = round(time.time() - started, 3)
+    records = []
+    for rel_path, (file_path, output_path) in paths.items():
+        record = _record_outcome(_new_record(rel_path, output_path, output_root), outcomes[file_path])
+        record['seconds'] = seconds
+        records.append(record)
+    return records
+
+def _print_record(record):
+    if record['status'] == 'ok':
+        if record['routing']:
+            print(f"🧭 Páginas por modo: {record['routing']}")
+        if record['bytes_saved']:
+            print(f"🗜️  Imagen optimizada: {record['bytes_saved'] // 1024} KB menos enviados")
+        print(f"✅ Archivo generado exitosamente: {record['output']} ({record['seconds']:.1f}s)")
+    elif record['status'] == 'rejected':
+        print(f"⛔ Archivo descartado {record['file']}: {record['error']}")
+    else:
+        print(f"❌ Error procesando {record['file']}: {record['error']}")
+
+def select_files(input_root, output_root, recursive=False, include=(), exclude=(), since=None):
+    """Files a run would convert, in scheduling order, and the ones --since skips."""
+    wanted_files = []
+    skipped = []
+    for rel_path in walk_input_files(input_root, recursive, include, exclude):
+        file_path = os.path.join(input_root, rel_path)
+        if since == 'changed':
+            wanted = is_changed(file_path, output_path_for(rel_path, output_root))
+        else:
+            wanted = since is None or os.path.getmtime(file_path) >= since
+        (wanted_files if wanted else skipped).append(rel_path)
+
+    # Order by the configured scheduling policy (shortest job first by default)
+    return scheduler.order_files(wanted_files, input_root), skipped
+
+def print_plan(result, skipped=0):
+    """Human readable report of planner.plan()."""
+    print(f"📋 Plan: {result['files']} archivos, {result['pages']} páginas, "
+          f"{result['bytes'] / (1024 * 1024):.1f}MB"
+          + (f" ({skipped} sin cambios omitidos)" if skipped else ""))
+    for item in result['items']:
+        if 'rejected' in item:
+            print(f"  ⛔ {item['file']}: {item['rejected']}")
+        else:
+            print(f"  - {item['file']}: {item['pages']} págs, ~{planner.format_duration(item['seconds'])}, "
+                  f"{item['credits']:g} créditos")
+    print("Por tipo:")
+    for kind, totals in sorted(result['by_type'].items()):
+        print(f"  {kind}: {totals['files']} archivos, {totals['pages']} págs, "
+              f"~{planner.format_duration(totals['seconds'])}, {totals['credits']:g} créditos")
+    modes = result['pages_by_mode']
+    print(f"Páginas por modo: premium {modes['premium']}, fast {modes['fast']}, local {modes['local']}, "
+          f"reutilizadas {modes['reused']}")
+    print(f"⏱️  Duración estimada: {planner.format_duration(result['estimated_duration_seconds'])} "
+          f"con {result['parallelism']} en paralelo "
+          f"(trabajo total {planner.format_duration(result['estimated_work_seconds'])})")
+    print(f"💳 Créditos estimados: {result['estimated_credits']:g}")
+    if result['rejected']:
+        print(f"⛔ {result['rejected']} archivos serían rechazados por el preflight")
+    if result['unmodeled_files']:
+        print(f"ℹ️  {result['unmodeled_files']} archivos sin historial de latencia: se usan "
+              f"{planner.PLANNER_DEFAULT_SECONDS_PER_PAGE:g}s por página")
+
+def process_files(input_root=None, output_root=None, recursive=False, include=(), exclude=(),
+                  jobs=1, since=None, summary_writer=None, quiet=False):
+    """Convert every supported file under input_root into output_root.
+
+    Runs `jobs` conversions in parallel (the key pool still caps parses per
+    API key) and stops early on repeated rate limit or consecutive errors.
+    Returns the run summary dict.
+    """
+    input_root = input_root or input_dir
+    output_root = output_root or output_dir
+    started = time.time()
+    summary = {
+        'input_dir': input_root,
+        'output_dir': output_root,
+        'total': 0,
+        'ok': 0,
+        'failed': 0,
+        'rejected': 0,
+        'skipped': 0,
+        'rate_limit_errors': 0,
+        'retries': 0,
+        'pages': 0,
+        'pages_reused': 0,
+        'stopped': None,
+        'seconds': 0.0,
+    }
+
+    input_files, skipped = select_files(input_root, output_root, recursive, include, exclude, since)
+    summary['skipped'] = len(skipped)
+    if summary_writer:
+        for rel_path in skipped:
+            summary_writer.record({'file': rel_path, 'status': 'skipped'})
+    summary['total'] = len(input_files)
+
+    print(f"Archivos encontrados para procesar: {len(input_files)}"
+          + (f" ({summary['skipped']} sin cambios omitidos)" if summary['skipped'] else ""))
     for file in input_files:
         print(f"  - {file}")
 
     if not input_files:
         print("❌ No se encontraron archivos para procesar.")
-        return False
+        summary['seconds'] = round(time.time() - started, 3)
+        return summary
 
-    # Process each file
-    rate_limit_errors = 0
+    progress = ProgressBar(len(input_files)) if quiet else None
     max_rate_limit_errors = 3  # Stop after 3 consecutive rate limit errors
+    rate_limit_streak = 0
     consecutive_errors = 0
-    successful_files = 0
     failed_files = []
+    finished = 0
+    pending = deque(enumerate(input_files, 1))
+    retrying = []  # heap of (due time, file) of failed files waiting for their backoff
+    attempts = {}  # file -> failed attempts so far
+    last_records = {}
 
-    for i, input_file in enumerate(input_files, 1):
-        print(f"\n{'='*60}")
-        print(f"Procesando archivo {i}/{len(input_files)}: {input_file}")
-        print(f"{'='*60}")
-        
-        try:
-            file_path = os.path.join(input_dir, input_file)
-            
-            # Parse the document
-            # https://docs.cloud.llamaindex.ai/llamaparse/presets_and_modes/auto_mode
-            
-            documents = LlamaParse(
-                result_type="markdown",
-                auto_mode=True,
-                auto_mode_trigger_on_image_in_page=True,
-                auto_mode_trigger_on_table_in_page=True,
-            ).load_data(file_path)
-            
-            base_documents = LlamaParse(result_type="markdown").load_data(file_path)
-            
-            # Generate page nodes (if needed for other processing)
-            page_nodes = get_page_nodes(documents)
-            base_page_nodes = get_page_nodes(base_documents)
-            
-            # Generate output file path
-            input_filename = os.path.splitext(input_file)[0]  # Get filename without extension
-            output_filename = f"{input_filename}.md"
-            output_path = os.path.join(output_dir, output_filename)
-            
-            # Combine all document content into markdown format
-            markdown_content = ""
-            for doc_idx, doc in enumerate(documents):
-                if doc_idx > 0:
-                    markdown_content += "\n\n---\n\n"  # Page separator
-                markdown_content += doc.text
-            
-            # Write markdown content to output file
-            with open(output_path, 'w', encoding='utf-8') as f:
-                f.write(markdown_content)
-            
-            # Verify file was created successfully and has content
-            if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-                print(f"✅ Archivo generado exitosamente: {output_filename}")
-                successful_files += 1
-                consecutive_errors = 0  # Reset consecutive error counter
+    def submit(executor, running, count):
+        # Due retries first, then new files
+        while count > 0 and retrying and retrying[0][0] <= time.time():
+            _, rel_path = heapq.heappop(retrying)
+            print(f"\n🔁 Reintentando {rel_path} (intento {attempts[rel_path] + 1}/{retry_queue.RETRY_MAX_ATTEMPTS})")
+            running.add(executor.submit(convert_many, input_root, output_root, [rel_path]))
+            count -= 1
+        while count > 0 and pending:
+            batch = [pending.popleft()]
+            # Small files next in line join the same composite parse (MICRO_BATCH_ENABLED)
+            group = micro_batch.group_of(os.path.join(input_root, batch[0][1]))
+            if group is not None:
+                total_bytes = os.path.getsize(os.path.join(input_root, batch[0][1]))
+                while pending and micro_batch.group_of(os.path.join(input_root, pending[0][1])) == group:
+                    size = os.path.getsize(os.path.join(input_root, pending[0][1]))
+                    if not micro_batch.fits(group, len(batch), total_bytes, size):
+                        break
+                    batch.append(pending.popleft())
+                    total_bytes += size
+            print(f"\n{'='*60}")
+            if len(batch) == 1:
+                print(f"Procesando archivo {batch[0][0]}/{len(input_files)}: {batch[0][1]}")
             else:
-                print(f"⚠️  Archivo creado pero está vacío: {output_filename}")
-                failed_files.append(input_file)
-                consecutive_errors += 1
-            
-        except Exception as e:
-            error_message = str(e)
-            print(f"❌ Error procesando {input_file}: {error_message}")
-            failed_files.append(input_file)
+                print(f"Procesando archivos {batch[0][0]}-{batch[-1][0]}/{len(input_files)} en un lote: "
+                      f"{', '.join(rel_path for _, rel_path in batch)}")
+            print(f"{'='*60}")
+            running.add(executor.submit(convert_many, input_root, output_root, [rel_path for _, rel_path in batch]))
+            count -= 1
+
+    def schedule_retry(record):
+        """Queue a failed file again after its backoff. False if it is permanent or out of attempts."""
+        failures = attempts.get(record['file'], 0) + 1
+        if (summary['stopped'] is not None or record['error_class'] == retry_queue.PERMANENT
+                or failures >= retry_queue.RETRY_MAX_ATTEMPTS):
+            return False
+        attempts[record['file']] = failures
+        last_records[record['file']] = record
+        delay = retry_queue.backoff(failures, record['error_class'])
+        heapq.heappush(retrying, (time.time() + delay, record['file']))
+        print(f"🔁 {record['file']}: {record['error']} (reintento en {delay:.0f}s)")
+        return True
+
+    def finish(record):
+        nonlocal finished, consecutive_errors, rate_limit_streak
+        failures = attempts.pop(record['file'], 0)
+        record.setdefault('attempts', failures + 1)
+        finished += 1
+        _print_record(record)
+        if summary_writer:
+            summary_writer.record(record)
+
+        if record['status'] == 'ok':
+            summary['ok'] += 1
+            summary['pages'] += record['pages']
+            summary['pages_reused'] += record['pages_reused']
+            consecutive_errors = 0  # Reset consecutive error counter
+            rate_limit_streak = 0
+        elif record['status'] == 'rejected':
+            # Rejected locally: it doesn't count as a consecutive error
+            summary['rejected'] += 1
+            failed_files.append(record['file'])
+        else:
+            summary['failed'] += 1
+            failed_files.append(record['file'])
             consecutive_errors += 1
-            
-            # Check if it's a rate limit error
-            if is_rate_limit_error(e):
-                rate_limit_errors += 1
-                print(f"🚫 Error de límite de API detectado (Error #{rate_limit_errors})")
-                
-                if rate_limit_errors >= max_rate_limit_errors:
-                    print(f"\n{'='*60}")
-                    print("🛑 PROCESO DETENIDO")
-                    print(f"{'='*60}")
-                    print(f"❌ Se han detectado {rate_limit_errors} errores consecutivos de límite de API.")
-                    print("💡 Recomendaciones:")
-                    print("   1. Espera algunos minutos antes de volver a procesar")
-                    print("   2. Considera usar una API key diferente")
-                    print("   3. Reduce la cantidad de archivos a procesar por lote")
-                    print("   4. Verifica tu plan de suscripción de Llama Cloud")
-                    break
-                else:
-                    # Wait before continuing with next file
-                    wait_for_rate_limit_reset(30)
-            
-            # Stop if too many consecutive errors
-            if consecutive_errors >= 5:
-                print(f"\n{'='*60}")
-                print("🛑 PROCESO DETENIDO POR ERRORES CONSECUTIVOS")
-                print(f"{'='*60}")
-                print(f"❌ Se han producido {consecutive_errors} errores consecutivos.")
-                print("💡 Revisa los archivos y la configuración antes de continuar.")
-                break
-            
-            continue
+            if consecutive_errors >= 5 and summary['stopped'] is None:
+                summary['stopped'] = 'consecutive_errors'
+
+        if progress:
+            progress.update(finished, summary['failed'] + summary['rejected'])
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        running = set()
+        submit(executor, running, max(1, jobs))
+        while running or (retrying and summary['stopped'] is None):
+            # Wake up when the next retry is due, even if nothing finished
+            timeout = max(0.0, retrying[0][0] - time.time()) if retrying else None
+            if running:
+                done, running = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            else:
+                time.sleep(timeout)
+                done = set()
+            for record in (record for future in done for record in future.result()):
+                if record['status'] == 'rate_limited':
+                    summary['rate_limit_errors'] += 1
+                    rate_limit_streak += 1
+                    print(f"🚫 Error de límite de API detectado (Error #{rate_limit_streak})")
+                    if rate_limit_streak >= max_rate_limit_errors:
+                        summary['stopped'] = 'rate_limit'
+                if record['status'] in ('failed', 'rate_limited') and schedule_retry(record):
+                    # Transient failure: the pool moves on to other files while its backoff runs
+                    summary['retries'] += 1
+                    continue
+                finish(record)
 
-        # Add delay between files if configured
-        if delay_between_files > 0 and i < len(input_files):  # Don't delay after last file
-            print(f"⏳ Esperando {delay_between_files} segundos antes del siguiente archivo...")
-            time.sleep(delay_between_files)
+            if summary['stopped'] is None:
+                # Add delay between files if configured
+                if delay_between_files > 0 and finished < len(input_files):
+                    print(f"⏳ Esperando {delay_between_files} segundos antes del siguiente archivo...")
+                    time.sleep(delay_between_files)
+                submit(executor, running, max(1, jobs) - len(running))
+
+    # Stopped with retries still waiting: they end with their last error
+    for _, rel_path in sorted(retrying):
+        finish(dict(last_records[rel_path], attempts=attempts[rel_path]))
+
+    if progress:
+        progress.close()
+
+    if summary['stopped'] == 'rate_limit':
+        print(f"\n{'='*60}")
+        print("🛑 PROCESO DETENIDO")
+        print(f"{'='*60}")
+        print(f"❌ Se han detectado {rate_limit_streak} errores consecutivos de límite de API.")
+        print("💡 Recomendaciones:")
+        print("   1. Espera algunos minutos antes de volver a procesar")
+        print("   2. Agrega más API keys en LLAMA_CLOUD_API_KEYS")
+        print("   3. Reduce la cantidad de archivos a procesar por lote")
+        print("   4. Verifica tu plan de suscripción de Llama Cloud")
+    elif summary['stopped'] == 'consecutive_errors':
+        print(f"\n{'='*60}")
+        print("🛑 PROCESO DETENIDO POR ERRORES CONSECUTIVOS")
+        print(f"{'='*60}")
+        print(f"❌ Se han producido {consecutive_errors} errores consecutivos.")
+        print("💡 Revisa los archivos y la configuración antes de continuar.")
 
     # Clean up empty files
     print(f"\n{'='*60}")
     print("🧹 Limpiando archivos vacíos...")
     print(f"{'='*60}")
-    cleaned_files = cleanup_empty_files(output_dir)
+    output_dirs = {os.path.dirname(output_path_for(rel_path, output_root)) for rel_path in input_files}
+    cleaned_files = [name for directory in sorted(output_dirs) for name in cleanup_empty_files(directory)]
     if cleaned_files:
         print(f"🗑️  Archivos vacíos eliminados: {len(cleaned_files)}")
         for file in cleaned_files:
@@ -260,31 +906,118 @@ def process_files():
     print(f"\n{'='*60}")
     print("📊 RESUMEN DEL PROCESAMIENTO")
     print(f"{'='*60}")
-    print(f"✅ Archivos procesados exitosamente: {successful_files}")
+    print(f"✅ Archivos procesados exitosamente: {summary['ok']}")
     print(f"❌ Archivos que fallaron: {len(failed_files)}")
-    print(f"🚫 Errores de límite de API: {rate_limit_errors}")
+    print(f"🚫 Errores de límite de API: {summary['rate_limit_errors']}")
+    if summary['retries']:
+        print(f"🔁 Reintentos: {summary['retries']}")
+    if summary['pages_reused']:
+        print(f"♻️  Páginas reutilizadas sin parsear: {summary['pages_reused']} de {summary['pages']}")
 
     if failed_files:
         print(f"\n📋 Archivos que no se pudieron procesar:")
         for file in failed_files:
             print(f"   - {file}")
 
-    if rate_limit_errors > 0:
+    if summary['rate_limit_errors'] > 0:
         print(f"\n💡 RECOMENDACIONES:")
         print("   - Espera al menos 15-30 minutos antes del siguiente procesamiento")
         print("   - Considera procesar archivos en lotes más pequeños")
         print("   - Verifica tu plan de suscripción de Llama Cloud API")
 
-    if successful_files > 0:
+    if summary['ok'] > 0:
         print("🎉 Algunos archivos se procesaron exitosamente!")
-        return True
     else:
         print("⚠️  No se pudo procesar ningún archivo completamente.")
-        return False
-        
     print(f"{'='*60}")
 
+    summary['seconds'] = round(time.time() - started, 3)
+    return summary
+
+def build_parser():
+    """Command line options of the batch converter."""
+    parser = argparse.ArgumentParser(
+        description="Convierte archivos a markdown con LlamaParse.",
+        epilog="Ejemplo: python file_to_md.py docs -o md -r --include '*.pdf' -j 4 --since changed -q --summary run.jsonl"
+    )
+    parser.add_argument('input', nargs='?', default=input_dir,
+                        help=f"directorio de entrada (por defecto INPUT_DIR={input_dir})")
+    parser.add_argument('-o', '--output', default=output_dir,
+                        help=f"directorio de salida (por defecto OUTPUT_DIR={output_dir})")
+    parser.add_argument('-r', '--recursive', action='store_true',
+                        help="recorrer subdirectorios y replicar su estructura en la salida")
+    parser.add_argument('--include', action='append', default=[], metavar='GLOB',
+                        help="procesar solo archivos que coincidan (repetible)")
+    parser.add_argument('--exclude', action='append', default=[], metavar='GLOB',
+                        help="omitir archivos o directorios que coincidan (repetible)")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="archivos convertidos en paralelo")
+    parser.add_argument('--since', type=parse_since, metavar='CUANDO',
+                        help='"changed" (sin salida o modificados después de ella), una duración (30m, 12h, 7d) o una fecha ISO')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help="solo una barra de progreso en stderr")
+    parser.add_argument('--summary', metavar='RUTA',
+                        help='escribir el resumen por archivo en RUTA ("-" para stdout)')
+    parser.add_argument('--summary-format', choices=['json', 'jsonl'],
+                        help="formato del resumen (por defecto según la extensión; json)")
+    parser.add_argument('--plan', nargs='?', const='text', choices=['text', 'json'],
+                        help="no convertir: estimar duración y créditos de la corrida (json para salida legible por máquina)")
+    return parser
+
+def plan_files(args):
+    """--plan: dry run of the files the same arguments would convert."""
+    input_files, skipped = select_files(args.input, args.output, args.recursive,
+                                        args.include, args.exclude, args.since)
+    # Warnings (e.g. unreadable PDFs) must not end up in the JSON output
+    with redirect_stdout(sys.stderr if args.plan == 'json' else sys.stdout):
+        result = planner.plan([os.path.join(args.input, rel_path) for rel_path in input_files],
+                              concurrency=max(1, args.jobs), delay=delay_between_files)
+    # Report files by their path relative to the input directory
+    for item, rel_path in zip(result['items'], input_files):
+        item['file'] = rel_path
+    if args.plan == 'json':
+        json.dump({**result, 'skipped': len(skipped)}, sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write("\n")
+    else:
+        print_plan(result, len(skipped))
+    return 0
+
+def main(argv=None):
+    """Run the batch converter. Exit code 0 if every file converted, 1 otherwise."""
+    args = build_parser().parse_args(argv)
+    if args.plan:
+        return plan_files(args)
+    stdout = sys.stdout
+    summary_writer = SummaryWriter(args.summary, args.summary_format, stdout) if args.summary else None
+
+    # Keep stdout clean for the summary: the log is dropped (--quiet) or sent to stderr
+    if args.quiet:
+        log = open(os.devnull, 'w')
+    elif summary_writer and summary_writer.to_stdout:
+        log = sys.stderr
+    else:
+        log = stdout
+    try:
+        with redirect_stdout(log):
+            summary = process_files(
+                args.input, args.output,
+                recursive=args.recursive,
+                include=args.include,
+                exclude=args.exclude,
+                jobs=args.jobs,
+                since=args.since,
+                summary_writer=summary_writer,
+                quiet=args.quiet
+            )
+    finally:
+        if log is not stdout and log is not sys.stderr:
+            log.close()
+
+    if summary_writer:
+        summary_writer.close(summary)
+    return 0 if summary['failed'] == 0 and summary['rejected'] == 0 and summary['stopped'] is None else 1
+
 
 # Only execute if run directly, not when imported
 if __name__ == "__main__":
-    process_files()
\ No newline at end of file
+    sys.exit(main())
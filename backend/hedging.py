@@ -0,0 +1,179 @@
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Per-file deadline: base + per page (or per MB when the page count is unknown), capped
+PARSE_TIMEOUT_BASE_SECONDS = float(os.getenv("PARSE_TIMEOUT_BASE_SECONDS", "120"))
+PARSE_TIMEOUT_PER_PAGE_SECONDS = float(os.getenv("PARSE_TIMEOUT_PER_PAGE_SECONDS", "20"))
+PARSE_TIMEOUT_PER_MB_SECONDS = float(os.getenv("PARSE_TIMEOUT_PER_MB_SECONDS", "30"))
+PARSE_TIMEOUT_MAX_SECONDS = float(os.getenv("PARSE_TIMEOUT_MAX_SECONDS", "3600"))
+# Duplicate a parse that runs past the latency percentile of its size class
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "true").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+# Hedges allowed as a fraction of all parses (each hedge spends credits again)
+HEDGE_MAX_FRACTION = float(os.getenv("HEDGE_MAX_FRACTION", "0.05"))
+# Observed parses needed in a size class before it is hedged
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_POOL_WORKERS = int(os.getenv("HEDGE_POOL_WORKERS", "16"))
+
+PAGE_BUCKETS = (1, 5, 20, 100)
+MB_BUCKETS = (1, 10, 50)
+
+_executor = ThreadPoolExecutor(max_workers=HEDGE_POOL_WORKERS, thread_name_prefix='parse')
+_lock = threading.Lock()
+_latencies = {}  # size class -> recent durations
+_counters = {'parses': 0, 'hedges': 0, 'hedge_wins': 0, 'timeouts': 0}
+
+
+class ParseTimeoutError(Exception):
+    """A parse didn't finish before its deadline."""
+
+
+def size_class(mode, pages=None, size_bytes=0):
+    """Bucket a parse by mode and page count (or MB) so latencies are comparable."""
+    if pages:
+        bucket = next((f"<={limit}p" for limit in PAGE_BUCKETS if pages <= limit), f">{PAGE_BUCKETS[-1]}p")
+    else:
+        mb = size_bytes / (1024 * 1024)
+        bucket = next((f"<={limit}MB" for limit in MB_BUCKETS if mb <= limit), f">{MB_BUCKETS[-1]}MB")
+    return f"{mode}:{bucket}"
+
+
+def deadline(pages=None, size_bytes=0):
+    """Seconds a parse may take, scaled by its page count or size."""
+    if pages:
+        scaled = PARSE_TIMEOUT_PER_PAGE_SECONDS * pages
+    else:
+        scaled = PARSE_TIMEOUT_PER_MB_SECONDS * size_bytes / (1024 * 1024)
+    return min(PARSE_TIMEOUT_MAX_SECONDS, PARSE_TIMEOUT_BASE_SECONDS + scaled)
+
+
+def percentile(cls):
+    """Observed latency percentile of a size class, or None without enough samples."""
+    with _lock:
+        samples = sorted(_latencies.get(cls, ()))
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return None
+    index = min(len(samples) - 1, int(round(HEDGE_PERCENTILE / 100 * (len(samples) - 1))))
+    return samples[index]
+
+
+def record(cls, seconds):
+    with _lock:
+        _latencies.setdefault(cls, deque(maxlen=500)).append(seconds)
+
+
+def _hedge_allowed():
+    with _lock:
+        if _counters['hedges'] + 1 > HEDGE_MAX_FRACTION * _counters['parses']:
+            return False
+        _counters['hedges'] += 1
+        return True
+
+
+def _first_result(futures, timeout):
+    """Wait for the first successful future. Raises its error if all failed."""
+    pending = set(futures)
+    error = None
+    end = time.time() + timeout
+    while pending:
+        done, pending = wait(pending, timeout=max(0.0, end - time.time()), return_when=FIRST_COMPLETED)
+        if not done:
+            return None, None
+        for future in done:
+            if future.exception() is None:
+                return future, None
+            error = error or future.exception()
+    return None, error
+
+
+def run(call, cls, limit, label='', can_hedge=None, hedge_call=None):
+    """Run call(begin) with a deadline, hedging it once if it straggles.
+
+    The call runs in the parse pool and calls begin() once it is ready to
+    parse (e.g. holding an API key): the deadline and the recorded latency
+    start there, so waiting for a pool thread or a key doesn't count. That
+    wait is itself bounded by limit; if begin() comes later it returns
+    False and the call must give up without parsing. When the call runs
+    past the size class percentile a duplicate (hedge_call(begin),
+    call(begin) by default, whose begin() returns False once this run is
+    over) is started within the HEDGE_MAX_FRACTION budget, and only if
+    can_hedge() says there is capacity for it; whichever finishes first
+    wins. A parse still running at the deadline raises ParseTimeoutError;
+    its thread is abandoned and ends when the client's own max_timeout
+    expires.
+    """
+    with _lock:
+        _counters['parses'] += 1
+    state = {'started': None, 'over': False}
+    state_lock = threading.Lock()
+    ready = threading.Event()
+
+    def begin():
+        with state_lock:
+            if state['over']:
+                return False
+            if state['started'] is None:
+                state['started'] = time.time()
+            ready.set()
+            return True
+
+    def begin_hedge():
+        with state_lock:
+            return not state['over']
+
+    def timed_out():
+        with _lock:
+            _counters['timeouts'] += 1
+        return ParseTimeoutError(f"Tiempo límite de parseo excedido ({limit:.0f}s) para {label}")
+
+    primary = _executor.submit(call, begin)
+    # A call that fails before begin() (no key at all...) ends the wait too
+    primary.add_done_callback(lambda future: ready.set())
+    try:
+        ready.wait(limit)
+        with state_lock:
+            started = state['started']
+            if started is None and not primary.done():
+                state['over'] = True  # begin() now refuses: the call won't parse
+        if started is None:
+            if not primary.done():
+                raise timed_out()
+            return primary.result()
+        futures = [primary]
+
+        threshold = percentile(cls) if HEDGE_ENABLED else None
+        if threshold is not None and threshold < limit:
+            winner, error = _first_result(futures, threshold - (time.time() - started))
+            if winner is None and error is None and (can_hedge is None or can_hedge()) and _hedge_allowed():
+                print(f"🐢 {label} supera el p{HEDGE_PERCENTILE:.0f} ({threshold:.0f}s) de {cls}: se lanza una copia")
+                futures.append(_executor.submit(hedge_call or call, begin_hedge))
+
+        winner, error = _first_result(futures, limit - (time.time() - started))
+        if error is not None:
+            raise error
+        if winner is None:
+            raise timed_out()
+
+        record(cls, time.time() - started)
+        if winner is not primary:
+            with _lock:
+                _counters['hedge_wins'] += 1
+        return winner.result()
+    finally:
+        with state_lock:
+            state['over'] = True
+
+
+def stats():
+    """Hedge counters and latency percentiles per size class for the metrics endpoint."""
+    with _lock:
+        counters = dict(_counters)
+        classes = list(_latencies)
+    return {
+        **counters,
+        'max_fraction': HEDGE_MAX_FRACTION,
+        'percentiles': {cls: percentile(cls) for cls in classes},
+    }
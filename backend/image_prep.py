@@ -0,0 +1,137 @@
+import os
+import atexit
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import scheduler
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # without Pillow images are sent upstream unchanged
+    Image = ImageOps = None
+
+# Downscale/recompress images before sending them upstream
+IMAGE_PREP_ENABLED = os.getenv("IMAGE_PREP_ENABLED", "true").lower() == "true"
+# Longest side in pixels after downscaling
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", "3000"))
+# Images scanned above this DPI are downscaled to it
+IMAGE_MAX_DPI = int(os.getenv("IMAGE_MAX_DPI", "300"))
+# Encoding for lossless inputs (BMP/TIFF): "png" keeps them lossless, "jpeg" is smaller
+IMAGE_TARGET_FORMAT = os.getenv("IMAGE_TARGET_FORMAT", "png").lower()
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+IMAGE_PREP_WORKERS = int(os.getenv("IMAGE_PREP_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+PREP_DIR = os.path.join(scheduler.STATE_DIR, "prepared")
+
+# Formats we can rewrite; everything else (svg, html...) is passed through
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.webp', '.gif'}
+LOSSLESS_EXTENSIONS = {'.bmp', '.tiff'}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=IMAGE_PREP_WORKERS)
+            atexit.register(_pool.shutdown, wait=False)
+        return _pool
+
+
+def _prepare(file_path, ext, out_dir, options):
+    """Worker process: downscale, re-encode and strip metadata. Returns the new path or None."""
+    with Image.open(file_path) as img:
+        if getattr(img, 'n_frames', 1) > 1:
+            return None  # multi-page TIFF / animated GIF: keep every frame as is
+        # Apply the EXIF orientation to the pixels: it is dropped with the rest of the metadata
+        img = ImageOps.exif_transpose(img)
+
+        scale = 1.0
+        dpi = img.info.get('dpi')
+        if dpi and dpi[0] and float(dpi[0]) > options['max_dpi']:
+            scale = options['max_dpi'] / float(dpi[0])
+        longest = max(img.size)
+        if longest * scale > options['max_dimension']:
+            scale = options['max_dimension'] / longest
+
+        if ext in LOSSLESS_EXTENSIONS:
+            target = options['target_format']
+        elif ext in ('.jpg', '.jpeg'):
+            target = 'jpeg'
+        elif ext == '.webp':
+            target = 'webp'
+        else:
+            target = 'png'
+
+        if scale >= 1.0 and ext not in LOSSLESS_EXTENSIONS and not img.info.get('exif'):
+            return None  # nothing to gain
+
+        if scale < 1.0:
+            img = img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))),
+                             Image.LANCZOS)
+        if target == 'jpeg' and img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+
+        # Saving a fresh copy without passing info/exif drops all metadata
+        out_ext = {'jpeg': '.jpg', 'png': '.png', 'webp': '.webp'}[target]
+        digest = hashlib.sha1(os.path.abspath(file_path).encode('utf-8')).hexdigest()[:16]
+        out_path = os.path.join(out_dir, f"{digest}{out_ext}")
+        if target == 'jpeg':
+            img.save(out_path, 'JPEG', quality=options['jpeg_quality'], optimize=True)
+        elif target == 'webp':
+            img.save(out_path, 'WEBP', quality=options['jpeg_quality'])
+        else:
+            img.save(out_path, 'PNG', optimize=True)
+        return out_path
+
+
+def prepare(file_path, upload_name):
+    """Shrink an image before it is sent upstream.
+
+    Runs in a process pool so it doesn't hold the GIL of the worker threads.
+    Returns a dict with 'path' and 'file_name' to parse, 'original_bytes',
+    'prepared_bytes' and 'bytes_saved', or None if the original should be used.
+    The caller removes the prepared file with cleanup() once parsed.
+    """
+    ext = os.path.splitext(upload_name)[1].lower()
+    if not IMAGE_PREP_ENABLED or Image is None or ext not in IMAGE_EXTENSIONS:
+        return None
+
+    os.makedirs(PREP_DIR, exist_ok=True)
+    options = {
+        'max_dimension': IMAGE_MAX_DIMENSION,
+        'max_dpi': IMAGE_MAX_DPI,
+        'target_format': 'jpeg' if IMAGE_TARGET_FORMAT in ('jpg', 'jpeg') else 'png',
+        'jpeg_quality': IMAGE_JPEG_QUALITY,
+    }
+    try:
+        out_path = _get_pool().submit(_prepare, file_path, ext, PREP_DIR, options).result()
+    except Exception as e:
+        print(f"⚠️  No se pudo optimizar la imagen {upload_name}: {e}")
+        return None
+    if out_path is None:
+        return None
+
+    original_bytes = os.path.getsize(file_path)
+    prepared_bytes = os.path.getsize(out_path)
+    if prepared_bytes >= original_bytes:
+        cleanup(out_path)
+        return None
+
+    return {
+        'path': out_path,
+        'file_name': os.path.splitext(upload_name)[0] + os.path.splitext(out_path)[1],
+        'original_bytes': original_bytes,
+        'prepared_bytes': prepared_bytes,
+        'bytes_saved': original_bytes - prepared_bytes,
+    }
+
+
+def cleanup(prepared_path):
+    """Remove a prepared image once it has been parsed."""
+    try:
+        os.remove(prepared_path)
+    except OSError:
+        pass
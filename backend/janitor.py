@@ -0,0 +1,248 @@
+import os
+import time
+import threading
+import output_store
+import chunk_export
+
+# Disk quotas in bytes per area (0 = unlimited)
+QUOTA_INPUT_BYTES = int(os.getenv("QUOTA_INPUT_BYTES", "0"))
+QUOTA_OUTPUT_BYTES = int(os.getenv("QUOTA_OUTPUT_BYTES", "0"))
+QUOTA_CACHE_BYTES = int(os.getenv("QUOTA_CACHE_BYTES", "0"))
+# Once over quota, evict down to this fraction of it so the janitor doesn't run on every write
+QUOTA_LOW_WATERMARK = float(os.getenv("QUOTA_LOW_WATERMARK", "0.9"))
+JANITOR_INTERVAL_SECONDS = float(os.getenv("JANITOR_INTERVAL_SECONDS", "60"))
+# Only evict inputs whose markdown output exists and is newer than the input
+JANITOR_KEEP_UNCONVERTED = os.getenv("JANITOR_KEEP_UNCONVERTED", "true").lower() == "true"
+
+AREAS = ('input', 'output', 'cache')
+
+
+def _walk_size(path):
+    """Total bytes of the files under path."""
+    total = 0
+    pending = [path]
+    while pending:
+        try:
+            entries = os.scandir(pending.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        total += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    continue
+    return total
+
+
+def _stem(filename):
+    return os.path.splitext(filename)[0]
+
+
+class Janitor:
+    """Keep the input, output and cache folders under their disk quotas.
+
+    Files are evicted least recently used first: the last use is the later of
+    the file's mtime and the last time it was served (see touch()). Workers
+    hold() a file for as long as it is being converted; held, queued
+    (is_pending) and, with JANITOR_KEEP_UNCONVERTED, not yet converted inputs
+    are never evicted. Holding and evicting share one lock, so a file can't
+    be taken by a worker while it is being deleted.
+
+    Inputs and outputs are found by listing their folders, unless `stores`
+    ({'input': ..., 'output': ...} storages, see storage.py) lay them out
+    in subdirectories; then names and paths come from the stores.
+    """
+
+    def __init__(self, input_dir, output_dir, cache_dir, quotas=None, is_pending=None, on_evict=None, stores=None):
+        self.dirs = {'input': input_dir, 'output': output_dir, 'cache': cache_dir}
+        self.stores = stores or {}
+        self.quotas = quotas or {
+            'input': QUOTA_INPUT_BYTES,
+            'output': QUOTA_OUTPUT_BYTES,
+            'cache': QUOTA_CACHE_BYTES,
+        }
+        self.is_pending = is_pending or (lambda filename: False)
+        self.on_evict = on_evict
+        self.lock = threading.RLock()
+        self._held = {}  # file stem -> (count, first hold time)
+        self._touched = {}  # path -> last time it was served
+        self._wake = threading.Event()
+        self._thread = None
+        self.counters = {
+            'runs': 0,
+            'last_run': None,
+            'evicted_files': {area: 0 for area in AREAS},
+            'evicted_bytes': {area: 0 for area in AREAS},
+            'skipped_in_use': 0,
+        }
+
+    def hold(self, filename):
+        """Protect an input (and its output) from eviction while it is converted."""
+        with self.lock:
+            count, since = self._held.get(_stem(filename), (0, time.time()))
+            self._held[_stem(filename)] = (count + 1, since)
+
+    def release(self, filename):
+        with self.lock:
+            count, since = self._held.get(_stem(filename), (1, None))
+            if count <= 1:
+                self._held.pop(_stem(filename), None)
+            else:
+                self._held[_stem(filename)] = (count - 1, since)
+
+    def touch(self, path):
+        """Record that a file was read so it counts as recently used."""
+        self._touched[os.path.abspath(path)] = time.time()
+
+    def _last_used(self, path, mtime):
+        return max(mtime, self._touched.get(os.path.abspath(path), 0))
+
+    def _candidates(self, area):
+        """(last used, size, name, path) of every evictable unit in an area."""
+        directory = self.dirs[area]
+        if not os.path.isdir(directory):
+            return []
+        candidates = []
+        store = self.stores.get(area)
+        if store is not None:
+            for entry in store.list():
+                if area == 'output' and not entry['name'].endswith('.md'):
+                    continue
+                path = store.path(entry['name'])
+                candidates.append((self._last_used(path, entry['modified']), entry['size'], entry['name'], path))
+        elif area == 'output':
+            for name in output_store.list_markdown(directory):
+                path = os.path.join(directory, name)
+                try:
+                    size, mtime = output_store.stat_markdown(path)
+                except OSError:
+                    continue
+                candidates.append((self._last_used(path, mtime), size, name, path))
+        elif area == 'input':
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_file() and not entry.name.startswith('.'):
+                        stat = entry.stat()
+                        candidates.append((self._last_used(entry.path, stat.st_mtime), stat.st_size,
+                                           entry.name, entry.path))
+        else:
+            for root, _, files in os.walk(directory):
+                for name in files:
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    candidates.append((stat.st_mtime, stat.st_size, name, path))
+        return sorted(candidates)
+
+    def _path(self, area, name):
+        store = self.stores.get(area)
+        return store.path(name) if store is not None else os.path.join(self.dirs[area], name)
+
+    def _evictable(self, area, name, path):
+        if area == 'cache':
+            # Cache entries (prepared images) created since the oldest running job may be in use
+            starts = [since for _, since in self._held.values()]
+            return not starts or os.path.getmtime(path) < min(starts)
+        if _stem(name) in self._held:
+            return False
+        if area == 'input':
+            if self.is_pending(name):
+                return False
+            if JANITOR_KEEP_UNCONVERTED:
+                output_path = self._path('output', f"{_stem(name)}.md")
+                if not output_store.exists(output_path) or not output_store.has_content(output_path):
+                    return False
+                if os.path.getmtime(path) > output_store.stat_markdown(output_path)[1]:
+                    return False
+        return True
+
+    def _remove(self, area, path):
+        if area == 'output':
+            output_store.remove_markdown(path)
+            chunk_export.remove(path)
+        else:
+            os.remove(path)
+        self._touched.pop(os.path.abspath(path), None)
+
+    def usage(self):
+        """Bytes used per area."""
+        return {area: _walk_size(directory) for area, directory in self.dirs.items()}
+
+    def enforce(self, area):
+        """Evict LRU files of one area until it is under its low watermark."""
+        quota = self.quotas.get(area) or 0
+        if quota <= 0:
+            return 0
+        used = _walk_size(self.dirs[area])
+        if used <= quota:
+            return 0
+        target = quota * QUOTA_LOW_WATERMARK
+        evicted = 0
+        for last_used, size, name, path in self._candidates(area):
+            if used <= target:
+                break
+            with self.lock:
+                try:
+                    if not self._evictable(area, name, path):
+                        self.counters['skipped_in_use'] += 1
+                        continue
+                    self._remove(area, path)
+                    if area in self.stores:
+                        self.stores[area].delete(name)  # drops it from the store's index
+                except FileNotFoundError:
+                    continue
+            used -= size
+            evicted += 1
+            self.counters['evicted_files'][area] += 1
+            self.counters['evicted_bytes'][area] += size
+            if self.on_evict:
+                self.on_evict(area, name)
+        if used > quota:
+            print(f"⚠️  {area}: {used} bytes en uso sobre la cuota de {quota}; el resto está en uso o sin convertir")
+        return evicted
+
+    def run_once(self):
+        for area in AREAS:
+            try:
+                evicted = self.enforce(area)
+                if evicted:
+                    print(f"🧹 {area}: {evicted} archivos desalojados por cuota de disco")
+            except Exception as e:
+                print(f"⚠️  Error en el janitor ({area}): {e}")
+        self.counters['runs'] += 1
+        self.counters['last_run'] = time.time()
+
+    def wake(self):
+        """Run the janitor now (e.g. after a large upload)."""
+        self._wake.set()
+
+    def _loop(self):
+        while True:
+            self._wake.wait(JANITOR_INTERVAL_SECONDS)
+            self._wake.clear()
+            self.run_once()
+
+    def start(self):
+        """Start the background janitor if any quota is configured."""
+        if self._thread is None and any(self.quotas.values()):
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+        return self
+
+    def stats(self):
+        """Usage, quotas and eviction counters for the metrics endpoint."""
+        with self.lock:
+            held = len(self._held)
+        return {
+            'enabled': self._thread is not None,
+            'usage_bytes': self.usage(),
+            'quota_bytes': dict(self.quotas),
+            'held_files': held,
+            **self.counters,
+        }
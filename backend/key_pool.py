@@ -0,0 +1,147 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+# Several Llama Cloud keys, comma separated (falls back to LLAMA_CLOUD_API_KEY)
+LLAMA_CLOUD_API_KEYS = os.getenv("LLAMA_CLOUD_API_KEYS", "")
+# Parses running at the same time on one key
+MAX_JOBS_PER_KEY = int(os.getenv("MAX_JOBS_PER_KEY", "1"))
+# Pause for a key after a 429; doubles with each consecutive 429 up to the max
+KEY_COOLDOWN_SECONDS = float(os.getenv("KEY_COOLDOWN_SECONDS", "60"))
+KEY_MAX_COOLDOWN_SECONDS = float(os.getenv("KEY_MAX_COOLDOWN_SECONDS", "900"))
+
+
+class RateLimitedError(Exception):
+    """Every configured key is cooling down after rate limit errors."""
+
+
+def mask(key):
+    """Show only the end of a key in status output."""
+    return f"...{key[-4:]}" if len(key) > 8 else "..."
+
+
+class KeyPool:
+    """Spread parses over several API keys.
+
+    Tracks in-flight jobs, requests and 429s per key. A key that gets a 429
+    cools down (exponentially longer on repeated 429s) and is skipped until
+    then, so work keeps flowing through the healthy keys.
+    """
+
+    def __init__(self, keys, max_jobs_per_key=None):
+        if not keys:
+            raise ValueError("Se necesita al menos una API key")
+        self.max_jobs_per_key = max_jobs_per_key or MAX_JOBS_PER_KEY
+        self._keys = {
+            key: {
+                'in_flight': 0,
+                'requests': 0,
+                'rate_limited': 0,
+                'errors': 0,
+                'consecutive_429': 0,
+                'cooldown_until': 0.0,
+            }
+            for key in keys
+        }
+        self._condition = threading.Condition()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _available(self, now):
+        return [
+            key for key, state in self._keys.items()
+            if state['cooldown_until'] <= now and state['in_flight'] < self.max_jobs_per_key
+        ]
+
+    def cooldown_remaining(self):
+        """Seconds until some key leaves its cooldown (0 if one is usable now)."""
+        with self._condition:
+            now = time.time()
+            return max(0.0, min(state['cooldown_until'] for state in self._keys.values()) - now)
+
+    def has_capacity(self):
+        """Check if a key could be acquired right now without waiting."""
+        with self._condition:
+            return bool(self._available(time.time()))
+
+    def acquire(self):
+        """Take the least loaded usable key, waiting while all healthy keys are busy.
+
+        Raises RateLimitedError if every key is cooling down.
+        """
+        with self._condition:
+            while True:
+                now = time.time()
+                available = self._available(now)
+                if available:
+                    key = min(available, key=lambda k: (self._keys[k]['in_flight'], self._keys[k]['requests']))
+                    self._keys[key]['in_flight'] += 1
+                    self._keys[key]['requests'] += 1
+                    return key
+
+                cooling = [state['cooldown_until'] for state in self._keys.values()]
+                if all(until > now for until in cooling):
+                    raise RateLimitedError(
+                        f"429: todas las API keys están en pausa por límite de API "
+                        f"({min(cooling) - now:.0f}s restantes)"
+                    )
+                self._condition.wait(min((u - now for u in cooling if u > now), default=None))
+
+    def release(self, key, rate_limited=False, failed=False):
+        """Return a key, putting it in cooldown if its request hit the rate limit."""
+        with self._condition:
+            state = self._keys[key]
+            state['in_flight'] -= 1
+            if rate_limited:
+                state['rate_limited'] += 1
+                state['consecutive_429'] += 1
+                cooldown = min(KEY_MAX_COOLDOWN_SECONDS,
+                               KEY_COOLDOWN_SECONDS * 2 ** (state['consecutive_429'] - 1))
+                state['cooldown_until'] = time.time() + cooldown
+            elif failed:
+                state['errors'] += 1
+            else:
+                state['consecutive_429'] = 0
+            self._condition.notify_all()
+
+    @contextmanager
+    def lease(self, is_rate_limit_error):
+        """Context manager around acquire/release that classifies the raised error."""
+        key = self.acquire()
+        try:
+            yield key
+        except Exception as e:
+            self.release(key, rate_limited=is_rate_limit_error(e), failed=True)
+            raise
+        else:
+            self.release(key)
+
+    def stats(self):
+        """Health of every key for status and metrics endpoints."""
+        with self._condition:
+            now = time.time()
+            return [
+                {
+                    'key': mask(key),
+                    'in_flight': state['in_flight'],
+                    'requests': state['requests'],
+                    'rate_limited': state['rate_limited'],
+                    'errors': state['errors'],
+                    'cooldown_remaining': round(max(0.0, state['cooldown_until'] - now), 1),
+                }
+                for key, state in self._keys.items()
+            ]
+
+
+def configured_keys():
+    """Keys from LLAMA_CLOUD_API_KEYS, or the single LLAMA_CLOUD_API_KEY."""
+    keys = [key.strip() for key in LLAMA_CLOUD_API_KEYS.split(',') if key.strip()]
+    if not keys:
+        keys = [os.getenv("LLAMA_CLOUD_API_KEY", "llx-xxx")]
+    return keys
+
+
+# Shared pool used by file_to_md
+pool = KeyPool(configured_keys())
@@ -0,0 +1,369 @@
+import os
+import re
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+import scheduler
+
+# Lease store shared by the workers: "sqlite" or "lockfile"
+LEASE_STORE = os.getenv("LEASE_STORE", "sqlite").lower()
+# Directory of the lease store, on a volume every host of the fleet mounts (required for PROCESSING_MODE=fleet:
+# STATE_DIR is local to each host, and separate stores would let two hosts convert the same file)
+LEASE_PATH = os.getenv("LEASE_PATH", "")
+# Seconds a claim stays valid without a heartbeat
+LEASE_TTL_SECONDS = float(os.getenv("LEASE_TTL_SECONDS", "120"))
+# Claims a file gets before it is marked failed instead of reclaimed once more (a file that keeps killing its worker)
+LEASE_MAX_ATTEMPTS = int(os.getenv("LEASE_MAX_ATTEMPTS", "5"))
+# SQLite journal mode. WAL needs shared memory between the processes, so it is only safe when every
+# worker runs on the same host; keep DELETE on network filesystems (NFS/SMB)
+LEASE_SQLITE_JOURNAL_MODE = os.getenv("LEASE_SQLITE_JOURNAL_MODE", "DELETE").upper()
+
+STATES = ('pending', 'leased', 'done', 'failed')
+
+
+class SQLiteLeaseStore:
+    """Job table in a SQLite database on the shared volume.
+
+    Claims run in an IMMEDIATE transaction so only one worker can take a
+    given job. A lease whose heartbeat is older than its TTL is claimable
+    again, which is how a dead worker's files get reclaimed, up to
+    LEASE_MAX_ATTEMPTS claims.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(LEASE_PATH or scheduler.STATE_DIR, 'leases.sqlite3')
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " filename TEXT PRIMARY KEY, state TEXT NOT NULL, priority INTEGER NOT NULL DEFAULT 0,"
+                " size INTEGER NOT NULL DEFAULT 0, enqueued_at REAL NOT NULL, owner TEXT,"
+                " lease_expires REAL, attempts INTEGER NOT NULL DEFAULT 0, error TEXT, updated_at REAL)"
+            )
+
+    def _connect(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute(f"PRAGMA journal_mode={LEASE_SQLITE_JOURNAL_MODE}")
+            self._local.db = db
+        return _Transaction(db)
+
+    def enqueue(self, filename, priority=0, size=0):
+        """Add or re-add a file as pending (a file currently leased is left alone)."""
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO jobs (filename, state, priority, size, enqueued_at, updated_at)"
+                " VALUES (?, 'pending', ?, ?, ?, ?)"
+                " ON CONFLICT(filename) DO UPDATE SET state='pending', priority=excluded.priority,"
+                " size=excluded.size, enqueued_at=excluded.enqueued_at, attempts=0, error=NULL,"
+                " updated_at=excluded.updated_at"
+                " WHERE jobs.state != 'leased'",
+                (filename, priority, size, now, now)
+            )
+
+    def claim(self, worker_id, ttl=None):
+        """Lease the next pending (or expired) job. Returns the filename or None."""
+        ttl = ttl or LEASE_TTL_SECONDS
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "UPDATE jobs SET state='failed', error=?, owner=NULL, lease_expires=NULL, updated_at=?"
+                " WHERE state='leased' AND lease_expires < ? AND attempts >= ?",
+                (_abandoned_error(LEASE_MAX_ATTEMPTS), now, now, LEASE_MAX_ATTEMPTS)
+            )
+            row = db.execute(
+                "SELECT filename FROM jobs WHERE state = 'pending'"
+                " OR (state = 'leased' AND lease_expires < ?)"
+                " ORDER BY priority DESC, size ASC, enqueued_at ASC LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE jobs SET state='leased', owner=?, lease_expires=?, attempts=attempts+1, updated_at=?"
+                " WHERE filename=?",
+                (worker_id, now + ttl, now, row[0])
+            )
+            return row[0]
+
+    def heartbeat(self, filename, worker_id, ttl=None):
+        """Extend a lease. Returns False if the lease was lost to another worker."""
+        ttl = ttl or LEASE_TTL_SECONDS
+        with self._connect() as db:
+            cursor = db.execute(
+                "UPDATE jobs SET lease_expires=?, updated_at=? WHERE filename=? AND owner=? AND state='leased'",
+                (time.time() + ttl, time.time(), filename, worker_id)
+            )
+            return cursor.rowcount == 1
+
+    def release(self, filename, worker_id):
+        """Give a job back without finishing it (e.g. every API key is throttled)."""
+        with self._connect() as db:
+            # Not an attempt: it doesn't count towards LEASE_MAX_ATTEMPTS
+            db.execute(
+                "UPDATE jobs SET state='pending', owner=NULL, lease_expires=NULL, attempts=MAX(attempts-1, 0),"
+                " updated_at=? WHERE filename=? AND owner=? AND state='leased'",
+                (time.time(), filename, worker_id)
+            )
+
+    def complete(self, filename, worker_id, error=None):
+        """Mark a leased job as done, or failed with an error message."""
+        with self._connect() as db:
+            db.execute(
+                "UPDATE jobs SET state=?, error=?, lease_expires=NULL, updated_at=?"
+                " WHERE filename=? AND owner=? AND state='leased'",
+                ('failed' if error else 'done', error, time.time(), filename, worker_id)
+            )
+
+    def state(self, filename):
+        """Current state of a file's job, or None if it was never queued."""
+        with self._connect() as db:
+            row = db.execute("SELECT state FROM jobs WHERE filename=?", (filename,)).fetchone()
+        return row[0] if row else None
+
+    def forget(self, filename):
+        """Drop a job (its input was deleted)."""
+        with self._connect() as db:
+            db.execute("DELETE FROM jobs WHERE filename=?", (filename,))
+
+    def status(self):
+        """Job counts per state, active leases and recent failures."""
+        now = time.time()
+        with self._connect() as db:
+            counts = dict(db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+            pending_bytes = db.execute("SELECT COALESCE(SUM(size), 0) FROM jobs WHERE state='pending'").fetchone()[0]
+            leases = db.execute(
+                "SELECT filename, owner, lease_expires FROM jobs WHERE state='leased'"
+            ).fetchall()
+            failures = db.execute(
+                "SELECT filename, error FROM jobs WHERE state='failed' ORDER BY updated_at DESC LIMIT 50"
+            ).fetchall()
+        return {
+            'counts': {state: counts.get(state, 0) for state in STATES},
+            'pending_bytes': pending_bytes,
+            'leases': [
+                {'file': name, 'worker': owner, 'expired': expires < now}
+                for name, owner, expires in leases
+            ],
+            'errors': [{'file': name, 'error': error} for name, error in failures],
+        }
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT/ROLLBACK around a block."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+class LockFileLeaseStore:
+    """Job state as files on the shared volume, for filesystems where SQLite locking is unreliable.
+
+    A job is a small JSON file that moves between the pending/, leased/,
+    done/ and failed/ directories. Each worker leases into its own
+    leased/<worker>/ directory, so a lease's path is its ownership: a claim,
+    a reclaim and a finish are each one os.rename out of a path only the
+    holder can still see, and only one of them can win. A lease's mtime is
+    its heartbeat; an expired lease is moved back to pending/ by whichever
+    worker notices first (or to failed/ after LEASE_MAX_ATTEMPTS claims).
+    """
+
+    def __init__(self, root=None):
+        self.root = root or os.path.join(LEASE_PATH or scheduler.STATE_DIR, 'leases')
+        for state in STATES:
+            os.makedirs(os.path.join(self.root, state), exist_ok=True)
+
+    def _path(self, state, filename):
+        return os.path.join(self.root, state, filename)
+
+    def _leased_path(self, worker_id, filename):
+        """Path of a file leased by worker_id (in the worker's own directory)."""
+        digest = hashlib.sha1(worker_id.encode('utf-8')).hexdigest()[:8]
+        owner_dir = f"{re.sub(r'[^A-Za-z0-9_.-]', '_', worker_id)[:64]}-{digest}"
+        return os.path.join(self.root, 'leased', owner_dir, filename)
+
+    def _read(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, path, data):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def _names(self, state):
+        return [name for name in os.listdir(os.path.join(self.root, state)) if not name.endswith('.tmp')]
+
+    def _leases(self):
+        """(path, filename) of every lease, whoever holds it."""
+        leased_dir = os.path.join(self.root, 'leased')
+        leases = []
+        for entry in os.scandir(leased_dir):
+            if entry.is_dir():
+                try:
+                    leases.extend((os.path.join(entry.path, name), name) for name in os.listdir(entry.path)
+                                  if not name.endswith('.tmp'))
+                except FileNotFoundError:
+                    continue
+            elif not entry.name.endswith('.tmp'):
+                leases.append((entry.path, entry.name))  # left by the flat layout of older versions
+        return leases
+
+    def enqueue(self, filename, priority=0, size=0):
+        if any(name == filename for _, name in self._leases()):
+            return
+        for state in ('done', 'failed'):
+            try:
+                os.remove(self._path(state, filename))
+            except FileNotFoundError:
+                pass
+        self._write(self._path('pending', filename),
+                    {'priority': priority, 'size': size, 'enqueued_at': time.time(), 'attempts': 0})
+
+    def _expired(self, path, now):
+        """A lease expires when its last heartbeat (mtime) is older than the TTL it was claimed with."""
+        return now - os.path.getmtime(path) > self._read(path).get('ttl', LEASE_TTL_SECONDS)
+
+    def _reclaim_expired(self):
+        now = time.time()
+        for path, name in self._leases():
+            try:
+                if not self._expired(path, now):
+                    continue
+                job = self._read(path)
+                if job.get('attempts', 0) < LEASE_MAX_ATTEMPTS:
+                    os.rename(path, self._path('pending', name))
+                    continue
+                # Taken out of the holder's directory first, so a late finish can't race the rewrite
+                abandoned_path = f"{self._path('failed', name)}.{os.getpid()}.{threading.get_ident()}.abandoned.tmp"
+                os.rename(path, abandoned_path)
+                job.update(error=_abandoned_error(LEASE_MAX_ATTEMPTS), updated_at=now)
+                job.pop('owner', None)
+                self._write(abandoned_path, job)
+                os.rename(abandoned_path, self._path('failed', name))
+            except FileNotFoundError:
+                continue  # finished or reclaimed by someone else meanwhile
+
+    def claim(self, worker_id, ttl=None):
+        ttl = ttl or LEASE_TTL_SECONDS
+        self._reclaim_expired()
+        jobs = {name: self._read(self._path('pending', name)) for name in self._names('pending')}
+        ordered = sorted(jobs, key=lambda n: (-jobs[n].get('priority', 0), jobs[n].get('size', 0),
+                                              jobs[n].get('enqueued_at', 0)))
+        for name in ordered:
+            pending_path = self._path('pending', name)
+            leased_path = self._leased_path(worker_id, name)
+            os.makedirs(os.path.dirname(leased_path), exist_ok=True)
+            try:
+                # Fresh heartbeat before the rename (which keeps the mtime): a pending file's mtime is its
+                # enqueue time, so the new lease could otherwise look expired and be reclaimed at once
+                os.utime(pending_path)
+                os.rename(pending_path, leased_path)
+            except FileNotFoundError:
+                continue  # another worker won this one
+            job = jobs[name]
+            job.update(owner=worker_id, ttl=ttl, attempts=job.get('attempts', 0) + 1)
+            self._write(leased_path, job)
+            return name
+        return None
+
+    def heartbeat(self, filename, worker_id, ttl=None):
+        try:
+            os.utime(self._leased_path(worker_id, filename))
+        except FileNotFoundError:
+            return False  # reclaimed: the lease was lost
+        return True
+
+    def _finish(self, filename, worker_id, state, error=None):
+        # The rename out of the worker's own directory is the ownership check: it fails if the lease
+        # was reclaimed meanwhile, and once it succeeds no reclaim can see the job any more
+        finishing_path = f"{self._path(state, filename)}.{os.getpid()}.{threading.get_ident()}.finish.tmp"
+        try:
+            os.rename(self._leased_path(worker_id, filename), finishing_path)
+        except FileNotFoundError:
+            return
+        job = self._read(finishing_path)
+        job.update(error=error, updated_at=time.time())
+        if state == 'pending':
+            job.pop('owner', None)
+            job.pop('ttl', None)
+            job['attempts'] = max(job.get('attempts', 1) - 1, 0)
+        self._write(finishing_path, job)
+        os.rename(finishing_path, self._path(state, filename))
+
+    def release(self, filename, worker_id):
+        self._finish(filename, worker_id, 'pending')
+
+    def complete(self, filename, worker_id, error=None):
+        self._finish(filename, worker_id, 'failed' if error else 'done', error)
+
+    def state(self, filename):
+        for state in STATES:
+            if state == 'leased':
+                if any(name == filename for _, name in self._leases()):
+                    return state
+            elif os.path.exists(self._path(state, filename)):
+                return state
+        return None
+
+    def forget(self, filename):
+        paths = [self._path(state, filename) for state in STATES if state != 'leased']
+        for path in paths + [path for path, name in self._leases() if name == filename]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def status(self):
+        now = time.time()
+        leases = []
+        for path, name in self._leases():
+            try:
+                expired = self._expired(path, now)
+            except FileNotFoundError:
+                continue
+            leases.append({'file': name, 'worker': self._read(path).get('owner'), 'expired': expired})
+        return {
+            'counts': {state: len(leases) if state == 'leased' else len(self._names(state)) for state in STATES},
+            'pending_bytes': sum(self._read(self._path('pending', name)).get('size', 0)
+                                 for name in self._names('pending')),
+            'leases': leases,
+            'errors': [
+                {'file': name, 'error': self._read(self._path('failed', name)).get('error')}
+                for name in self._names('failed')[:50]
+            ],
+        }
+
+
+def _abandoned_error(attempts):
+    return f"Abandonado tras {attempts} intentos: el worker se detuvo sin terminarlo"
+
+
+def open_store(kind=None, path=None):
+    """Create the configured lease store under path (LEASE_PATH). Raises ValueError if neither is set."""
+    kind = (kind or LEASE_STORE).lower()
+    path = path or LEASE_PATH
+    if not path:
+        raise ValueError("El modo fleet necesita LEASE_PATH: un directorio en el volumen compartido por todos los hosts")
+    if kind == 'sqlite':
+        return SQLiteLeaseStore(os.path.join(path, 'leases.sqlite3'))
+    if kind == 'lockfile':
+        return LockFileLeaseStore(os.path.join(path, 'leases'))
+    raise ValueError(f"LEASE_STORE desconocido: {kind}")
@@ -0,0 +1,365 @@
+"""Load test of the Flask API hot paths.
+
+Generates synthetic InputFiles/OutputFiles trees and drives the API with
+concurrent clients, reporting throughput, latency percentiles and the
+server's memory, optionally compared against a stored baseline:
+
+    python loadtest.py generate /tmp/lt --inputs 5000 --outputs 5000
+    python loadtest.py run /tmp/lt --duration 30 --save-baseline baseline.json
+    python loadtest.py run /tmp/lt --duration 30 --baseline baseline.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import threading
+import subprocess
+import urllib.request
+import urllib.error
+
+try:
+    import psutil
+except ImportError:  # without psutil server memory is read from /proc (Linux only)
+    psutil = None
+
+# Scenario -> (method, path, default clients, seconds between requests of one client; 0 = back to back)
+SCENARIOS = {
+    'list': ('GET', '/api/files/list', 4, 0),
+    'status': ('GET', '/api/process/status', 20, 0.5),  # the frontend polls at 2 Hz
+    'download-all': ('GET', '/api/files/download-all', 1, 0),
+    'consolidate': ('POST', '/api/process/consolidate', 1, 0),
+}
+
+PAGE_SEPARATOR = "\n\n---\n\n"
+WORDS = ("contrato", "cláusula", "anexo", "tabla", "importe", "fecha", "parte", "servicio",
+         "entrega", "plazo", "garantía", "pago", "total", "resumen", "informe", "datos")
+
+
+def _markdown(rng, pages, page_bytes):
+    out = []
+    for page in range(pages):
+        words = []
+        size = 0
+        while size < page_bytes:
+            word = rng.choice(WORDS)
+            words.append(word)
+            size += len(word) + 1
+        out.append(f"# Página {page + 1}\n\n" + ' '.join(words))
+    return PAGE_SEPARATOR.join(out)
+
+
+def generate(root, inputs=1000, outputs=1000, pages=5, page_bytes=2000, input_bytes=50 * 1024, seed=42):
+    """Write a reproducible synthetic tree: root/InputFiles and root/OutputFiles."""
+    rng = random.Random(seed)
+    input_dir = os.path.join(root, 'InputFiles')
+    output_dir = os.path.join(root, 'OutputFiles')
+    os.makedirs(input_dir, exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
+    filler = rng.randbytes(input_bytes) if hasattr(rng, 'randbytes') else os.urandom(input_bytes)
+    for i in range(inputs):
+        with open(os.path.join(input_dir, f"doc_{i:06d}.pdf"), 'wb') as f:
+            f.write(b"%PDF-1.4\n" + filler)
+    for i in range(outputs):
+        with open(os.path.join(output_dir, f"doc_{i:06d}.md"), 'w', encoding='utf-8') as f:
+            f.write(_markdown(rng, rng.randint(1, pages * 2 - 1), page_bytes))
+    print(f"🧪 {inputs} entradas y {outputs} salidas generadas en {root}")
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _rss(pid):
+    """Resident memory of a process in bytes, or None if it can't be read."""
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).memory_info().rss
+        except psutil.Error:
+            return None
+    try:
+        with open(f"/proc/{pid}/status", 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+class MemorySampler:
+    """Sample a process's RSS in the background; reports start, peak and end."""
+
+    def __init__(self, pid, interval=0.2):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            rss = _rss(self.pid)
+            if rss is not None:
+                self.samples.append(rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def report(self):
+        if not self.samples:
+            return None
+        return {'start_bytes': self.samples[0], 'peak_bytes': max(self.samples), 'end_bytes': self.samples[-1]}
+
+
+def start_server(root, port):
+    """Run app.py on a local port against the synthetic tree. Returns the process."""
+    env = dict(os.environ,
+               INPUT_DIR=os.path.join(root, 'InputFiles'),
+               OUTPUT_DIR=os.path.join(root, 'OutputFiles'),
+               STATE_DIR=os.path.join(root, 'state'),
+               WATCH_INPUT_DIR='false',
+               PROCESSING_MODE='local')
+    code = f"import app; app.app.run(host='127.0.0.1', port={port}, threaded=True)"
+    process = subprocess.Popen([sys.executable, '-c', code], env=env,
+                               cwd=os.path.dirname(os.path.abspath(__file__)),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"El servidor terminó al iniciar (código {process.returncode})")
+        try:
+            urllib.request.urlopen(base_url + '/api/health', timeout=2).read()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("El servidor no respondió en 60s")
+
+
+def _request(base_url, method, path, timeout):
+    """One request. Returns (seconds, status code, response bytes)."""
+    started = time.perf_counter()
+    req = urllib.request.Request(base_url + path, method=method, data=b'' if method == 'POST' else None)
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            size = len(response.read())
+            status = response.status
+    except urllib.error.HTTPError as e:
+        size = len(e.read())
+        status = e.code
+    except OSError:
+        size = 0
+        status = 0  # connection error or timeout
+    return time.perf_counter() - started, status, size
+
+
+def _client(base_url, scenario, end, results, timeout):
+    method, path, _, interval = SCENARIOS[scenario]
+    while time.time() < end:
+        started = time.time()
+        results.append(_request(base_url, method, path, timeout))
+        if interval:
+            time.sleep(max(0.0, interval - (time.time() - started)))
+
+
+def summarize(results, seconds):
+    latencies = sorted(latency for latency, _, _ in results)
+    errors = sum(1 for _, status, _ in results if not 200 <= status < 300)
+    return {
+        'requests': len(results),
+        'errors': errors,
+        'throughput_rps': round(len(results) / seconds, 2) if seconds else 0,
+        'bytes_per_request': round(sum(size for _, _, size in results) / len(results)) if results else 0,
+        'latency_ms': {
+            name: round(value * 1000, 2) if value is not None else None
+            for name, value in (('p50', percentile(latencies, 50)), ('p95', percentile(latencies, 95)),
+                                ('p99', percentile(latencies, 99)),
+                                ('max', latencies[-1] if latencies else None))
+        },
+    }
+
+
+def run_load(base_url, scenarios, clients=None, duration=30, timeout=120, pid=None):
+    """Drive the scenarios at once (a mixed load) for `duration` seconds.
+
+    clients maps scenario -> concurrent clients (SCENARIOS defaults
+    otherwise). pid is the server process whose memory is sampled.
+    """
+    clients = clients or {}
+    for scenario in scenarios:  # warm up caches and imports before timing
+        method, path, _, _ = SCENARIOS[scenario]
+        _request(base_url, method, path, timeout)
+
+    results = {scenario: [] for scenario in scenarios}
+    sampler = MemorySampler(pid) if pid else None
+    end = time.time() + duration
+    threads = [
+        threading.Thread(target=_client, args=(base_url, scenario, end, results[scenario], timeout), daemon=True)
+        for scenario in scenarios
+        for _ in range(clients.get(scenario, SCENARIOS[scenario][2]))
+    ]
+    started = time.time()
+    if sampler:
+        sampler.__enter__()
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        if sampler:
+            sampler.__exit__(None, None, None)
+    elapsed = time.time() - started
+
+    return {
+        'duration_seconds': round(elapsed, 2),
+        'clients': {scenario: clients.get(scenario, SCENARIOS[scenario][2]) for scenario in scenarios},
+        'scenarios': {scenario: summarize(results[scenario], elapsed) for scenario in scenarios},
+        'memory': sampler.report() if sampler else None,
+    }
+
+
+def compare(report, baseline, tolerance=0.2):
+    """Regressions against a baseline report: slower p95 or lower throughput than the tolerance allows."""
+    regressions = []
+    for scenario, current in report['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(scenario)
+        if not previous:
+            continue
+        p95, base_p95 = current['latency_ms']['p95'], previous['latency_ms']['p95']
+        if p95 is not None and base_p95 and p95 > base_p95 * (1 + tolerance):
+            regressions.append(f"{scenario}: p95 {p95}ms vs {base_p95}ms")
+        rps, base_rps = current['throughput_rps'], previous['throughput_rps']
+        if base_rps and rps < base_rps * (1 - tolerance):
+            regressions.append(f"{scenario}: {rps} req/s vs {base_rps} req/s")
+    memory, base_memory = report.get('memory'), baseline.get('memory')
+    if memory and base_memory and memory['peak_bytes'] > base_memory['peak_bytes'] * (1 + tolerance):
+        regressions.append(f"memoria pico {memory['peak_bytes']} vs {base_memory['peak_bytes']} bytes")
+    return regressions
+
+
+def print_report(report, baseline=None):
+    print(f"\n{'='*72}")
+    print(f"{'escenario':<14}{'clientes':>9}{'req':>8}{'err':>6}{'req/s':>9}{'p50ms':>9}{'p95ms':>9}{'p99ms':>9}")
+    for scenario, result in report['scenarios'].items():
+        latency = result['latency_ms']
+        print(f"{scenario:<14}{report['clients'][scenario]:>9}{result['requests']:>8}{result['errors']:>6}"
+              f"{result['throughput_rps']:>9}{latency['p50'] or '-':>9}{latency['p95'] or '-':>9}{latency['p99'] or '-':>9}")
+        previous = (baseline or {}).get('scenarios', {}).get(scenario)
+        if previous and previous['latency_ms']['p95'] and latency['p95']:
+            change = (latency['p95'] / previous['latency_ms']['p95'] - 1) * 100
+            print(f"{'':<14}  p95 {change:+.1f}% y {result['throughput_rps'] - previous['throughput_rps']:+.2f} req/s frente a la línea base")
+    if report['memory']:
+        memory = report['memory']
+        print(f"Memoria del servidor: inicio {memory['start_bytes'] / 2**20:.1f}MB, "
+              f"pico {memory['peak_bytes'] / 2**20:.1f}MB, fin {memory['end_bytes'] / 2**20:.1f}MB")
+    print(f"{'='*72}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Prueba de carga de la API de FileToMarkDown.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    gen = commands.add_parser('generate', help="generar un árbol sintético de entradas y salidas")
+    gen.add_argument('root', help="directorio donde crear InputFiles y OutputFiles")
+    gen.add_argument('--inputs', type=int, default=1000, help="archivos de entrada")
+    gen.add_argument('--outputs', type=int, default=1000, help="salidas markdown")
+    gen.add_argument('--pages', type=int, default=5, help="páginas promedio por salida")
+    gen.add_argument('--page-bytes', type=int, default=2000, help="bytes por página")
+    gen.add_argument('--input-bytes', type=int, default=50 * 1024, help="bytes por archivo de entrada")
+    gen.add_argument('--seed', type=int, default=42)
+
+    run = commands.add_parser('run', help="lanzar los clientes contra un servidor local")
+    run.add_argument('root', nargs='?', help="árbol generado (se levanta un servidor local sobre él)")
+    run.add_argument('--url', help="usar un servidor ya levantado en vez de iniciar uno")
+    run.add_argument('--pid', type=int, help="PID del servidor de --url para medir su memoria")
+    run.add_argument('--scenarios', default=','.join(SCENARIOS),
+                     help=f"escenarios separados por coma ({', '.join(SCENARIOS)})")
+    run.add_argument('--clients', action='append', default=[], metavar='ESCENARIO=N',
+                     help="clientes concurrentes de un escenario (repetible)")
+    run.add_argument('--duration', type=float, default=30, help="segundos de carga")
+    run.add_argument('--timeout', type=float, default=120, help="timeout por petición")
+    run.add_argument('--report', help="escribir el informe JSON en esta ruta")
+    run.add_argument('--baseline', help="comparar con este informe; código de salida 1 si hay regresiones")
+    run.add_argument('--save-baseline', help="guardar el informe como línea base en esta ruta")
+    run.add_argument('--tolerance', type=float, default=0.2,
+                     help="empeoramiento relativo permitido frente a la línea base")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == 'generate':
+        generate(args.root, args.inputs, args.outputs, args.pages, args.page_bytes, args.input_bytes, args.seed)
+        return 0
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        print(f"❌ Escenarios desconocidos: {', '.join(unknown)}")
+        return 2
+    clients = {}
+    for item in args.clients:
+        name, _, count = item.partition('=')
+        clients[name] = int(count)
+    if not args.url and not args.root:
+        print("❌ Indica el árbol generado o --url")
+        return 2
+
+    server = None
+    if args.url:
+        base_url, pid = args.url.rstrip('/'), args.pid
+    else:
+        port = _free_port()
+        server = start_server(args.root, port)
+        base_url, pid = f"http://127.0.0.1:{port}", server.pid
+    try:
+        print(f"🚀 {args.duration:g}s de carga contra {base_url}: {', '.join(scenarios)}")
+        report = run_load(base_url, scenarios, clients, args.duration, args.timeout, pid)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    for path in (args.report, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+
+    if baseline is not None:
+        regressions = compare(report, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"📉 Regresión: {regression}")
+        if regressions:
+            return 1
+        print("✅ Sin regresiones frente a la línea base")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
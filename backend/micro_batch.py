@@ -0,0 +1,146 @@
+import os
+import re
+import uuid
+import threading
+import scheduler
+import preflight
+import image_prep
+import spreadsheet
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # without Pillow small images are parsed one by one
+    Image = ImageOps = None
+
+# Pack small files into one composite upstream parse instead of one job per file
+MICRO_BATCH_ENABLED = os.getenv("MICRO_BATCH_ENABLED", "false").lower() == "true"
+# Files up to this size are batched
+MICRO_BATCH_MAX_FILE_BYTES = int(os.getenv("MICRO_BATCH_MAX_FILE_BYTES", str(128 * 1024)))
+# Limits of one composite: total bytes, files, and images (one PDF page each)
+MICRO_BATCH_MAX_BYTES = int(os.getenv("MICRO_BATCH_MAX_BYTES", str(2 * 1024 * 1024)))
+MICRO_BATCH_MAX_FILES = int(os.getenv("MICRO_BATCH_MAX_FILES", "50"))
+MICRO_BATCH_MAX_PAGES = int(os.getenv("MICRO_BATCH_MAX_PAGES", "20"))
+# Queued jobs looked at (in run order) when filling a composite
+MICRO_BATCH_SCAN_JOBS = int(os.getenv("MICRO_BATCH_SCAN_JOBS", "200"))
+
+# Text files are concatenated between markers; images become the pages of one PDF
+TEXT_EXTENSIONS = {'.txt', '.csv', '.tsv'}
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.webp'}
+
+BATCH_DIR = os.path.join(scheduler.STATE_DIR, "batches")
+
+# Plain alphanumeric token: markdown conversion leaves it alone. Split also eats
+# any emphasis or heading characters the parser wrapped around it
+_MARKER = "FILETOMDPART{:04d}"
+_MARKER_RE = re.compile(r'[#*_\s]*FILETOMDPART(\d{4})[*_\s]*')
+
+_counters_lock = threading.Lock()
+_counters = {'batches': 0, 'files': 0, 'fallbacks': 0}
+
+
+def group_of(file_path):
+    """'text' or 'image' if a file can go into a composite parse, else None.
+
+    Runs the preflight: call it when a file is queued, not while taking jobs.
+    """
+    if not MICRO_BATCH_ENABLED:
+        return None
+    ext = os.path.splitext(file_path)[1].lower()
+    if spreadsheet.handles(file_path):
+        return None  # converted locally, no upstream job to save
+    if ext in TEXT_EXTENSIONS:
+        group = 'text'
+    elif ext in IMAGE_EXTENSIONS and Image is not None:
+        group = 'image'
+    else:
+        return None
+    try:
+        analysis = preflight.analyze(file_path)
+    except OSError:
+        return None
+    if not analysis['ok'] or analysis['parse_as'] or analysis['size'] > MICRO_BATCH_MAX_FILE_BYTES:
+        return None
+    return group
+
+
+def fits(group, files, total_bytes, size):
+    """Whether one more file of `size` bytes fits a composite of `files` files and `total_bytes`."""
+    max_files = MICRO_BATCH_MAX_FILES if group == 'text' else min(MICRO_BATCH_MAX_FILES, MICRO_BATCH_MAX_PAGES)
+    return files < max_files and total_bytes + size <= MICRO_BATCH_MAX_BYTES
+
+
+def _compose_text(file_paths, out_path):
+    with open(out_path, 'w', encoding='utf-8') as out:
+        for index, file_path in enumerate(file_paths):
+            with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+                out.write(f"\n\n{_MARKER.format(index)}\n\n")
+                out.write(f.read())
+
+
+def _compose_pdf(file_paths, out_path):
+    pages = []
+    try:
+        for file_path in file_paths:
+            with Image.open(file_path) as img:
+                # Upright as the camera's EXIF orientation says: the PDF page has no EXIF
+                page = ImageOps.exif_transpose(img).convert('RGB')
+            page.thumbnail((image_prep.IMAGE_MAX_DIMENSION, image_prep.IMAGE_MAX_DIMENSION))
+            pages.append(page)
+        pages[0].save(out_path, 'PDF', save_all=True, append_images=pages[1:], resolution=150)
+    finally:
+        for page in pages:
+            page.close()
+
+
+def compose(group, file_paths):
+    """Write the composite of a group's files. Returns its path; remove it with cleanup()."""
+    os.makedirs(BATCH_DIR, exist_ok=True)
+    out_path = os.path.join(BATCH_DIR, f"batch-{uuid.uuid4().hex}{'.txt' if group == 'text' else '.pdf'}")
+    try:
+        (_compose_text if group == 'text' else _compose_pdf)(file_paths, out_path)
+    except Exception:
+        cleanup(out_path)
+        raise
+    return out_path
+
+
+def split(group, documents, count):
+    """Markdown of each file from the documents of a composite parse, in input order.
+
+    Text composites are split at their markers and image composites by
+    page. Raises ValueError if the boundaries didn't survive the parse.
+    """
+    if group == 'image':
+        if len(documents) != count:
+            raise ValueError(f"se enviaron {count} imágenes y llegaron {len(documents)} páginas")
+        return [doc.text.strip() for doc in documents]
+
+    parts = _MARKER_RE.split("\n\n".join(doc.text for doc in documents))
+    texts = {}
+    for index, text in zip(parts[1::2], parts[2::2]):
+        index = int(index)
+        texts[index] = (texts[index] + "\n\n" + text).strip() if index in texts else text.strip()
+    if sorted(texts) != list(range(count)):
+        raise ValueError(f"se enviaron {count} archivos y se recuperaron {len(texts)} marcadores")
+    return [texts[index] for index in range(count)]
+
+
+def cleanup(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def record(files, fallback=False):
+    with _counters_lock:
+        _counters['batches'] += 1
+        _counters['files'] += files
+        if fallback:
+            _counters['fallbacks'] += 1
+
+
+def stats():
+    """Composite parses sent, files they carried and those whose split failed."""
+    with _counters_lock:
+        return dict(_counters, enabled=MICRO_BATCH_ENABLED)
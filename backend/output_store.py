@@ -0,0 +1,374 @@
+import io
+import os
+import re
+import gzip
+import shutil
+import hashlib
+import threading
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, gzip is always available
+    zstandard = None
+
+# Output compression: "none", "gzip" or "zstd"
+OUTPUT_COMPRESSION = os.getenv("OUTPUT_COMPRESSION", "none").lower()
+# Keep the plain .md next to the compressed sidecar (set to false to save disk)
+OUTPUT_KEEP_PLAIN = os.getenv("OUTPUT_KEEP_PLAIN", "true").lower() == "true"
+OUTPUT_COMPRESSION_LEVEL = int(os.getenv("OUTPUT_COMPRESSION_LEVEL", "6"))
+# Append pages to a <name>.md.partial companion as they arrive, for readers following a file in progress
+OUTPUT_PARTIAL = os.getenv("OUTPUT_PARTIAL", "true").lower() == "true"
+
+# Content-Encoding token -> sidecar suffix
+SIDECAR_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+
+PARTIAL_SUFFIX = '.partial'
+_PAGE_MARKER_RE = re.compile(r'^<!-- page (\d+)/(\d+|\?) -->$', re.MULTILINE)
+
+_etag_cache = {}
+_etag_lock = threading.Lock()
+_partials = {}  # output path -> PartialWriter of the files being converted in this process
+_partials_lock = threading.Lock()
+_partial_scans = {}  # .partial path -> (inode, bytes scanned, pages, total) for read_partial
+
+
+def _compression():
+    """Return the configured encoding, falling back to gzip if zstd is not installed."""
+    if OUTPUT_COMPRESSION == 'zstd' and zstandard is None:
+        return 'gzip'
+    if OUTPUT_COMPRESSION in SIDECAR_SUFFIXES:
+        return OUTPUT_COMPRESSION
+    return None
+
+
+def _compress(data, encoding):
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=OUTPUT_COMPRESSION_LEVEL).compress(data)
+    return gzip.compress(data, compresslevel=min(OUTPUT_COMPRESSION_LEVEL, 9), mtime=0)
+
+
+def _decompress(data, encoding):
+    if encoding == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("zstandard no está instalado; no se puede leer la salida .zst")
+        # decompressobj: streamed frames (write_markdown_stream) don't record their size
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return gzip.decompress(data)
+
+
+def _atomic_write(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def sidecars(output_path):
+    """Return the existing compressed sidecars of an output as {encoding: path}."""
+    found = {}
+    for encoding, suffix in SIDECAR_SUFFIXES.items():
+        if os.path.isfile(output_path + suffix):
+            found[encoding] = output_path + suffix
+    return found
+
+
+def write_markdown(output_path, content):
+    """Write markdown output, plain and/or as a precompressed sidecar."""
+    data = content.encode('utf-8')
+    encoding = _compression()
+
+    if encoding is None or OUTPUT_KEEP_PLAIN:
+        _atomic_write(output_path, data)
+    elif os.path.exists(output_path):
+        os.remove(output_path)
+
+    for other, path in sidecars(output_path).items():
+        if other != encoding:
+            os.remove(path)
+
+    if encoding is not None:
+        _atomic_write(output_path + SIDECAR_SUFFIXES[encoding], _compress(data, encoding))
+
+
+def write_markdown_stream(output_path, pieces):
+    """write_markdown for content produced piece by piece (strings), never held whole in memory."""
+    encoding = _compression()
+    tmp_path = f"{output_path}.tmp"
+    sidecar_tmp = output_path + SIDECAR_SUFFIXES[encoding] + '.tmp' if encoding is not None else None
+    try:
+        with open(tmp_path, 'wb') as f:
+            for piece in pieces:
+                f.write(piece.encode('utf-8'))
+        if encoding is not None:
+            with open(tmp_path, 'rb') as source, open(sidecar_tmp, 'wb') as raw:
+                if encoding == 'zstd':
+                    zstandard.ZstdCompressor(level=OUTPUT_COMPRESSION_LEVEL).copy_stream(source, raw)
+                else:
+                    with gzip.GzipFile(filename='', mode='wb', fileobj=raw,
+                                       compresslevel=min(OUTPUT_COMPRESSION_LEVEL, 9), mtime=0) as compressed:
+                        shutil.copyfileobj(source, compressed)
+    except BaseException:
+        for path in (tmp_path, sidecar_tmp):
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+        raise
+
+    for other, path in sidecars(output_path).items():
+        if other != encoding:
+            os.remove(path)
+    if encoding is not None:
+        os.replace(sidecar_tmp, output_path + SIDECAR_SUFFIXES[encoding])
+    if encoding is None or OUTPUT_KEEP_PLAIN:
+        os.replace(tmp_path, output_path)
+    else:
+        os.remove(tmp_path)
+        if os.path.exists(output_path):
+            os.remove(output_path)
+
+
+def read_markdown(output_path):
+    """Read markdown output from the plain file or from its compressed sidecar."""
+    if os.path.isfile(output_path):
+        with open(output_path, 'r', encoding='utf-8') as f:
+            return f.read()
+    for encoding, path in sidecars(output_path).items():
+        with open(path, 'rb') as f:
+            return _decompress(f.read(), encoding).decode('utf-8')
+    raise FileNotFoundError(output_path)
+
+
+def publish(store, output_path):
+    """Record a new output in its storage (see storage.py); remote ones get the plain markdown."""
+    name = os.path.basename(output_path)
+    if not store.remote:
+        store.publish(name)
+    elif os.path.isfile(output_path):
+        store.publish(name, output_path)
+    else:
+        # Only a compressed sidecar is kept locally
+        store.write(name, io.BytesIO(read_markdown(output_path).encode('utf-8')))
+
+
+def exists(output_path):
+    """Check if an output exists in any representation."""
+    return os.path.isfile(output_path) or bool(sidecars(output_path))
+
+
+def has_content(output_path):
+    """Check if an output exists and is not empty."""
+    if os.path.isfile(output_path):
+        return os.path.getsize(output_path) > 0
+    return exists(output_path) and len(read_markdown(output_path)) > 0
+
+
+def remove_markdown(output_path):
+    """Remove an output and all its sidecars. Returns True if anything was removed."""
+    removed = False
+    for path in [output_path] + list(sidecars(output_path).values()):
+        if os.path.isfile(path):
+            os.remove(path)
+            removed = True
+    return removed
+
+
+def list_markdown(output_dir):
+    """List logical .md names in output_dir, including outputs stored only compressed."""
+    names = set()
+    if not os.path.exists(output_dir):
+        return []
+    for filename in os.listdir(output_dir):
+        if not os.path.isfile(os.path.join(output_dir, filename)):
+            continue
+        if filename.endswith('.md'):
+            names.add(filename)
+            continue
+        for suffix in SIDECAR_SUFFIXES.values():
+            if filename.endswith('.md' + suffix):
+                names.add(filename[:-len(suffix)])
+    return sorted(names)
+
+
+def stat_markdown(output_path):
+    """Return (size, mtime) of the stored representation used for listings."""
+    if os.path.isfile(output_path):
+        path = output_path
+    else:
+        path = next(iter(sidecars(output_path).values()))
+    return os.path.getsize(path), os.path.getmtime(path)
+
+
+def strong_etag(path):
+    """Content hash of a file, cached by (path, size, mtime)."""
+    st = os.stat(path)
+    key = (path, st.st_size, st.st_mtime_ns)
+    with _etag_lock:
+        if key in _etag_cache:
+            return _etag_cache[key]
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    etag = digest.hexdigest()[:32]
+
+    with _etag_lock:
+        for stale in [k for k in _etag_cache if k[0] == path]:
+            del _etag_cache[stale]
+        _etag_cache[key] = etag
+    return etag
+
+
+def choose_representation(output_path, accept_encodings):
+    """Pick (path, content_encoding) to serve for a request.
+
+    accept_encodings is the request's Accept-Encoding header parsed by werkzeug.
+    Returns (None, None) when only a sidecar the client cannot accept exists.
+    """
+    available = sidecars(output_path)
+    for encoding in ('zstd', 'gzip'):
+        if encoding in available and accept_encodings[encoding]:
+            return available[encoding], encoding
+    if os.path.isfile(output_path):
+        return output_path, None
+    return None, None
+
+
+def compress_existing(output_dir):
+    """Create sidecars for outputs written before compression was enabled."""
+    count = 0
+    for name in list_markdown(output_dir):
+        output_path = os.path.join(output_dir, name)
+        encoding = _compression()
+        if encoding is None or encoding in sidecars(output_path):
+            continue
+        write_markdown(output_path, read_markdown(output_path))
+        count += 1
+    return count
+
+
+def partial_path(output_path):
+    return output_path + PARTIAL_SUFFIX
+
+
+class PartialWriter:
+    """Append the pages of an output to its .partial companion as they arrive.
+
+    Each page is written as a "<!-- page N/TOTAL -->" marker line followed
+    by its markdown, in arrival order (not page order), so the file only
+    grows and can be followed with byte offsets. close() removes it once
+    the final .md has been written.
+    """
+
+    def __init__(self, output_path, total_pages=None):
+        self.output_path = output_path
+        self.path = partial_path(output_path)
+        self.total = total_pages
+        self.done = set()
+        self._lock = threading.Lock()
+        if OUTPUT_PARTIAL:
+            open(self.path, 'w', encoding='utf-8').close()
+        with _partials_lock:
+            _partials[os.path.abspath(output_path)] = self
+
+    def write_pages(self, pages, total=None):
+        """Append pages ({0-based index: markdown}) not written yet."""
+        with self._lock:
+            if total:
+                self.total = total
+            new = [(index, pages[index]) for index in sorted(pages) if index not in self.done]
+            if OUTPUT_PARTIAL and new:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    for index, text in new:
+                        f.write(f"<!-- page {index + 1}/{self.total or '?'} -->\n{text}\n\n")
+            self.done.update(index for index, _ in new)
+
+    def progress(self):
+        """(pages written, total pages or None)."""
+        with self._lock:
+            return len(self.done), self.total
+
+    def close(self):
+        with _partials_lock:
+            _partials.pop(os.path.abspath(self.output_path), None)
+            _partial_scans.pop(os.path.abspath(self.path), None)
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def partial_progress(output_path):
+    """(pages written, total pages) of an output being converted in this process, or None."""
+    with _partials_lock:
+        writer = _partials.get(os.path.abspath(output_path))
+    return writer.progress() if writer else None
+
+
+def _scan_markers(path, f):
+    """Pages and total from the page markers of an open .partial, scanning only the bytes added since the last call."""
+    key = os.path.abspath(path)
+    st = os.fstat(f.fileno())
+    with _partials_lock:
+        inode, scanned, pages, total = _partial_scans.get(key, (None, 0, 0, None))
+    if inode != st.st_ino or scanned > st.st_size:
+        # Rewritten (a new conversion of the same output)
+        scanned, pages, total = 0, 0, None
+    f.seek(scanned)
+    added = f.read(st.st_size - scanned)
+    # Up to the last line break: a marker still being written is counted on the next call
+    added = added[:added.rindex(b'\n') + 1] if b'\n' in added else b''
+    for _, marker_total in _PAGE_MARKER_RE.findall(added.decode('utf-8', errors='replace')):
+        pages += 1
+        if marker_total != '?':
+            total = int(marker_total)
+    with _partials_lock:
+        _partial_scans[key] = (st.st_ino, scanned + len(added), pages, total)
+    return pages, total
+
+
+def read_partial(output_path, offset=0, limit=1024 * 1024):
+    """Tail an output's .partial from a byte offset.
+
+    Returns a dict with the new 'data', 'next_offset', 'pages_done' and
+    'pages_total' (from the page markers), or None if there is no
+    .partial (not started or already finished). A read cut by limit ends
+    at a line break so no character or marker is split. Only the bytes
+    after offset are read; the markers are counted incrementally.
+    """
+    path = partial_path(output_path)
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        with _partials_lock:
+            _partial_scans.pop(os.path.abspath(path), None)
+        return None
+    with f:
+        pages_done, pages_total = _scan_markers(path, f)
+        size = os.fstat(f.fileno()).st_size
+        f.seek(offset)
+        data = f.read(limit)
+    if offset + limit < size and b'\n' in data:
+        data = data[:data.rindex(b'\n') + 1]
+    return {
+        'data': data.decode('utf-8', errors='replace'),
+        'offset': offset,
+        'next_offset': offset + len(data),
+        'pages_done': pages_done,
+        'pages_total': pages_total,
+    }
+
+
+if __name__ == "__main__":
+    directorio = os.getenv("OUTPUT_DIR", "OutputFiles")
+    if _compression() is None:
+        print("⚠️  OUTPUT_COMPRESSION no está configurado (gzip o zstd)")
+    else:
+        total = compress_existing(directorio)
+        print(f"✅ {total} archivos comprimidos en '{directorio}'")
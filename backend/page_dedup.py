@@ -0,0 +1,263 @@
+import os
+import re
+import time
+import random
+import sqlite3
+import hashlib
+import threading
+from array import array
+import scheduler
+import page_router
+
+try:
+    from PIL import Image
+except ImportError:  # without Pillow scanned pages (no text layer) are never deduplicated
+    Image = None
+
+# Reuse the markdown of pages already parsed elsewhere instead of parsing near-duplicates again
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "false").lower() == "true"
+# Estimated Jaccard similarity of the page text (word 5-grams) needed to reuse a page
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.95"))
+# Max differing bits between the perceptual hashes (64-bit dHash) of two scanned pages
+DEDUP_PHASH_MAX_DISTANCE = int(os.getenv("DEDUP_PHASH_MAX_DISTANCE", "4"))
+DEDUP_INDEX_PATH = os.getenv("DEDUP_INDEX_PATH", os.path.join(scheduler.STATE_DIR, "page_index.sqlite3"))
+
+SHINGLE_WORDS = 5
+NUM_PERM = 128
+# LSH: 16 bands of 8 rows make pages above ~0.7 similarity candidates; DEDUP_THRESHOLD decides
+BANDS = 16
+# dHash split in 8 one-byte bands: hashes within 7 bits always share one
+PHASH_BANDS = 8
+
+_PRIME = (1 << 61) - 1
+# Fixed seed: signatures must stay comparable across runs and processes
+_seed = random.Random(20240613)
+_PERMUTATIONS = [(_seed.randrange(1, _PRIME), _seed.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+_WORD_RE = re.compile(r'\w+')
+
+_counters_lock = threading.Lock()
+_counters = {'pages_checked': 0, 'pages_reused': 0}
+
+
+def minhash(text):
+    """MinHash signature of a text's word 5-grams, or None if it has no words."""
+    words = _WORD_RE.findall(text.lower())
+    if not words:
+        return None
+    shingles = {' '.join(words[i:i + SHINGLE_WORDS]) for i in range(max(1, len(words) - SHINGLE_WORDS + 1))}
+    hashes = [int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'little')
+              for shingle in shingles]
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def similarity(signature, other):
+    """Estimated Jaccard similarity of two MinHash signatures."""
+    return sum(1 for x, y in zip(signature, other) if x == y) / len(signature)
+
+
+def dhash(image):
+    """64-bit difference hash of an image (robust to rescaling and recompression)."""
+    pixels = list(image.convert('L').resize((9, 8), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+def _page_phash(page):
+    """dHash of the largest image on a pypdf page, or None."""
+    if Image is None:
+        return None
+    try:
+        images = [image.image for image in page.images]
+    except Exception:
+        return None
+    images = [image for image in images if image is not None]
+    if not images:
+        return None
+    return dhash(max(images, key=lambda image: image.width * image.height))
+
+
+def _bands(minhash_values, phash):
+    """LSH keys of a signature as (kind, band, key)."""
+    if minhash_values is not None:
+        rows = NUM_PERM // BANDS
+        for band in range(BANDS):
+            chunk = array('Q', minhash_values[band * rows:(band + 1) * rows]).tobytes()
+            yield 'text', band, hashlib.blake2b(chunk, digest_size=8).hexdigest()
+    else:
+        for band in range(PHASH_BANDS):
+            yield 'image', band, str((phash >> (8 * band)) & 0xFF)
+
+
+class PageIndex:
+    """Pages parsed upstream, with their signatures and markdown, in SQLite under STATE_DIR."""
+
+    def __init__(self, path=None):
+        self.path = path or DEDUP_INDEX_PATH
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                " id INTEGER PRIMARY KEY, source TEXT NOT NULL, page INTEGER NOT NULL,"
+                " minhash BLOB, phash INTEGER, markdown TEXT NOT NULL, mode TEXT, created_at REAL)"
+            )
+            db.execute("CREATE TABLE IF NOT EXISTS bands (kind TEXT, band INTEGER, key TEXT, page_id INTEGER)")
+            db.execute("CREATE INDEX IF NOT EXISTS bands_lookup ON bands (kind, band, key)")
+
+    def _connect(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            self._local.db = db
+        return db
+
+    def find(self, signature):
+        """Best indexed page matching a signature: (markdown, source, page, mode) or None."""
+        minhash_values, phash = signature
+        db = self._connect()
+        candidates = set()
+        for kind, band, key in _bands(minhash_values, phash):
+            candidates.update(row[0] for row in db.execute(
+                "SELECT page_id FROM bands WHERE kind = ? AND band = ? AND key = ?", (kind, band, key)))
+        best = None
+        for page_id in candidates:
+            row = db.execute("SELECT minhash, phash, markdown, source, page, mode FROM pages WHERE id = ?",
+                             (page_id,)).fetchone()
+            if row is None or (row[0] is None) != (minhash_values is None) or (row[1] is None) != (phash is None):
+                continue
+            score = 1.0
+            if minhash_values is not None:
+                score = similarity(minhash_values, array('Q', row[0]))
+                if score < DEDUP_THRESHOLD:
+                    continue
+            if phash is not None and bin(phash ^ row[1]).count('1') > DEDUP_PHASH_MAX_DISTANCE:
+                continue
+            if best is None or score > best[0]:
+                best = (score, row[2], row[3], row[4], row[5])
+        return best[1:] if best else None
+
+    def add(self, signature, markdown, source, page, mode):
+        minhash_values, phash = signature
+        with self._connect() as db:
+            cursor = db.execute(
+                "INSERT INTO pages (source, page, minhash, phash, markdown, mode, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (source, page,
+                 array('Q', minhash_values).tobytes() if minhash_values is not None else None,
+                 phash, markdown, mode, time.time())
+            )
+            db.executemany("INSERT INTO bands (kind, band, key, page_id) VALUES (?, ?, ?, ?)",
+                           [(kind, band, key, cursor.lastrowid) for kind, band, key in _bands(minhash_values, phash)])
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = PageIndex()
+        return _index
+
+
+def _signatures(file_path, routing_plan):
+    """(minhash, phash) per page index of the pages that would go upstream.
+
+    Pages with a text layer are matched on their text; pages with large
+    images also need a matching image hash, and scanned pages (no text
+    layer) are matched on the image hash alone. Pages that can't be
+    signed (blank, or scanned without Pillow) are left out.
+    """
+    upstream = routing_plan['pages_by_mode']['fast'] + routing_plan['pages_by_mode']['premium']
+    signatures = {}
+    reader = None
+    for index_ in upstream:
+        features = routing_plan['features'][index_]
+        text = routing_plan['texts'][index_]
+        has_text = features['text_chars'] >= page_router.PAGE_MIN_TEXT_CHARS
+        minhash_values = minhash(text) if has_text else None
+        phash = None
+        if features['images'] or not has_text:
+            if reader is None:
+                reader = page_router.PdfReader(file_path)
+                if reader.is_encrypted:
+                    reader.decrypt('')
+            phash = _page_phash(reader.pages[index_])
+            if phash is None:
+                continue
+        if minhash_values is None and phash is None:
+            continue
+        signatures[index_] = (minhash_values, phash)
+    return signatures
+
+
+def apply(file_path, routing_plan, source=None, dry_run=False):
+    """Mark pages already parsed elsewhere as 'reused' and give them the stored markdown.
+
+    Updates routing_plan in place (its modes, 'pages_by_mode' and
+    'local_text') and keeps the signatures of the remaining upstream pages
+    so learn() can index them once parsed. Returns the reused page count.
+    dry_run (used by the planner) leaves the savings counters alone.
+    """
+    if not DEDUP_ENABLED or routing_plan is None:
+        return 0
+    try:
+        signatures = _signatures(file_path, routing_plan)
+    except Exception as e:
+        print(f"⚠️  No se pudo calcular las firmas de página de {os.path.basename(file_path)}: {e}")
+        return 0
+
+    page_index = index()
+    reused = {}
+    for page, signature in signatures.items():
+        match = page_index.find(signature)
+        if match is not None:
+            reused[page] = match
+    for page, (markdown, match_source, match_page, match_mode) in reused.items():
+        routing_plan['local_text'][page] = markdown
+        routing_plan['pages'][page] = 'reused'
+        routing_plan.setdefault('reused_from', {})[page] = {
+            'source': match_source, 'page': match_page + 1, 'mode': match_mode}
+    routing_plan['pages_by_mode'] = {
+        mode: [i for i, m in enumerate(routing_plan['pages']) if m == mode] for mode in page_router.MODES}
+    routing_plan['signatures'] = {page: sig for page, sig in signatures.items() if page not in reused}
+
+    if dry_run:
+        return len(reused)
+    with _counters_lock:
+        _counters['pages_checked'] += len(signatures)
+        _counters['pages_reused'] += len(reused)
+    if reused:
+        print(f"♻️  {len(reused)} páginas de {source or os.path.basename(file_path)} reutilizadas de documentos ya procesados")
+    return len(reused)
+
+
+def learn(routing_plan, documents, source):
+    """Index the pages of a file just parsed upstream (documents in page order)."""
+    if not DEDUP_ENABLED or not routing_plan or not routing_plan.get('signatures'):
+        return
+    if len(documents) != len(routing_plan['pages']):
+        return
+    page_index = index()
+    for page, signature in routing_plan['signatures'].items():
+        markdown = documents[page].text
+        if markdown.strip():
+            page_index.add(signature, markdown, source, page, routing_plan['pages'][page])
+
+
+def stats():
+    """Pages checked and reused since start, and the pages in the index."""
+    with _counters_lock:
+        counters = dict(_counters)
+    counters['enabled'] = DEDUP_ENABLED
+    counters['indexed_pages'] = len(index()) if DEDUP_ENABLED else 0
+    return counters
@@ -0,0 +1,144 @@
+import os
+import re
+import time
+import threading
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # without pypdf every page goes to the premium (auto) mode
+    PdfReader = None
+
+# Route PDF pages to the cheapest parse mode that handles them
+PAGE_ROUTING_ENABLED = os.getenv("PAGE_ROUTING_ENABLED", "true").lower() == "true"
+# Extract clean text-only pages locally instead of sending them upstream at all
+PAGE_ROUTING_LOCAL_TEXT = os.getenv("PAGE_ROUTING_LOCAL_TEXT", "false").lower() == "true"
+# A page with at least this many extracted characters has a usable text layer
+PAGE_MIN_TEXT_CHARS = int(os.getenv("PAGE_MIN_TEXT_CHARS", "200"))
+# Images smaller than this (pixels per side) are ignored (logos, bullets...)
+PAGE_MIN_IMAGE_SIDE = int(os.getenv("PAGE_MIN_IMAGE_SIDE", "200"))
+# Pages drawing at least this many lines/rectangles are treated as tables
+PAGE_TABLE_MIN_LINES = int(os.getenv("PAGE_TABLE_MIN_LINES", "12"))
+
+# 'reused' pages take the markdown of a near-duplicate parsed before (see page_dedup)
+MODES = ('local', 'fast', 'premium', 'reused')
+
+# Path operators that draw ruling lines: "x y w h re" and "x y l"
+_LINE_OPS_RE = re.compile(rb'(?:^|\s)(?:re|l)(?=\s)')
+
+# Moving average of premium seconds per page, used to estimate time saved
+_premium_seconds_per_page = None
+_stats_lock = threading.Lock()
+
+
+def _large_images(page):
+    resources = page.get('/Resources') or {}
+    xobjects = resources.get('/XObject') if hasattr(resources, 'get') else None
+    if not xobjects:
+        return 0
+    count = 0
+    for ref in xobjects.get_object().values():
+        xobject = ref.get_object()
+        if xobject.get('/Subtype') != '/Image':
+            continue
+        if min(int(xobject.get('/Width', 0)), int(xobject.get('/Height', 0))) >= PAGE_MIN_IMAGE_SIDE:
+            count += 1
+    return count
+
+
+def _line_ops(page):
+    contents = page.get_contents()
+    if contents is None:
+        return 0
+    return len(_LINE_OPS_RE.findall(contents.get_data()))
+
+
+def classify_page(page):
+    """Inspect one pypdf page and return (mode, features, extracted text)."""
+    text = page.extract_text() or ''
+    features = {
+        'text_chars': len(text.strip()),
+        'images': _large_images(page),
+        'line_ops': _line_ops(page),
+    }
+    if features['images'] or features['line_ops'] >= PAGE_TABLE_MIN_LINES:
+        mode = 'premium'
+    elif features['text_chars'] < PAGE_MIN_TEXT_CHARS:
+        mode = 'premium'  # no text layer: scanned page, needs OCR
+    else:
+        mode = 'local' if PAGE_ROUTING_LOCAL_TEXT else 'fast'
+    return mode, features, text
+
+
+def plan(file_path):
+    """Classify every page of a PDF.
+
+    Returns a dict with 'pages' (mode per page index), 'pages_by_mode',
+    'local_text' (page index -> text for local pages), the extracted 'texts'
+    and 'features' of every page and 'classify_seconds', or None when
+    routing is disabled or the PDF can't be inspected.
+    """
+    if not PAGE_ROUTING_ENABLED or PdfReader is None:
+        return None
+    started = time.time()
+    try:
+        reader = PdfReader(file_path)
+        if reader.is_encrypted:
+            reader.decrypt('')
+        modes = []
+        local_text = {}
+        texts = []
+        features = []
+        for index, page in enumerate(reader.pages):
+            mode, page_features, text = classify_page(page)
+            modes.append(mode)
+            texts.append(text)
+            features.append(page_features)
+            if mode == 'local':
+                local_text[index] = text
+    except Exception as e:
+        print(f"⚠️  No se pudo clasificar las páginas de {os.path.basename(file_path)}: {e}")
+        return None
+
+    return {
+        'pages': modes,
+        'pages_by_mode': {mode: [i for i, m in enumerate(modes) if m == mode] for mode in MODES},
+        'local_text': local_text,
+        'texts': texts,
+        'features': features,
+        'classify_seconds': time.time() - started,
+    }
+
+
+def worth_routing(routing_plan):
+    """Routing only pays off when some pages can skip the premium mode."""
+    return routing_plan is not None and len(routing_plan['pages_by_mode']['premium']) < len(routing_plan['pages'])
+
+
+def record(routing_plan, seconds_by_mode):
+    """Summarize a routed parse: pages per mode, timings and estimated time saved."""
+    global _premium_seconds_per_page
+    premium_pages = len(routing_plan['pages_by_mode']['premium'])
+    with _stats_lock:
+        if premium_pages and seconds_by_mode.get('premium'):
+            observed = seconds_by_mode['premium'] / premium_pages
+            if _premium_seconds_per_page is None:
+                _premium_seconds_per_page = observed
+            else:
+                _premium_seconds_per_page = 0.8 * _premium_seconds_per_page + 0.2 * observed
+        per_page = _premium_seconds_per_page
+
+    routed_pages = len(routing_plan['pages']) - premium_pages
+    cheap_seconds = seconds_by_mode.get('fast', 0) + seconds_by_mode.get('local', 0)
+    return {
+        'pages': {mode: len(pages) for mode, pages in routing_plan['pages_by_mode'].items()},
+        'seconds': {mode: round(sec, 2) for mode, sec in seconds_by_mode.items()},
+        'classify_seconds': round(routing_plan['classify_seconds'], 3),
+        'estimated_seconds_saved': (
+            round(max(0.0, routed_pages * per_page - cheap_seconds), 1) if per_page else None
+        ),
+    }
+
+
+def target_pages(pages):
+    """Format page indexes for LlamaParse's target_pages option (0-based)."""
+    return ','.join(str(page) for page in pages)
@@ -0,0 +1,217 @@
+import os
+import json
+import heapq
+import threading
+import preflight
+import page_router
+import scheduler
+import key_pool
+import hedging
+import page_dedup
+import spreadsheet
+
+# Latency model learned from past conversions (seconds per page by file type and size)
+PLANNER_MODEL_PATH = os.getenv("PLANNER_MODEL_PATH", os.path.join(scheduler.STATE_DIR, "latency_model.json"))
+# Weight of the newest conversion in the model's moving averages
+PLANNER_EWMA_ALPHA = float(os.getenv("PLANNER_EWMA_ALPHA", "0.2"))
+# Seconds per page assumed until a file type has been observed
+PLANNER_DEFAULT_SECONDS_PER_PAGE = float(os.getenv("PLANNER_DEFAULT_SECONDS_PER_PAGE", "6"))
+# Upstream credits per page in each parse mode (set them to your LlamaParse plan);
+# the premium (auto) mode default is an upper bound: every page escalated
+CREDITS_PER_PAGE_FAST = float(os.getenv("CREDITS_PER_PAGE_FAST", "1"))
+CREDITS_PER_PAGE_PREMIUM = float(os.getenv("CREDITS_PER_PAGE_PREMIUM", "45"))
+
+# Conversions of a type and size needed before its own average is trusted
+MIN_SAMPLES = 3
+# Reported share of the planned work a running file can account for before it finishes
+MAX_PARTIAL = 0.95
+
+_lock = threading.Lock()
+_model = None
+
+
+def _load():
+    global _model
+    if _model is None:
+        try:
+            with open(PLANNER_MODEL_PATH, 'r', encoding='utf-8') as f:
+                _model = json.load(f)
+        except (FileNotFoundError, ValueError):
+            _model = {}
+    return _model
+
+
+def _save(model):
+    os.makedirs(os.path.dirname(PLANNER_MODEL_PATH) or '.', exist_ok=True)
+    tmp_path = PLANNER_MODEL_PATH + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(model, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, PLANNER_MODEL_PATH)
+
+
+def file_type(filename):
+    return os.path.splitext(filename)[1].lower() or '(sin extensión)'
+
+
+def size_bucket(pages):
+    """Page bucket shared with the hedging size classes."""
+    return next((f"<={limit}p" for limit in hedging.PAGE_BUCKETS if pages <= limit),
+                f">{hedging.PAGE_BUCKETS[-1]}p")
+
+
+def _keys(filename, pages):
+    """Model entries from most to least specific: type and size, type, everything."""
+    kind = file_type(filename)
+    return [f"{kind}:{size_bucket(pages)}", f"{kind}:*", "*"]
+
+
+def record(filename, pages, seconds):
+    """Learn from a finished conversion (wall time of the whole file).
+
+    pages must be the preflight's page count, the unit estimate() and
+    work() multiply the learned rate by (an estimate for office formats).
+    """
+    if not pages or seconds <= 0:
+        return
+    observed = seconds / pages
+    with _lock:
+        model = _load()
+        for key in _keys(filename, pages):
+            entry = model.setdefault(key, {'samples': 0, 'seconds_per_page': observed})
+            entry['samples'] += 1
+            entry['seconds_per_page'] += PLANNER_EWMA_ALPHA * (observed - entry['seconds_per_page'])
+        try:
+            _save(model)
+        except OSError as e:
+            print(f"⚠️  No se pudo guardar el modelo de latencia: {e}")
+
+
+def seconds_per_page(filename, pages):
+    """Learned seconds per page and the model entry they came from ('default' if none)."""
+    with _lock:
+        model = _load()
+        for key in _keys(filename, pages):
+            entry = model.get(key)
+            if entry and entry['samples'] >= MIN_SAMPLES:
+                return entry['seconds_per_page'], key
+    return PLANNER_DEFAULT_SECONDS_PER_PAGE, 'default'
+
+
+def estimate(file_path, routing=False):
+    """Estimate one file: pages, conversion seconds and upstream credits.
+
+    With routing, PDFs are classified page by page (as the conversion
+    would) so fast, local and already indexed (reused) pages are priced
+    as such; otherwise every page is priced in the premium mode.
+    """
+    name = os.path.basename(file_path)
+    try:
+        analysis = preflight.analyze(file_path)
+    except OSError as e:
+        return {'file': name, 'rejected': str(e), 'size': 0, 'pages': 0, 'seconds': 0.0, 'credits': 0.0}
+    if not analysis['ok']:
+        return {'file': name, 'rejected': analysis['reason'], 'size': analysis['size'],
+                'pages': 0, 'seconds': 0.0, 'credits': 0.0}
+
+    parse_as = analysis['parse_as'] or name
+    pages = analysis['pages'] or 1
+    pages_by_mode = {'local': 0, 'fast': 0, 'premium': pages, 'reused': 0}
+    if spreadsheet.handles(parse_as):
+        pages_by_mode = {'local': pages, 'fast': 0, 'premium': 0, 'reused': 0}
+    elif routing and analysis['kind'] == 'pdf':
+        routing_plan = page_router.plan(file_path)
+        page_dedup.apply(file_path, routing_plan, name, dry_run=True)
+        if page_router.worth_routing(routing_plan):
+            pages_by_mode = {mode: len(indexes) for mode, indexes in routing_plan['pages_by_mode'].items()}
+
+    per_page, source = seconds_per_page(parse_as, pages)
+    return {
+        'file': name,
+        'type': file_type(parse_as),
+        'size': analysis['size'],
+        'pages': pages,
+        'pages_by_mode': pages_by_mode,
+        'seconds': round(per_page * pages, 1),
+        'credits': pages_by_mode['fast'] * CREDITS_PER_PAGE_FAST + pages_by_mode['premium'] * CREDITS_PER_PAGE_PREMIUM,
+        'model': source,
+    }
+
+
+def work(file_path):
+    """Estimated seconds of a file, used to weight progress (no page routing, cheap)."""
+    try:
+        analysis = preflight.analyze(file_path)
+    except OSError:
+        return PLANNER_DEFAULT_SECONDS_PER_PAGE
+    pages = analysis['pages'] or 1
+    return seconds_per_page(analysis['parse_as'] or os.path.basename(file_path), pages)[0] * pages
+
+
+def parallelism(concurrency):
+    """Files that can really run at once: the workers, capped by the API keys' slots."""
+    return max(1, min(concurrency, len(key_pool.pool) * key_pool.pool.max_jobs_per_key))
+
+
+def makespan(durations, workers, delay=0):
+    """Wall time to run durations in order on `workers` slots (each takes the next file when free)."""
+    slots = [0.0] * max(1, workers)
+    for seconds in durations:
+        heapq.heappush(slots, heapq.heappop(slots) + seconds + delay)
+    return max(slots) if durations else 0.0
+
+
+def plan(file_paths, concurrency=1, delay=0, routing=True):
+    """Dry run of a batch: estimated duration and credits without calling the API.
+
+    file_paths are taken in the order they would run. delay is the pause a
+    worker takes between files.
+    """
+    items = [estimate(path, routing) for path in file_paths]
+    accepted = [item for item in items if 'rejected' not in item]
+    workers = parallelism(concurrency)
+
+    by_type = {}
+    for item in accepted:
+        totals = by_type.setdefault(item['type'], {'files': 0, 'pages': 0, 'seconds': 0.0, 'credits': 0.0})
+        totals['files'] += 1
+        totals['pages'] += item['pages']
+        totals['seconds'] = round(totals['seconds'] + item['seconds'], 1)
+        totals['credits'] += item['credits']
+
+    return {
+        'files': len(accepted),
+        'rejected': len(items) - len(accepted),
+        'bytes': sum(item['size'] for item in accepted),
+        'pages': sum(item['pages'] for item in accepted),
+        'pages_by_mode': {mode: sum(item['pages_by_mode'][mode] for item in accepted)
+                          for mode in page_router.MODES},
+        'parallelism': workers,
+        'estimated_work_seconds': round(sum(item['seconds'] for item in accepted), 1),
+        'estimated_duration_seconds': round(makespan([item['seconds'] for item in accepted], workers, delay), 1),
+        'estimated_credits': sum(item['credits'] for item in accepted),
+        'unmodeled_files': sum(1 for item in accepted if item['model'] == 'default'),
+        'by_type': by_type,
+        'items': items,
+    }
+
+
+def eta(remaining_work, workers, speed=1.0):
+    """Seconds left for remaining_work (estimated seconds), corrected by the observed speed ratio."""
+    return round(remaining_work * speed / max(1, workers), 1)
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}h {minutes:02d}m"
+    if minutes:
+        return f"{minutes}m {seconds:02d}s"
+    return f"{seconds}s"
+
+
+def model_stats():
+    """Learned entries of the latency model for the metrics endpoint."""
+    with _lock:
+        return {key: dict(entry) for key, entry in _load().items()}
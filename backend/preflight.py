@@ -0,0 +1,205 @@
+import os
+import re
+import threading
+import spreadsheet
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # page counts fall back to scanning the raw PDF
+    PdfReader = None
+
+# Size limits checked locally before any upstream call
+MAX_FILE_SIZE = int(os.getenv("PREFLIGHT_MAX_FILE_SIZE", str(100 * 1024 * 1024)))
+MAX_AUDIO_SIZE = int(os.getenv("PREFLIGHT_MAX_AUDIO_SIZE", str(20 * 1024 * 1024)))  # LlamaParse audio limit
+
+# Rough bytes per page for files whose pages can't be counted locally
+BYTES_PER_PAGE_ESTIMATE = 100 * 1024
+
+AUDIO_EXTENSIONS = {'.mp3', '.mp4', '.mpeg', '.mpga', '.m4a', '.wav', '.webm'}
+# Parsed (and billed) upstream as one page whatever their size: no size-based page estimate
+SINGLE_PAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff', '.webp', '.svg'} | AUDIO_EXTENSIONS
+
+# Content kind -> extensions that must carry that kind of content
+# (.mpeg is ambiguous: MPEG audio or an MPEG program/transport stream video)
+EXPECTED_KIND = {
+    'pdf': {'.pdf'},
+    'zip': {'.docx', '.docm', '.dotm', '.pptx', '.pptm', '.potx', '.potm', '.xlsx', '.xlsm',
+            '.xlsb', '.epub', '.ods', '.numbers', '.pages', '.key', '.sxw', '.sxi', '.sxg'},
+    'ole': {'.doc', '.dot', '.ppt', '.pot', '.xls', '.xlw', '.hwp', '.wps', '.et'},
+    'png': {'.png'},
+    'jpeg': {'.jpg', '.jpeg'},
+    'gif': {'.gif'},
+    'bmp': {'.bmp'},
+    'tiff': {'.tiff'},
+    'webp': {'.webp'},
+    'rtf': {'.rtf'},
+    'wav': {'.wav'},
+    'mp3': {'.mp3', '.mpga', '.mpeg'},
+    'mpeg': {'.mpeg'},
+    'mp4': {'.mp4', '.m4a'},
+    'webm': {'.webm'},
+}
+
+# Kinds that can be parsed under their own extension when the original one is wrong
+REROUTE_EXTENSION = {
+    'pdf': '.pdf', 'png': '.png', 'jpeg': '.jpg', 'gif': '.gif', 'bmp': '.bmp',
+    'tiff': '.tiff', 'webp': '.webp', 'rtf': '.rtf', 'wav': '.wav', 'mp3': '.mp3',
+    'mp4': '.mp4', 'webm': '.webm',
+}
+
+_PDF_PAGE_RE = re.compile(rb'/Type\s*/Page(?![a-zA-Z])')
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+class PreflightError(Exception):
+    """A file was rejected locally; retrying or sending it upstream won't help."""
+
+    def __init__(self, filename, reason):
+        super().__init__(f"Preflight: {reason}")
+        self.filename = filename
+        self.reason = reason
+
+
+def detect_kind(header):
+    """Detect the content kind from the first bytes of a file (None if unknown)."""
+    if header.startswith(b'%PDF-'):
+        return 'pdf'
+    if header.startswith(b'PK\x03\x04'):
+        return 'zip'
+    if header.startswith(b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'):
+        return 'ole'
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if header.startswith((b'GIF87a', b'GIF89a')):
+        return 'gif'
+    if header.startswith(b'BM'):
+        return 'bmp'
+    if header.startswith((b'II*\x00', b'MM\x00*')):
+        return 'tiff'
+    if header.startswith(b'RIFF') and header[8:12] == b'WEBP':
+        return 'webp'
+    if header.startswith(b'RIFF') and header[8:12] == b'WAVE':
+        return 'wav'
+    if header.startswith(b'{\\rtf'):
+        return 'rtf'
+    # MPEG audio frame sync: 11 set bits (any version/layer/protection)
+    if header.startswith(b'ID3') or (len(header) >= 2 and header[0] == 0xFF and header[1] & 0xE0 == 0xE0):
+        return 'mp3'
+    # MPEG program stream pack header, or a transport stream sync byte
+    if header.startswith(b'\x00\x00\x01\xba') or header.startswith(b'\x47'):
+        return 'mpeg'
+    if header[4:8] == b'ftyp':
+        return 'mp4'
+    if header.startswith(b'\x1a\x45\xdf\xa3'):
+        return 'webm'
+    return None
+
+
+def _inspect_pdf(file_path, result):
+    """Fill page count and encryption info; returns a rejection reason or None."""
+    with open(file_path, 'rb') as f:
+        f.seek(max(0, result['size'] - 2048))
+        tail = f.read()
+    if b'%%EOF' not in tail:
+        return 'PDF truncado o corrupto (sin marcador %%EOF)'
+
+    if PdfReader is None:
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        result['encrypted'] = b'/Encrypt' in data
+        result['pages'] = len(_PDF_PAGE_RE.findall(data)) or None
+        return None
+
+    try:
+        reader = PdfReader(file_path)
+        result['encrypted'] = reader.is_encrypted
+        if reader.is_encrypted and not reader.decrypt(''):
+            return 'PDF protegido con contraseña'
+        result['pages'] = len(reader.pages)
+    except Exception as e:
+        return f'PDF corrupto: {e}'
+    return None
+
+
+def _analyze(file_path):
+    filename = os.path.basename(file_path)
+    ext = os.path.splitext(filename)[1].lower()
+    result = {
+        'ok': True,
+        'reason': None,
+        'size': os.path.getsize(file_path),
+        'kind': None,
+        'pages': None,
+        'encrypted': False,
+        'parse_as': None,
+    }
+
+    def reject(reason):
+        result.update(ok=False, reason=reason)
+        return result
+
+    if result['size'] == 0:
+        return reject('archivo vacío (0 bytes)')
+    # The upstream size limit doesn't apply to spreadsheets converted locally
+    if result['size'] > MAX_FILE_SIZE and not spreadsheet.handles(filename):
+        return reject(f"supera el tamaño máximo de {MAX_FILE_SIZE // (1024 * 1024)}MB")
+    if ext in AUDIO_EXTENSIONS and result['size'] > MAX_AUDIO_SIZE:
+        return reject(f"audio mayor a {MAX_AUDIO_SIZE // (1024 * 1024)}MB (límite de LlamaParse)")
+
+    with open(file_path, 'rb') as f:
+        result['kind'] = kind = detect_kind(f.read(16))
+
+    expected = {k for k, exts in EXPECTED_KIND.items() if ext in exts}
+    if expected and kind not in expected:
+        if kind in REROUTE_EXTENSION:
+            # Wrong extension but recognizable content: parse it as what it really is
+            result['parse_as'] = os.path.splitext(filename)[0] + REROUTE_EXTENSION[kind]
+        else:
+            return reject(f"el contenido no corresponde a la extensión {ext}")
+
+    if kind == 'pdf':
+        reason = _inspect_pdf(file_path, result)
+        if reason:
+            return reject(reason)
+
+    if result['pages'] is None:
+        parsed_ext = os.path.splitext(result['parse_as'] or filename)[1].lower()
+        if parsed_ext in SINGLE_PAGE_EXTENSIONS:
+            result['pages'] = 1
+        else:
+            result['pages'] = max(1, result['size'] // BYTES_PER_PAGE_ESTIMATE)
+    return result
+
+
+def analyze(file_path):
+    """Run the local preflight checks on a file.
+
+    Returns a dict with 'ok', 'reason', 'size', 'kind', 'pages', 'encrypted'
+    and 'parse_as' (name to parse the file under when its extension is wrong).
+    Results are cached while the file's size and mtime don't change.
+    """
+    st = os.stat(file_path)
+    key = (os.path.abspath(file_path), st.st_size, st.st_mtime_ns)
+    with _cache_lock:
+        if key in _cache:
+            return dict(_cache[key])
+
+    result = _analyze(file_path)
+
+    with _cache_lock:
+        for stale in [k for k in _cache if k[0] == key[0]]:
+            del _cache[stale]
+        _cache[key] = result
+    return dict(result)
+
+
+def check(file_path):
+    """Run the preflight and raise PreflightError if the file is rejected."""
+    result = analyze(file_path)
+    if not result['ok']:
+        raise PreflightError(os.path.basename(file_path), result['reason'])
+    return result
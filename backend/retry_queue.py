@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import heapq
+import random
+import threading
+import scheduler
+import preflight
+import hedging
+import key_pool
+
+# Attempts per file (first try included) before it goes to the dead-letter list
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "5"))
+# Exponential backoff: base * 2^(attempt - 1) capped at the max, with jitter on the upper half
+RETRY_BASE_SECONDS = float(os.getenv("RETRY_BASE_SECONDS", "15"))
+RETRY_MAX_SECONDS = float(os.getenv("RETRY_MAX_SECONDS", "900"))
+
+PERMANENT = 'permanent'
+RATE_LIMIT = 'rate_limit'
+TRANSIENT = 'transient'
+
+# HTTP statuses that are worth retrying; any other 4xx is permanent
+RETRYABLE_STATUSES = {408, 409, 425, 429}
+
+_dead_letter_lock = threading.Lock()
+
+
+class EmptyOutputError(Exception):
+    """The upstream parse succeeded but produced no content."""
+
+
+def _status_code(error):
+    for candidate in (error, getattr(error, 'response', None)):
+        code = getattr(candidate, 'status_code', None) or getattr(candidate, 'status', None)
+        if isinstance(code, int):
+            return code
+    return None
+
+
+def classify(error, rate_limited=False):
+    """Retry policy class of an error: 'permanent', 'rate_limit' or 'transient'.
+
+    rate_limited is the caller's rate limit check (file_to_md.is_rate_limit_error).
+    Timeouts, network errors and 5xx are transient; so is anything not
+    recognized, which is retried until RETRY_MAX_ATTEMPTS.
+    """
+    if isinstance(error, (preflight.PreflightError, EmptyOutputError, FileNotFoundError, PermissionError)):
+        return PERMANENT
+    if rate_limited or isinstance(error, key_pool.RateLimitedError):
+        return RATE_LIMIT
+    if isinstance(error, (hedging.ParseTimeoutError, TimeoutError, ConnectionError)):
+        return TRANSIENT
+    status = _status_code(error)
+    if status is not None and 400 <= status < 500 and status not in RETRYABLE_STATUSES:
+        return PERMANENT
+    return TRANSIENT
+
+
+def backoff(attempt, error_class):
+    """Seconds to wait before retry number `attempt` (1 = first retry)."""
+    ceiling = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (attempt - 1))
+    delay = ceiling / 2 + random.uniform(0, ceiling / 2)
+    if error_class == RATE_LIMIT:
+        # No point retrying before a key is usable again
+        delay = max(delay, key_pool.pool.cooldown_remaining())
+    return delay
+
+
+class RetryQueue:
+    """Failed files waiting for a retry, and the dead-letter list of those given up on.
+
+    A failure is retried after an exponential backoff with jitter unless it
+    is permanent or the file ran out of attempts, in which case it moves to
+    the dead-letter list (persisted under STATE_DIR) with its last error and
+    attempt count. Waiting retries don't hold a worker: a timer thread calls
+    on_due(filename, path) when each one is due.
+    """
+
+    def __init__(self, on_due, path=None):
+        self.on_due = on_due
+        self.path = path or os.path.join(scheduler.STATE_DIR, 'dead_letter.json')
+        self._lock = threading.Condition()
+        self._waiting = []  # heap of (due time, filename, path)
+        self._attempts = {}  # filename -> failed attempts so far
+        self._thread = None
+
+    def _load_dead(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save_dead(self, dead):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(dead, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def failed(self, filename, path, error, rate_limited=False):
+        """Record a failed attempt. Returns (error class, seconds until the retry or None if dead-lettered)."""
+        error_class = classify(error, rate_limited)
+        with self._lock:
+            attempts = self._attempts.get(filename, 0) + 1
+            self._attempts[filename] = attempts
+            if error_class != PERMANENT and attempts < RETRY_MAX_ATTEMPTS:
+                delay = backoff(attempts, error_class)
+                self._waiting = [item for item in self._waiting if item[1] != filename]
+                heapq.heapify(self._waiting)
+                heapq.heappush(self._waiting, (time.time() + delay, filename, path))
+                self._lock.notify()
+                self._start()
+                return error_class, delay
+            self._attempts.pop(filename, None)
+
+        with _dead_letter_lock:
+            dead = self._load_dead()
+            dead[filename] = {
+                'file': filename,
+                'error': str(error),
+                'error_class': error_class,
+                'attempts': attempts,
+                'failed_at': time.time(),
+            }
+            self._save_dead(dead)
+        return error_class, None
+
+    def succeeded(self, filename):
+        """Forget a file's failed attempts (and its dead letter, if it was requeued by hand)."""
+        with self._lock:
+            self._attempts.pop(filename, None)
+        self.discard(filename)
+
+    def discard(self, filename):
+        """Drop a file from the retries and the dead-letter list (e.g. when its input is deleted)."""
+        with self._lock:
+            self._waiting = [item for item in self._waiting if item[1] != filename]
+            heapq.heapify(self._waiting)
+        with _dead_letter_lock:
+            dead = self._load_dead()
+            if dead.pop(filename, None) is not None:
+                self._save_dead(dead)
+
+    def is_waiting(self, filename):
+        with self._lock:
+            return any(item[1] == filename for item in self._waiting)
+
+    def dead_letters(self):
+        with _dead_letter_lock:
+            return sorted(self._load_dead().values(), key=lambda entry: entry['failed_at'], reverse=True)
+
+    def requeue(self, filenames=None):
+        """Take files (all if None) off the dead-letter list with a fresh attempt count. Returns their names."""
+        with _dead_letter_lock:
+            dead = self._load_dead()
+            names = [name for name in (dead if filenames is None else filenames) if name in dead]
+            for name in names:
+                del dead[name]
+            if names:
+                self._save_dead(dead)
+        with self._lock:
+            for name in names:
+                self._attempts.pop(name, None)
+        return names
+
+    def waiting(self):
+        """Retries not due yet: [{file, attempts, retry_in}]."""
+        now = time.time()
+        with self._lock:
+            return [{'file': filename, 'attempts': self._attempts.get(filename, 0),
+                     'retry_in': round(max(0.0, due - now), 1)}
+                    for due, filename, _ in sorted(self._waiting)]
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        while True:
+            with self._lock:
+                while not self._waiting or self._waiting[0][0] > time.time():
+                    self._lock.wait(self._waiting[0][0] - time.time() if self._waiting else None)
+                _, filename, path = heapq.heappop(self._waiting)
+            try:
+                self.on_due(filename, path)
+            except Exception as e:
+                print(f"⚠️  No se pudo reencolar {filename}: {e}")
+
+    def stats(self):
+        with self._lock:
+            waiting = len(self._waiting)
+        return {'waiting': waiting, 'dead_letters': len(self.dead_letters()), 'max_attempts': RETRY_MAX_ATTEMPTS}
@@ -0,0 +1,285 @@
+import os
+import json
+import math
+import heapq
+import time
+import threading
+import preflight
+
+# Directory for persistent pipeline state (priorities, models, indexes...)
+STATE_DIR = os.getenv("STATE_DIR", ".filetomd")
+
+# Scheduling policy: "fifo", "sjf_size" or "sjf_pages"
+SCHEDULING_POLICY = os.getenv("SCHEDULING_POLICY", "sjf_size")
+# A job's cost counts half for each this many seconds it has waited (0 disables aging)
+SCHEDULING_AGING_SECONDS = float(os.getenv("SCHEDULING_AGING_SECONDS", "300"))
+
+# Tenant of files without one: unidentified uploads, the CLI (see tenants.py)
+DEFAULT_TENANT = os.getenv("TENANT_DEFAULT", "default")
+
+_priorities_lock = threading.Lock()
+
+
+def _priorities_path():
+    return os.path.join(STATE_DIR, 'priorities.json')
+
+
+def load_priorities():
+    """Load the per-file priorities set at upload time."""
+    try:
+        with open(_priorities_path(), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def priority_of(filename, priorities=None):
+    return (load_priorities() if priorities is None else priorities).get(filename, 0)
+
+
+def set_priority(filenames, priority):
+    """Persist an explicit priority for files (higher runs first). None clears it."""
+    with _priorities_lock:
+        priorities = load_priorities()
+        for filename in filenames:
+            if priority is None:
+                priorities.pop(filename, None)
+            else:
+                priorities[filename] = int(priority)
+        os.makedirs(STATE_DIR, exist_ok=True)
+        tmp_path = _priorities_path() + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(priorities, f)
+        os.replace(tmp_path, _priorities_path())
+
+
+def estimate_pages(file_path):
+    """Page count from the local preflight (real count for PDFs, size-based otherwise)."""
+    try:
+        return preflight.analyze(file_path)['pages'] or 1
+    except OSError:
+        return 1
+
+
+def _fifo_cost(job):
+    return job['enqueued_at']
+
+
+def _size_cost(job):
+    return job['size']
+
+
+def _pages_cost(job):
+    if job.get('pages') is None:
+        job['pages'] = estimate_pages(job['path'])
+    return job['pages']
+
+
+# Policy name -> function(job) returning a cost; cheaper jobs run first
+POLICIES = {
+    'fifo': _fifo_cost,
+    'sjf_size': _size_cost,
+    'sjf_pages': _pages_cost,
+}
+
+
+def register_policy(name, cost_function):
+    """Register a custom scheduling policy."""
+    POLICIES[name] = cost_function
+
+
+def _file_size(file_path):
+    try:
+        return os.path.getsize(file_path)
+    except OSError:
+        return 0
+
+
+def make_job(filename, file_path, priority=0, tenant=None, group=None):
+    """Build the job record used by the queue."""
+    return {
+        'filename': filename,
+        'tenant': tenant or DEFAULT_TENANT,
+        'path': file_path,
+        'size': _file_size(file_path),
+        'pages': None,
+        'work': None,
+        'priority': priority,
+        'group': group,
+        'enqueued_at': time.time(),
+    }
+
+
+class WorkQueue:
+    """Thread-safe queue of pending files ordered by a scheduling policy.
+
+    Each tenant has its own share of the queue: the next job comes from the
+    tenant that has received the least service (estimated pages divided by
+    its weight), skipping tenants at their max_active cap, so one large
+    batch can't starve the others. Within a tenant, jobs with a higher
+    explicit priority always go first, then the policy cost decides,
+    halved for every aging_seconds a job has been waiting. Aging is
+    subtracted from the log of the cost, so a file 1000x larger than the
+    ones arriving behind it catches up after about 10 aging periods,
+    whatever the unit (bytes or pages) of the cost.
+
+    weight(tenant) and max_active(tenant) default to 1 and 0 (no cap).
+    group(file_path), computed once when a file is queued, tags the job
+    with the batch it can share with others (see take); default None.
+    Every job returned by get() must be given back with done().
+    """
+
+    def __init__(self, policy=None, aging_seconds=None, weight=None, max_active=None, group=None):
+        self.policy = policy or SCHEDULING_POLICY
+        if self.policy not in POLICIES:
+            raise ValueError(f"Política de planificación desconocida: {self.policy}")
+        self.aging_seconds = SCHEDULING_AGING_SECONDS if aging_seconds is None else aging_seconds
+        self.weight = weight or (lambda tenant: 1)
+        self.max_active = max_active or (lambda tenant: 0)
+        self.group = group or (lambda file_path: None)
+        self._jobs = {}
+        self._active = {}  # tenant -> jobs taken with get() and not done yet
+        self._virtual = {}  # tenant -> service received, in weighted pages
+        self._clock = 0.0  # service of the last tenant served: where idle tenants rejoin
+        self._condition = threading.Condition()
+
+    def _sort_key(self, job, now):
+        cost = POLICIES[self.policy](job)
+        if self.policy != 'fifo' and self.aging_seconds > 0:
+            cost = math.log2(1 + max(cost, 0)) - (now - job['enqueued_at']) / self.aging_seconds
+        return (-job['priority'], cost)
+
+    def put(self, filename, file_path, priority=None, tenant=None):
+        """Add a file to the queue, or refresh it if it is already queued."""
+        if priority is None:
+            priority = priority_of(filename)
+        # May read the file: done before taking the lock
+        group = self.group(file_path)
+        with self._condition:
+            job = self._jobs.get(filename)
+            if job is None:
+                job = make_job(filename, file_path, priority, tenant, group)
+                if not self._active.get(job['tenant']) and not any(
+                        queued['tenant'] == job['tenant'] for queued in self._jobs.values()):
+                    # A tenant back from idle doesn't get credit for the time it had nothing queued
+                    self._virtual[job['tenant']] = max(self._virtual.get(job['tenant'], 0.0), self._clock)
+                self._jobs[filename] = job
+            else:
+                job.update(path=file_path, priority=priority, group=group, pages=None, work=None,
+                           size=_file_size(file_path))
+            self._condition.notify()
+
+    def __contains__(self, filename):
+        with self._condition:
+            return filename in self._jobs
+
+    def _charge(self, job):
+        tenant = job['tenant']
+        self._clock = self._virtual.get(tenant, self._clock)
+        self._virtual[tenant] = self._clock + _pages_cost(job) / self.weight(tenant)
+
+    def _next_tenant(self):
+        backlogged = {job['tenant'] for job in self._jobs.values()}
+        eligible = [tenant for tenant in backlogged
+                    if not self.max_active(tenant) or self._active.get(tenant, 0) < self.max_active(tenant)]
+        return min(eligible, key=lambda tenant: (self._virtual.get(tenant, self._clock), tenant), default=None)
+
+    def get(self, block=True, timeout=None):
+        """Pop the next job to run, or None if the queue is empty or every queued tenant is at its cap."""
+        with self._condition:
+            if block and not self._jobs:
+                self._condition.wait(timeout)
+            tenant = self._next_tenant()
+            if tenant is None:
+                return None
+            now = time.time()
+            job = min((j for j in self._jobs.values() if j['tenant'] == tenant),
+                      key=lambda j: self._sort_key(j, now))
+            self._charge(job)
+            self._active[tenant] = self._active.get(tenant, 0) + 1
+            return self._jobs.pop(job['filename'])
+
+    def take(self, accept, limit, scan=None):
+        """Pop up to `limit` more jobs, in run order, for which accept(job) is true.
+
+        Only the first `scan` queued jobs in run order are looked at (all
+        if None); accept runs under the queue lock, so it must be cheap.
+        They run along with a job from get() and are charged to their
+        tenants' share, but don't take a slot of their own.
+        """
+        with self._condition:
+            now = time.time()
+            key = lambda j: self._sort_key(j, now)
+            candidates = (sorted(self._jobs.values(), key=key) if scan is None
+                          else heapq.nsmallest(scan, self._jobs.values(), key=key))
+            taken = []
+            for job in candidates:
+                if len(taken) >= limit:
+                    break
+                if accept(job):
+                    self._charge(job)
+                    taken.append(self._jobs.pop(job['filename']))
+            return taken
+
+    def done(self, job):
+        """Give back the slot of a job returned by get()."""
+        with self._condition:
+            self._active[job['tenant']] = max(0, self._active.get(job['tenant'], 0) - 1)
+            self._condition.notify_all()
+
+    def wait(self, timeout):
+        """Block until a job is done or queued (or timeout seconds pass)."""
+        with self._condition:
+            self._condition.wait(timeout)
+
+    def active(self):
+        """Jobs running per tenant."""
+        with self._condition:
+            return {tenant: count for tenant, count in self._active.items() if count}
+
+    def remove(self, filename):
+        """Drop a file from the queue (e.g. when the input is deleted)."""
+        with self._condition:
+            return self._jobs.pop(filename, None) is not None
+
+    def snapshot(self):
+        """Queued jobs in the order they would run now."""
+        with self._condition:
+            now = time.time()
+            jobs = sorted(self._jobs.values(), key=lambda j: self._sort_key(j, now))
+            return [dict(job) for job in jobs]
+
+    def pending_pages(self, *extra_jobs):
+        """Estimated pages of the queued jobs (plus extra_jobs, e.g. the running one)."""
+        with self._condition:
+            jobs = list(self._jobs.values()) + list(extra_jobs)
+        for job in jobs:
+            if job.get('pages') is None:
+                job['pages'] = estimate_pages(job['path'])
+        return sum(job['pages'] for job in jobs)
+
+    def pending_work(self, estimate, *extra_jobs):
+        """Estimated work of the queued jobs (plus extra_jobs), estimate(path) per job."""
+        with self._condition:
+            jobs = list(self._jobs.values()) + list(extra_jobs)
+        for job in jobs:
+            if job.get('work') is None:
+                job['work'] = estimate(job['path'])
+        return sum(job['work'] for job in jobs)
+
+    def __len__(self):
+        with self._condition:
+            return len(self._jobs)
+
+
+def order_files(filenames, input_dir, policy=None, locate=None):
+    """Order a batch of filenames by policy (one-shot version of WorkQueue).
+
+    locate(filename) gives a file's path when it isn't directly in input_dir.
+    """
+    queue = WorkQueue(policy=policy)
+    priorities = load_priorities()
+    for filename in filenames:
+        queue.put(filename, locate(filename) if locate else os.path.join(input_dir, filename),
+                  priority_of(filename, priorities))
+    return [job['filename'] for job in queue.snapshot()]
@@ -0,0 +1,215 @@
+import os
+import csv
+import sys
+import zipfile
+import datetime
+import xml.etree.ElementTree as ET
+
+try:
+    import openpyxl
+    from openpyxl.utils.exceptions import InvalidFileException
+except ImportError:  # without openpyxl .xlsx/.xlsm files go to LlamaParse
+    openpyxl = InvalidFileException = None
+
+try:
+    import xlrd
+except ImportError:  # without xlrd .xls files go to LlamaParse
+    xlrd = None
+
+# Convert spreadsheets to markdown tables locally instead of sending them upstream
+SPREADSHEET_LOCAL = os.getenv("SPREADSHEET_LOCAL", "true").lower() == "true"
+# Rows per markdown table: longer sheets are split into several tables (pages), each with the header row
+SPREADSHEET_MAX_ROWS_PER_TABLE = int(os.getenv("SPREADSHEET_MAX_ROWS_PER_TABLE", "1000"))
+
+# Same page separator as file_to_md.documents_to_markdown: one page per sheet (or per table of a long sheet)
+PAGE_SEPARATOR = "\n\n---\n\n"
+
+# Repeated empty columns/rows of an .ods are expanded up to this count (sheets end in ~16k repeated blanks)
+MAX_REPEAT = 1024
+
+_ODS_TABLE = '{urn:oasis:names:tc:opendocument:xmlns:table:1.0}'
+_ODS_OFFICE = '{urn:oasis:names:tc:opendocument:xmlns:office:1.0}'
+
+# Errors of a corrupt or mislabeled file
+_READ_ERRORS = tuple(error for error in (
+    OSError, ValueError, KeyError, csv.Error, zipfile.BadZipFile, ET.ParseError,
+    InvalidFileException, xlrd.XLRDError if xlrd is not None else None) if error is not None)
+
+csv.field_size_limit(min(sys.maxsize, 2 ** 31 - 1))
+
+
+class SpreadsheetError(Exception):
+    """A spreadsheet could not be read locally."""
+
+
+def _readers():
+    readers = {'.csv': _csv_rows, '.tsv': _csv_rows, '.ods': _ods_rows, '.fods': _ods_rows}
+    if openpyxl is not None:
+        readers.update({'.xlsx': _xlsx_rows, '.xlsm': _xlsx_rows})
+    if xlrd is not None:
+        readers['.xls'] = _xls_rows
+    return readers
+
+
+def handles(file_name):
+    """Whether a file is converted locally by this module rather than parsed upstream."""
+    return SPREADSHEET_LOCAL and os.path.splitext(file_name)[1].lower() in _readers()
+
+
+def _csv_rows(file_path):
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    with open(file_path, 'r', encoding='utf-8-sig', errors='replace', newline='') as f:
+        if file_path.lower().endswith('.tsv'):
+            dialect = csv.excel_tab
+        else:
+            try:
+                dialect = csv.Sniffer().sniff(f.read(64 * 1024), delimiters=',;\t|')
+            except csv.Error:
+                dialect = csv.excel
+            f.seek(0)
+        for row in csv.reader(f, dialect):
+            yield name, row
+
+
+def _xlsx_rows(file_path):
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            for row in sheet.iter_rows(values_only=True):
+                yield sheet.title, row
+    finally:
+        workbook.close()
+
+
+def _xls_rows(file_path):
+    book = xlrd.open_workbook(file_path, on_demand=True)
+    try:
+        for index in range(book.nsheets):
+            sheet = book.sheet_by_index(index)
+            for r in range(sheet.nrows):
+                yield sheet.name, [xlrd.xldate_as_datetime(cell.value, book.datemode)
+                                   if cell.ctype == xlrd.XL_CELL_DATE else cell.value
+                                   for cell in sheet.row(r)]
+            book.unload_sheet(index)
+    finally:
+        book.release_resources()
+
+
+def _ods_value(cell):
+    kind = cell.get(_ODS_OFFICE + 'value-type')
+    if kind in ('float', 'percentage', 'currency') and cell.get(_ODS_OFFICE + 'value') is not None:
+        return float(cell.get(_ODS_OFFICE + 'value'))
+    if kind == 'date':
+        return cell.get(_ODS_OFFICE + 'date-value')
+    if kind == 'boolean':
+        return cell.get(_ODS_OFFICE + 'boolean-value') == 'true'
+    return '\n'.join(''.join(p.itertext()) for p in cell if p.tag.endswith('}p')) or None
+
+
+def _ods_rows(file_path):
+    """Rows of an .ods (content.xml in the zip) or flat .fods, parsed incrementally."""
+    if file_path.lower().endswith('.fods'):
+        source = open(file_path, 'rb')
+    else:
+        archive = zipfile.ZipFile(file_path)
+        source = archive.open('content.xml')
+    try:
+        stack = []
+        sheet = None
+        row = []
+        blanks = 0
+        for event, element in ET.iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                stack.append(element)
+                if element.tag == _ODS_TABLE + 'table':
+                    sheet = element.get(_ODS_TABLE + 'name')
+                elif element.tag == _ODS_TABLE + 'table-row':
+                    row, blanks = [], 0
+                continue
+            stack.pop()
+            if element.tag in (_ODS_TABLE + 'table-cell', _ODS_TABLE + 'covered-table-cell'):
+                repeat = min(int(element.get(_ODS_TABLE + 'number-columns-repeated', '1')), MAX_REPEAT)
+                value = _ods_value(element)
+                if value is None:
+                    # Only materialized if a value follows: rows end in thousands of repeated blanks
+                    blanks += repeat
+                else:
+                    row.extend([None] * blanks + [value] * repeat)
+                    blanks = 0
+            elif element.tag == _ODS_TABLE + 'table-row':
+                if row:
+                    repeat = min(int(element.get(_ODS_TABLE + 'number-rows-repeated', '1')), MAX_REPEAT)
+                    for _ in range(repeat):
+                        yield sheet, row
+                # Drop parsed rows so memory stays bounded by one row
+                if stack:
+                    stack[-1].remove(element)
+            elif element.tag == _ODS_TABLE + 'table' and stack:
+                stack[-1].remove(element)
+    finally:
+        source.close()
+        if not file_path.lower().endswith('.fods'):
+            archive.close()
+
+
+def _cell(value):
+    """Markdown table cell text of a spreadsheet value."""
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    elif isinstance(value, datetime.datetime) and value.time() == datetime.time():
+        value = value.date()
+    if isinstance(value, (datetime.date, datetime.time)):
+        value = value.isoformat()
+    text = str(value).strip()
+    return text.replace('|', '\\|').replace('\r\n', '<br>').replace('\n', '<br>')
+
+
+def _table(sheet, header, rows, first, split):
+    width = max(len(header), max((len(row) for row in rows), default=0))
+    title = f"## {sheet} (filas {first}-{first + len(rows) - 1})" if split else f"## {sheet}"
+    lines = [title, '']
+    for cells in [header, ['---'] * width] + rows:
+        cells = list(cells) + [''] * (width - len(cells))
+        lines.append('| ' + ' | '.join(cells) + ' |')
+    return '\n'.join(lines)
+
+
+def iter_pages(file_path, max_rows=None):
+    """Markdown pages of a spreadsheet, one per sheet, read row by row.
+
+    Each page is a heading with the sheet name and a table whose header is
+    the sheet's first non-empty row. Sheets longer than max_rows data rows
+    are split into several tables (pages) with the header repeated, so no
+    more than one table is ever held in memory. Raises SpreadsheetError if
+    the file can't be read.
+    """
+    max_rows = max(1, max_rows or SPREADSHEET_MAX_ROWS_PER_TABLE)
+    reader = _readers()[os.path.splitext(file_path)[1].lower()]
+    sheet = header = None
+    rows = []
+    first = 1
+    try:
+        for name, values in reader(file_path):
+            if name != sheet:
+                if rows or header is not None:
+                    yield _table(sheet, header, rows, first, first > 1)
+                sheet, header, rows, first = name, None, [], 1
+            cells = [_cell(value) for value in values]
+            while cells and not cells[-1]:
+                cells.pop()
+            if not cells:
+                continue
+            if header is None:
+                header = cells
+                continue
+            if len(rows) == max_rows:
+                yield _table(sheet, header, rows, first, True)
+                first += len(rows)
+                rows = []
+            rows.append(cells)
+        if header is not None:
+            yield _table(sheet, header, rows, first, first > 1)
+    except _READ_ERRORS as e:
+        raise SpreadsheetError(f"no se pudo leer la hoja de cálculo: {e}") from e
@@ -0,0 +1,506 @@
+import os
+import sys
+import shutil
+import sqlite3
+import hashlib
+import argparse
+import tempfile
+import threading
+import output_store
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.exceptions import ClientError
+except ImportError:  # boto3 is only needed with STORAGE_BACKEND=s3
+    boto3 = None
+
+# Where inputs and outputs are kept: "local" (INPUT_DIR / OUTPUT_DIR) or "s3" (any S3-compatible store)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local").lower()
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+# Inputs are stored under <prefix>input/ and outputs under <prefix>output/
+S3_PREFIX = os.getenv("S3_PREFIX", "filetomd/")
+# Endpoint of an S3-compatible server (e.g. http://localhost:9000 for MinIO); empty for AWS S3
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+S3_REGION = os.getenv("S3_REGION") or None
+# Objects larger than the threshold are uploaded in parts of STORAGE_MULTIPART_CHUNK_BYTES
+STORAGE_MULTIPART_THRESHOLD_BYTES = int(os.getenv("STORAGE_MULTIPART_THRESHOLD_BYTES", str(16 * 1024 * 1024)))
+STORAGE_MULTIPART_CHUNK_BYTES = int(os.getenv("STORAGE_MULTIPART_CHUNK_BYTES", str(8 * 1024 * 1024)))
+# Objects per listing request
+STORAGE_LIST_PAGE_SIZE = int(os.getenv("STORAGE_LIST_PAGE_SIZE", "1000"))
+# Local directory layout: "flat" or "sharded" (hash-prefix subdirectories, for trees of many thousands of files)
+STORAGE_LAYOUT = os.getenv("STORAGE_LAYOUT", "flat").lower()
+# Subdirectory levels of the sharded layout (256 directories per level)
+STORAGE_SHARD_DEPTH = max(1, int(os.getenv("STORAGE_SHARD_DEPTH", "2")))
+
+# Read size when streaming an object
+CHUNK_SIZE = 1024 * 1024
+# name -> path index at the top of a sharded tree
+INDEX_FILENAME = '.index.sqlite3'
+_HEX = set('0123456789abcdef')
+
+
+def iter_chunks(stream, chunk_size=CHUNK_SIZE):
+    """Yield a binary stream in chunks and close it (for streamed responses)."""
+    try:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        stream.close()
+
+
+def shard_of(name, depth=None):
+    """Shard directory of a name relative to the tree, e.g. '3f/a2' (hex pairs of its hash)."""
+    digest = hashlib.sha1(name.encode('utf-8')).hexdigest()
+    return os.path.join(*[digest[2 * level:2 * level + 2] for level in range(depth or STORAGE_SHARD_DEPTH)])
+
+
+def unsharded(directory):
+    """Top of the tree a directory belongs to: strips the shard levels in the sharded layout."""
+    if STORAGE_LAYOUT != 'sharded':
+        return directory
+    parts = os.path.normpath(directory).split(os.sep)
+    shards = parts[-STORAGE_SHARD_DEPTH:]
+    if len(parts) > STORAGE_SHARD_DEPTH and all(len(part) == 2 and set(part) <= _HEX for part in shards):
+        return os.sep.join(parts[:-STORAGE_SHARD_DEPTH]) or os.sep
+    return directory
+
+
+def logical_name(filename):
+    """Name a stored file belongs to: compressed sidecars and .partial files map to their .md."""
+    for suffix in list(output_store.SIDECAR_SUFFIXES.values()) + [output_store.PARTIAL_SUFFIX]:
+        if filename.endswith('.md' + suffix):
+            return filename[:-len(suffix)]
+    return filename
+
+
+def _stat_any(path):
+    """(size, mtime) of a file or, for outputs kept only compressed, of its sidecar."""
+    for candidate in [path] + [path + suffix for suffix in output_store.SIDECAR_SUFFIXES.values()]:
+        try:
+            info = os.stat(candidate)
+            return info.st_size, info.st_mtime
+        except FileNotFoundError:
+            continue
+    raise FileNotFoundError(path)
+
+
+class LocalStorage:
+    """Files in a local directory, addressed by their flat name.
+
+    The directory is also the working copy the converters read and write,
+    so fetch() and publish() have nothing to do.
+    """
+
+    remote = False
+    sharded = False
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def target(self, name):
+        """Path to write a file to; call publish(name) once it is written."""
+        return self.path(name)
+
+    def list(self):
+        """Yield {'name', 'size', 'modified'} of every file."""
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    info = entry.stat()
+                    yield {'name': entry.name, 'size': info.st_size, 'modified': info.st_mtime}
+
+    def stat(self, name):
+        """{'size', 'modified'} of a file, or None if it doesn't exist."""
+        try:
+            info = os.stat(self.path(name))
+        except FileNotFoundError:
+            return None
+        return {'size': info.st_size, 'modified': info.st_mtime}
+
+    def exists(self, name):
+        return os.path.isfile(self.path(name))
+
+    def open(self, name):
+        """Binary stream of a file's content."""
+        return open(self.path(name), 'rb')
+
+    def write(self, name, stream):
+        """Store a binary stream under name without holding it in memory. Returns the bytes written."""
+        path = self.target(name)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            shutil.copyfileobj(stream, f, CHUNK_SIZE)
+            size = f.tell()
+        os.replace(tmp_path, path)
+        self.publish(name)
+        return size
+
+    def delete(self, name):
+        """Remove a file. Returns True if it existed."""
+        try:
+            os.remove(self.path(name))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def fetch(self, name):
+        """Local path of a file to convert, or None if it doesn't exist."""
+        path = self.path(name)
+        return path if os.path.isfile(path) else None
+
+    def publish(self, name, local_path=None):
+        """Store the working copy (or local_path) under name."""
+        if local_path and os.path.abspath(local_path) != os.path.abspath(self.path(name)):
+            with open(local_path, 'rb') as f:
+                self.write(name, f)
+
+
+class ShardedLocalStorage(LocalStorage):
+    """Local files spread over hash-prefix subdirectories (root/3f/a2/name).
+
+    Names stay flat for callers. An SQLite index at the top of the tree maps
+    each name to its path with its size and mtime, so listings never walk
+    the shards; files still at the top level (not migrated yet, or dropped
+    in by hand) are found and listed as well.
+    """
+
+    sharded = True
+
+    def __init__(self, root, depth=None):
+        super().__init__(root)
+        self.depth = depth or STORAGE_SHARD_DEPTH
+        self.index_path = os.path.join(root, INDEX_FILENAME)
+        self._local = threading.local()
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS files"
+                       " (name TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER, modified REAL)")
+
+    def _connect(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.index_path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            self._local.db = db
+        return db
+
+    def shard_path(self, name):
+        return os.path.join(self.root, shard_of(name, self.depth), name)
+
+    def path(self, name):
+        row = self._connect().execute("SELECT path FROM files WHERE name = ?", (name,)).fetchone()
+        if row is not None:
+            return os.path.join(self.root, row[0])
+        flat = os.path.join(self.root, name)
+        return flat if os.path.isfile(flat) else self.shard_path(name)
+
+    def target(self, name):
+        path = self.path(name)
+        if not os.path.exists(path):
+            path = self.shard_path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def register(self, name, path=None):
+        """Add or refresh a name in the index (no-op if it has no file)."""
+        path = path or self.path(name)
+        try:
+            size, modified = _stat_any(path)
+        except FileNotFoundError:
+            return False
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO files (name, path, size, modified) VALUES (?, ?, ?, ?)",
+                       (name, os.path.relpath(path, self.root), size, modified))
+        return True
+
+    def unregister(self, name):
+        with self._connect() as db:
+            db.execute("DELETE FROM files WHERE name = ?", (name,))
+
+    def list(self):
+        """Yield {'name', 'size', 'modified'} from the index, a page at a time, then unindexed top-level files."""
+        db = self._connect()
+        last = ''
+        while True:
+            rows = db.execute("SELECT name, size, modified FROM files WHERE name > ? ORDER BY name LIMIT ?",
+                              (last, STORAGE_LIST_PAGE_SIZE)).fetchall()
+            for name, size, modified in rows:
+                yield {'name': name, 'size': size, 'modified': modified}
+            if len(rows) < STORAGE_LIST_PAGE_SIZE:
+                break
+            last = rows[-1][0]
+        with os.scandir(self.root) as entries:
+            loose = [entry for entry in entries if entry.is_file() and not entry.name.startswith('.')]
+        for entry in loose:
+            if db.execute("SELECT 1 FROM files WHERE name = ?", (entry.name,)).fetchone() is None:
+                info = entry.stat()
+                yield {'name': entry.name, 'size': info.st_size, 'modified': info.st_mtime}
+
+    def delete(self, name):
+        removed = super().delete(name)
+        self.unregister(name)
+        return removed
+
+    def publish(self, name, local_path=None):
+        if local_path and os.path.abspath(local_path) != os.path.abspath(self.path(name)):
+            shutil.copyfile(local_path, self.target(name))
+        self.register(name)
+
+    def reindex(self):
+        """Rebuild the index from the files in the shards. Returns the names indexed."""
+        names = set()
+        for directory, _, files in _walk_shards(self.root, self.depth):
+            for filename in files:
+                if not filename.startswith('.') and not filename.endswith('.tmp'):
+                    names.add((logical_name(filename), directory))
+        with self._connect() as db:
+            db.execute("DELETE FROM files")
+        for name, directory in names:
+            self.register(name, os.path.join(directory, name))
+        return len(names)
+
+
+def _walk_shards(root, depth):
+    """(directory, subdirectories, files) of every leaf shard directory of a tree."""
+    levels = [root]
+    for _ in range(depth):
+        levels = [os.path.join(directory, entry.name) for directory in levels
+                  for entry in os.scandir(directory)
+                  if entry.is_dir() and len(entry.name) == 2 and set(entry.name) <= _HEX]
+    for directory in levels:
+        with os.scandir(directory) as entries:
+            entries = list(entries)
+        yield (directory, [entry.name for entry in entries if entry.is_dir()],
+               [entry.name for entry in entries if entry.is_file()])
+
+
+class S3Storage:
+    """Objects in an S3-compatible bucket (AWS S3, MinIO...) under a key prefix.
+
+    Files are converted from a local working copy under cache_dir:
+    fetch() downloads an object there and publish() uploads it back.
+    Transfers stream in chunks and objects above
+    STORAGE_MULTIPART_THRESHOLD_BYTES go up as multipart uploads.
+    Credentials come from the usual AWS variables (AWS_ACCESS_KEY_ID,
+    AWS_SECRET_ACCESS_KEY) or the instance role.
+    """
+
+    remote = True
+    sharded = False
+
+    def __init__(self, area, cache_dir, bucket=None, prefix=None):
+        if boto3 is None:
+            raise RuntimeError("STORAGE_BACKEND=s3 necesita boto3 (pip install boto3)")
+        self.bucket = bucket or S3_BUCKET
+        if not self.bucket:
+            raise ValueError("STORAGE_BACKEND=s3 necesita S3_BUCKET")
+        self.prefix = f"{S3_PREFIX if prefix is None else prefix}{area}/"
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.client = boto3.client('s3', endpoint_url=S3_ENDPOINT_URL, region_name=S3_REGION)
+        self.transfer = TransferConfig(multipart_threshold=STORAGE_MULTIPART_THRESHOLD_BYTES,
+                                       multipart_chunksize=STORAGE_MULTIPART_CHUNK_BYTES)
+
+    def _key(self, name):
+        return self.prefix + name
+
+    def path(self, name):
+        """Working copy of an object in the local cache."""
+        return os.path.join(self.cache_dir, name)
+
+    def target(self, name):
+        return self.path(name)
+
+    def list(self):
+        """Yield {'name', 'size', 'modified'} of every object, one listing page at a time."""
+        paginator = self.client.get_paginator('list_objects_v2')
+        pages = paginator.paginate(Bucket=self.bucket, Prefix=self.prefix,
+                                   PaginationConfig={'PageSize': STORAGE_LIST_PAGE_SIZE})
+        for page in pages:
+            for obj in page.get('Contents', []):
+                name = obj['Key'][len(self.prefix):]
+                if name and '/' not in name:
+                    yield {'name': name, 'size': obj['Size'], 'modified': obj['LastModified'].timestamp()}
+
+    def stat(self, name):
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self._key(name))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        return {'size': head['ContentLength'], 'modified': head['LastModified'].timestamp()}
+
+    def exists(self, name):
+        return self.stat(name) is not None
+
+    def open(self, name):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self._key(name))['Body']
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey'):
+                raise FileNotFoundError(name) from e
+            raise
+
+    def write(self, name, stream):
+        counter = _CountingReader(stream)
+        self.client.upload_fileobj(counter, self.bucket, self._key(name), Config=self.transfer)
+        return counter.count
+
+    def delete(self, name):
+        existed = self.exists(name)
+        if existed:
+            self.client.delete_object(Bucket=self.bucket, Key=self._key(name))
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
+        return existed
+
+    def fetch(self, name):
+        """Download an object to its working copy unless an up-to-date one is cached."""
+        info = self.stat(name)
+        if info is None:
+            return None
+        path = self.path(name)
+        try:
+            cached = os.stat(path)
+            if cached.st_size == info['size'] and cached.st_mtime >= info['modified']:
+                return path
+        except FileNotFoundError:
+            pass
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix='.fetch-')
+        os.close(fd)
+        try:
+            self.client.download_file(self.bucket, self._key(name), tmp_path, Config=self.transfer)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return path
+
+    def publish(self, name, local_path=None):
+        self.client.upload_file(local_path or self.path(name), self.bucket, self._key(name), Config=self.transfer)
+
+
+class _CountingReader:
+    """File-like wrapper counting the bytes read through it."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.count += len(data)
+        return data
+
+
+def open_storage(area, local_dir, kind=None):
+    """Create the configured storage for 'input' or 'output' (local_dir is its directory or working cache)."""
+    kind = (kind or STORAGE_BACKEND).lower()
+    if kind == 'local':
+        return ShardedLocalStorage(local_dir) if STORAGE_LAYOUT == 'sharded' else LocalStorage(local_dir)
+    if kind == 's3':
+        return S3Storage(area, local_dir)
+    raise ValueError(f"STORAGE_BACKEND desconocido: {kind}")
+
+
+def migrate(root, to='sharded', outputs=False, dry_run=False):
+    """Move a local tree between the flat and sharded layouts. Returns the files moved.
+
+    With outputs, only markdown outputs (and their sidecars and chunk files)
+    are sharded; consolidations and other files stay at the top level.
+    """
+    import chunk_export
+    import consolidar_md
+
+    moves = []
+    if to == 'sharded':
+        with os.scandir(root) as entries:
+            files = [entry.name for entry in entries
+                     if entry.is_file() and not entry.name.startswith('.') and not entry.name.endswith('.tmp')]
+        for filename in files:
+            name = logical_name(filename)
+            if outputs and (not name.endswith('.md') or consolidar_md.es_salida_consolidada(name, 'Consolidated.md')):
+                continue
+            moves.append((os.path.join(root, filename), os.path.join(root, shard_of(name), filename)))
+        chunks = os.path.join(root, 'chunks')
+        if outputs and not chunk_export.CHUNK_DIR and os.path.isdir(chunks):
+            for filename in os.listdir(chunks):
+                stem = chunk_export.chunk_stem(filename)
+                if stem is not None:
+                    moves.append((os.path.join(chunks, filename),
+                                  os.path.join(root, shard_of(f"{stem}.md"), 'chunks', filename)))
+    else:
+        for directory, subdirectories, files in _walk_shards(root, STORAGE_SHARD_DEPTH):
+            moves.extend((os.path.join(directory, filename), os.path.join(root, filename)) for filename in files)
+            if 'chunks' in subdirectories:
+                chunks = os.path.join(directory, 'chunks')
+                moves.extend((os.path.join(chunks, filename), os.path.join(root, 'chunks', filename))
+                             for filename in os.listdir(chunks))
+
+    if dry_run:
+        return len(moves)
+    for source, destination in moves:
+        if os.path.exists(destination):
+            print(f"⚠️  {destination} ya existe; se deja {source} donde está")
+            continue
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.replace(source, destination)
+
+    if to == 'sharded':
+        ShardedLocalStorage(root).reindex()
+    else:
+        for directory, subdirectories, _ in list(_walk_shards(root, STORAGE_SHARD_DEPTH)):
+            # Remove the emptied shard directories, stopping at the top of the tree
+            for path in [os.path.join(directory, name) for name in subdirectories] + [directory]:
+                while os.path.abspath(path) != os.path.abspath(root):
+                    try:
+                        os.rmdir(path)
+                    except OSError:
+                        break
+                    path = os.path.dirname(path)
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                os.remove(os.path.join(root, INDEX_FILENAME + suffix))
+            except FileNotFoundError:
+                pass
+    return len(moves)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Migrate the input/output folders between the flat and sharded layouts")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = subparsers.add_parser('migrate', help="move existing files to the given layout")
+    migrate_parser.add_argument('--to', choices=['sharded', 'flat'], default='sharded')
+    migrate_parser.add_argument('--dry-run', action='store_true', help="only count the files to move")
+    subparsers.add_parser('reindex', help="rebuild the name -> path index of sharded folders")
+    for subparser in subparsers.choices.values():
+        subparser.add_argument('--input-dir', default=os.getenv("INPUT_DIR", "InputFiles"))
+        subparser.add_argument('--output-dir', default=os.getenv("OUTPUT_DIR", "OutputFiles"))
+    args = parser.parse_args(argv)
+
+    for root, outputs in ((args.input_dir, False), (args.output_dir, True)):
+        if not os.path.isdir(root):
+            print(f"⚠️  {root} no existe")
+            continue
+        if args.command == 'reindex':
+            print(f"🗂️  {root}: {ShardedLocalStorage(root).reindex()} archivos indexados")
+            continue
+        moved = migrate(root, args.to, outputs, args.dry_run)
+        print(f"{'🔎' if args.dry_run else '📦'} {root}: {moved} archivos {'a mover' if args.dry_run else 'movidos'} al formato {args.to}")
+    if args.command == 'migrate' and not args.dry_run:
+        print(f"✅ Recuerda configurar STORAGE_LAYOUT={args.to}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+import os
+import re
+import json
+import time
+import threading
+from collections import deque
+import scheduler
+import admission
+
+
+def _parse_map(value):
+    """Parse "name:value,name:value" settings; a bare value applies to every tenant ("*")."""
+    entries = {}
+    for item in value.split(','):
+        item = item.strip()
+        if item:
+            name, _, setting = item.rpartition(':')
+            entries[name.strip() or '*'] = setting.strip()
+    return entries
+
+
+# Request header naming the tenant (team or API client) an upload or run belongs to
+TENANT_HEADER = os.getenv("TENANT_HEADER", "X-Tenant")
+# API tokens of the tenants, "token:tenant,...". When set, the tenant comes from the
+# "Authorization: Bearer <token>" header only and TENANT_HEADER is ignored
+TENANT_TOKENS = _parse_map(os.getenv("TENANT_TOKENS", ""))
+# Tenant of requests without identification (and of files uploaded before tenants were set up)
+TENANT_DEFAULT = scheduler.DEFAULT_TENANT
+# Share of the parse slots of each tenant while several have queued files, "tenant:weight,..." (default 1)
+TENANT_WEIGHTS = _parse_map(os.getenv("TENANT_WEIGHTS", ""))
+# Files a tenant may convert at once, "tenant:n,..." or "n" for all (0 = only MAX_CONCURRENT_FILES)
+TENANT_MAX_ACTIVE = _parse_map(os.getenv("TENANT_MAX_ACTIVE", "0"))
+# A tenant's new work is refused while its queued files/bytes reach these ("tenant:n,..." or "n", 0 = unlimited)
+TENANT_MAX_QUEUED_FILES = _parse_map(os.getenv("TENANT_MAX_QUEUED_FILES", "0"))
+TENANT_MAX_QUEUED_BYTES = _parse_map(os.getenv("TENANT_MAX_QUEUED_BYTES", "0"))
+
+# Waits kept per tenant for the status averages, and the window of its throughput
+WAIT_SAMPLES = 200
+THROUGHPUT_WINDOW_SECONDS = 600
+
+_NAME_RE = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+
+_assignments_lock = threading.Lock()
+
+
+class TenantError(Exception):
+    """A request's tenant identification was invalid."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _setting(settings, tenant, default):
+    return float(settings.get(tenant, settings.get('*', default)))
+
+
+def weight(tenant):
+    return max(_setting(TENANT_WEIGHTS, tenant, 1), 0.01)
+
+
+def max_active(tenant):
+    return int(_setting(TENANT_MAX_ACTIVE, tenant, 0))
+
+
+def identify(headers):
+    """Tenant of a request, from its bearer token (TENANT_TOKENS) or TENANT_HEADER. Raises TenantError."""
+    if TENANT_TOKENS:
+        authorization = headers.get('Authorization', '')
+        if not authorization:
+            return TENANT_DEFAULT
+        scheme, _, token = authorization.partition(' ')
+        tenant = TENANT_TOKENS.get(token.strip()) if scheme.lower() == 'bearer' else None
+        if tenant is None:
+            raise TenantError('Token de API no válido', 401)
+        return tenant
+    tenant = headers.get(TENANT_HEADER, '').strip()
+    if not tenant:
+        return TENANT_DEFAULT
+    if not _NAME_RE.match(tenant):
+        raise TenantError(f'{TENANT_HEADER} no válido (letras, números, "_", "-" o ".", hasta 64)')
+    return tenant
+
+
+def _assignments_path():
+    return os.path.join(scheduler.STATE_DIR, 'tenants.json')
+
+
+def load_assignments():
+    """Tenant of each uploaded file (files of the default tenant are not listed)."""
+    try:
+        with open(_assignments_path(), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def assign(filenames, tenant):
+    """Persist the tenant of uploaded files. None (or the default tenant) clears it."""
+    with _assignments_lock:
+        assignments = load_assignments()
+        for filename in filenames:
+            if tenant is None or tenant == TENANT_DEFAULT:
+                assignments.pop(filename, None)
+            else:
+                assignments[filename] = tenant
+        os.makedirs(scheduler.STATE_DIR, exist_ok=True)
+        tmp_path = _assignments_path() + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(assignments, f)
+        os.replace(tmp_path, _assignments_path())
+
+
+def tenant_of(filename, assignments=None):
+    return (load_assignments() if assignments is None else assignments).get(filename, TENANT_DEFAULT)
+
+
+def queue_quota(tenant):
+    """(max queued files, max queued bytes) of a tenant, 0 = unlimited."""
+    return int(_setting(TENANT_MAX_QUEUED_FILES, tenant, 0)), int(_setting(TENANT_MAX_QUEUED_BYTES, tenant, 0))
+
+
+def quota_refusal(tenant, queued_files, queued_bytes, incoming_files, files_per_second=None):
+    """Like admission.evaluate for one tenant's queue quota: None, or (429, message, retry after, load)."""
+    max_files, max_bytes = queue_quota(tenant)
+    over_files = max_files and queued_files >= max_files
+    over_bytes = max_bytes and queued_bytes >= max_bytes
+    if not incoming_files or not (over_files or over_bytes):
+        return None
+    excess = max(queued_files - (max_files or queued_files) + 1, 1)
+    retry_after = excess / files_per_second if files_per_second else admission.DEFAULT_RETRY_AFTER
+    return 429, f'Cuota de cola del equipo {tenant} alcanzada', \
+        int(min(admission.MAX_RETRY_AFTER, max(admission.MIN_RETRY_AFTER, retry_after))), {
+        'tenant': tenant,
+        'queued_files': queued_files,
+        'queued_bytes': queued_bytes,
+        'files_per_second': round(files_per_second, 3) if files_per_second else None,
+    }
+
+
+class TenantStats:
+    """Wait times and throughput of each tenant's files in the local workers."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tenants = {}
+
+    def _entry(self, tenant):
+        return self._tenants.setdefault(tenant, {
+            'started': 0, 'completed': 0, 'failed': 0,
+            'waits': deque(maxlen=WAIT_SAMPLES), 'finished_at': deque(),
+        })
+
+    def started(self, tenant, waited):
+        with self._lock:
+            entry = self._entry(tenant)
+            entry['started'] += 1
+            entry['waits'].append(max(0.0, waited))
+
+    def finished(self, tenant, ok):
+        now = time.time()
+        with self._lock:
+            entry = self._entry(tenant)
+            entry['completed' if ok else 'failed'] += 1
+            entry['finished_at'].append(now)
+            while entry['finished_at'] and entry['finished_at'][0] < now - THROUGHPUT_WINDOW_SECONDS:
+                entry['finished_at'].popleft()
+
+    def files_per_second(self, tenant):
+        with self._lock:
+            entry = self._tenants.get(tenant)
+            if not entry or not entry['finished_at']:
+                return None
+            recent = [t for t in entry['finished_at'] if t >= time.time() - THROUGHPUT_WINDOW_SECONDS]
+            return len(recent) / THROUGHPUT_WINDOW_SECONDS if recent else None
+
+    def snapshot(self, queued_jobs, active):
+        """Per-tenant queue, caps, waits and throughput: {tenant: {...}}.
+
+        queued_jobs is WorkQueue.snapshot(), active WorkQueue.active().
+        """
+        now = time.time()
+        queued = {}
+        for job in queued_jobs:
+            totals = queued.setdefault(job['tenant'], {'files': 0, 'bytes': 0, 'oldest': now})
+            totals['files'] += 1
+            totals['bytes'] += job['size']
+            totals['oldest'] = min(totals['oldest'], job['enqueued_at'])
+        with self._lock:
+            tenants = set(self._tenants) | set(queued) | set(active)
+            result = {}
+            for tenant in sorted(tenants):
+                entry = self._tenants.get(tenant) or {'started': 0, 'completed': 0, 'failed': 0,
+                                                      'waits': (), 'finished_at': ()}
+                waits = list(entry['waits'])
+                recent = sum(1 for t in entry['finished_at'] if t >= now - THROUGHPUT_WINDOW_SECONDS)
+                totals = queued.get(tenant, {'files': 0, 'bytes': 0, 'oldest': now})
+                result[tenant] = {
+                    'queued_files': totals['files'],
+                    'queued_bytes': totals['bytes'],
+                    'active_files': active.get(tenant, 0),
+                    'weight': weight(tenant),
+                    'max_active': max_active(tenant) or None,
+                    'started': entry['started'],
+                    'completed': entry['completed'],
+                    'failed': entry['failed'],
+                    'avg_wait_seconds': round(sum(waits) / len(waits), 1) if waits else None,
+                    'max_wait_seconds': round(max(waits), 1) if waits else None,
+                    'oldest_queued_seconds': round(now - totals['oldest'], 1) if totals['files'] else None,
+                    'files_per_minute': round(recent * 60 / THROUGHPUT_WINDOW_SECONDS, 2),
+                }
+            return result
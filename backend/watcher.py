@@ -0,0 +1,145 @@
+import os
+import time
+import threading
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:  # watchdog is optional, polling works everywhere
+    Observer = None
+    FileSystemEventHandler = object
+
+# Watch INPUT_DIR and process files as soon as they land
+WATCH_INPUT_DIR = os.getenv("WATCH_INPUT_DIR", "false").lower() == "true"
+# A file is considered complete once its size and mtime are stable for this long
+WATCH_DEBOUNCE_SECONDS = float(os.getenv("WATCH_DEBOUNCE_SECONDS", "2"))
+# Rescan interval when inotify (watchdog) is not available
+WATCH_POLL_INTERVAL = float(os.getenv("WATCH_POLL_INTERVAL", "2"))
+
+
+def _signature(file_path):
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime_ns)
+
+
+class _EventHandler(FileSystemEventHandler):
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        if event.is_directory:
+            return
+        for path in (getattr(event, 'src_path', None), getattr(event, 'dest_path', None)):
+            if path and os.path.dirname(os.path.abspath(path)) == self.watcher.directory:
+                self.watcher.touch(os.path.basename(path))
+
+
+class FolderWatcher:
+    """Watch a directory and report new or changed files once they are fully written.
+
+    Uses inotify through watchdog when installed, otherwise rescans the
+    directory every WATCH_POLL_INTERVAL seconds. on_ready(filename) is called
+    from the watcher thread once per new (size, mtime) signature of a file.
+    """
+
+    def __init__(self, directory, on_ready, debounce=None, poll_interval=None):
+        self.directory = os.path.abspath(directory)
+        self.on_ready = on_ready
+        self.debounce = WATCH_DEBOUNCE_SECONDS if debounce is None else debounce
+        self.poll_interval = WATCH_POLL_INTERVAL if poll_interval is None else poll_interval
+        self._pending = {}  # filename -> (signature, first seen with that signature)
+        self._reported = {}  # filename -> signature passed to on_ready
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._observer = None
+        self._thread = None
+
+    @property
+    def mode(self):
+        return 'inotify' if self._observer is not None else 'polling'
+
+    def touch(self, filename):
+        """Mark a file as possibly changed; it is reported once it stops changing."""
+        if filename.startswith('.'):
+            return
+        signature = _signature(os.path.join(self.directory, filename))
+        with self._lock:
+            if signature is None:
+                self._pending.pop(filename, None)
+                self._reported.pop(filename, None)
+            elif self._reported.get(filename) != signature:
+                pending = self._pending.get(filename)
+                if pending is None or pending[0] != signature:
+                    self._pending[filename] = (signature, time.time())
+
+    def _scan(self):
+        try:
+            with os.scandir(self.directory) as entries:
+                names = [entry.name for entry in entries if entry.is_file()]
+        except OSError:
+            return
+        for name in names:
+            self.touch(name)
+        with self._lock:
+            for gone in set(self._reported) - set(names):
+                del self._reported[gone]
+
+    def _flush_stable(self):
+        now = time.time()
+        ready = []
+        with self._lock:
+            for filename, (signature, since) in list(self._pending.items()):
+                if now - since < self.debounce:
+                    continue
+                current = _signature(os.path.join(self.directory, filename))
+                if current != signature:
+                    # Still being written (or gone): restart the debounce window
+                    if current is None:
+                        del self._pending[filename]
+                    else:
+                        self._pending[filename] = (current, now)
+                    continue
+                del self._pending[filename]
+                self._reported[filename] = signature
+                ready.append(filename)
+        for filename in ready:
+            try:
+                self.on_ready(filename)
+            except Exception as e:
+                print(f"⚠️  Error encolando {filename}: {e}")
+
+    def _run(self):
+        last_scan = 0
+        while not self._stop.is_set():
+            if self._observer is None and time.time() - last_scan >= self.poll_interval:
+                self._scan()
+                last_scan = time.time()
+            self._flush_stable()
+            self._stop.wait(min(0.5, self.debounce or 0.5))
+
+    def start(self):
+        """Start watching. Files already in the directory are reported too."""
+        os.makedirs(self.directory, exist_ok=True)
+        if Observer is not None:
+            try:
+                self._observer = Observer()
+                self._observer.schedule(_EventHandler(self), self.directory, recursive=False)
+                self._observer.start()
+            except OSError as e:
+                print(f"⚠️  inotify no disponible ({e}), usando sondeo")
+                self._observer = None
+        self._scan()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,152 @@
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+from dotenv import load_dotenv
+
+# Load environment variables before the local modules read their configuration
+load_dotenv()
+
+import file_to_md
+import leases
+import preflight
+import key_pool
+import storage
+import output_store
+
+# Seconds to wait before asking for work again when nothing is pending
+WORKER_POLL_SECONDS = float(os.getenv("WORKER_POLL_SECONDS", "5"))
+
+# Inputs and outputs shared with the API nodes (local folders or an S3-compatible bucket)
+inputs = storage.open_storage('input', file_to_md.input_dir)
+outputs = storage.open_storage('output', file_to_md.output_dir)
+
+
+def default_worker_id():
+    """host:pid identifies a worker in the lease store."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class Heartbeat:
+    """Keep a lease alive while its file is being parsed.
+
+    Beats every third of the TTL; if the store says the lease was lost (it
+    expired and another worker reclaimed it) `lost` is set so the result is
+    not reported twice.
+    """
+
+    def __init__(self, store, filename, worker_id, ttl):
+        self.store = store
+        self.filename = filename
+        self.worker_id = worker_id
+        self.ttl = ttl
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.ttl / 3):
+            try:
+                if not self.store.heartbeat(self.filename, self.worker_id, self.ttl):
+                    self.lost.set()
+                    return
+            except Exception as e:
+                print(f"⚠️  Heartbeat falló para {self.filename}: {e}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+
+def process_one(store, filename, worker_id, ttl):
+    """Convert a claimed file and report the outcome to the lease store."""
+    output_path = outputs.target(f"{os.path.splitext(filename)[0]}.md")
+
+    # With object storage the input is downloaded to a local working copy first
+    input_path = inputs.fetch(filename)
+    if input_path is None:
+        store.complete(filename, worker_id, error='Archivo de entrada no encontrado')
+        return
+
+    print(f"🔄 [{worker_id}] Procesando: {filename}")
+    error = None
+    with Heartbeat(store, filename, worker_id, ttl) as heartbeat:
+        try:
+            result = file_to_md.convert_file(input_path, output_path)
+            if not result['has_content']:
+                error = 'Archivo creado pero está vacío'
+            else:
+                output_store.publish(outputs, output_path)
+        except preflight.PreflightError as e:
+            error = str(e)
+        except Exception as e:
+            if file_to_md.is_rate_limit_error(e):
+                # Hand the file back so another worker (or this one, later) retries it
+                store.release(filename, worker_id)
+                print(f"⏸️  [{worker_id}] Límite de API, {filename} vuelve a la cola")
+                time.sleep(max(key_pool.pool.cooldown_remaining(), WORKER_POLL_SECONDS))
+                return
+            error = str(e)
+
+    if heartbeat.lost.is_set():
+        print(f"⚠️  [{worker_id}] Se perdió el lease de {filename}; otro worker lo reprocesa")
+        return
+    store.complete(filename, worker_id, error=error)
+    print(f"{'❌' if error else '✅'} [{worker_id}] {filename}{': ' + error if error else ''}")
+
+
+def run(store, worker_id, ttl, drain=False):
+    """Claim and process files until interrupted (or until the queue is empty with drain)."""
+    print(f"🚀 Worker {worker_id} usando lease store {type(store).__name__}")
+    while True:
+        filename = store.claim(worker_id, ttl)
+        if filename is None:
+            if drain:
+                print(f"🏁 [{worker_id}] No hay más trabajo")
+                return
+            time.sleep(WORKER_POLL_SECONDS)
+            continue
+        process_one(store, filename, worker_id, ttl)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="FileToMarkdown worker: claims files from the shared lease store")
+    parser.add_argument('--store', choices=['sqlite', 'lockfile'], default=leases.LEASE_STORE,
+                        help="lease store on the shared volume")
+    parser.add_argument('--lease-path', default=leases.LEASE_PATH,
+                        help="directory of the lease store on the shared volume (default LEASE_PATH)")
+    parser.add_argument('--id', default=default_worker_id(), help="worker id (default host:pid)")
+    parser.add_argument('--ttl', type=float, default=leases.LEASE_TTL_SECONDS,
+                        help="lease time-to-live in seconds")
+    parser.add_argument('--drain', action='store_true', help="exit when no work is pending")
+    parser.add_argument('--enqueue', action='store_true',
+                        help="queue every supported input file before starting")
+    args = parser.parse_args(argv)
+
+    try:
+        store = leases.open_store(args.store, args.lease_path)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.enqueue:
+        supported = file_to_md.supported_extensions()
+        for entry in inputs.list():
+            if os.path.splitext(entry['name'])[1].lower() in supported:
+                store.enqueue(entry['name'], size=entry['size'])
+
+    try:
+        run(store, args.id, args.ttl, drain=args.drain)
+    except KeyboardInterrupt:
+        # The current lease simply expires and is reclaimed by another worker
+        print(f"\n🛑 Worker {args.id} detenido")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
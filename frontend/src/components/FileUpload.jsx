@@ -2,6 +2,13 @@ import React, { useState, useRef } from 'react';
 import { Upload, File, X, AlertCircle, CheckCircle, Trash2 } from 'lucide-react';
 import { fileAPI } from '../services/api';
 
+// Bulk uploads are split into requests below the server's request size limit
+const BULK_MAX_FILES = 200;
+const BULK_MAX_BYTES = 90 * 1024 * 1024;
+const ARCHIVE_TYPES = ['.zip', '.tar.gz', '.tgz'];
+
+const isArchive = (name) => ARCHIVE_TYPES.some(ext => name.toLowerCase().endsWith(ext));
+
 const FileUpload = ({ onFileUploaded, onError }) => {
   const [dragActive, setDragActive] = useState(false);
   const [uploading, setUploading] = useState(false);
@@ -45,13 +52,13 @@ const FileUpload = ({ onFileUploaded, onError }) => {
       
       const fileExtension = '.' + file.name.split('.').pop().toLowerCase();
       
-      // Check if file type is supported
-      const isSupported = supportedFormats.includes(fileExtension);
+      // Check if file type is supported (archives are extracted by the server)
+      const isSupported = supportedFormats.includes(fileExtension) || isArchive(file.name);
       
       // Check file size limit (100MB for most files, 20MB for audio)
       const audioTypes = ['.mp3', '.mp4', '.mpeg', '.mpga', '.m4a', '.wav', '.webm'];
       const isAudio = audioTypes.includes(fileExtension);
-      const maxSize = isAudio ? 20 * 1024 * 1024 : 100 * 1024 * 1024; // 20MB for audio, 100MB for others
+      const maxSize = isAudio ? 20 * 1024 * 1024 : 100 * 1024 * 1024; // 20MB for audio, 100MB for others (and archives)
       const isValidSize = file.size <= maxSize;
       
       return isSupported && isValidSize;
@@ -88,28 +95,66 @@ const FileUpload = ({ onFileUploaded, onError }) => {
     }
   };
 
-  const uploadSingleFile = async (fileItem) => {
-    try {
-      setUploadProgress(prev => ({ ...prev, [fileItem.id]: 'uploading' }));
-      const result = await fileAPI.upload(fileItem.file);
-      
-      setUploadProgress(prev => ({ ...prev, [fileItem.id]: 'success' }));
-      
-      if (onFileUploaded) {
-        onFileUploaded(result);
+  const makeBatches = (items) => {
+    const batches = [];
+    let batch = [];
+    let batchBytes = 0;
+    for (const item of items) {
+      if (batch.length > 0 && (batch.length >= BULK_MAX_FILES || batchBytes + item.size > BULK_MAX_BYTES)) {
+        batches.push(batch);
+        batch = [];
+        batchBytes = 0;
       }
-      
-      return { success: true, result, fileName: fileItem.name };
+      batch.push(item);
+      batchBytes += item.size;
+    }
+    if (batch.length > 0) {
+      batches.push(batch);
+    }
+    return batches;
+  };
+
+  const uploadBatch = async (batch) => {
+    const markAll = (state) => setUploadProgress(prev => ({
+      ...prev,
+      ...Object.fromEntries(batch.map(item => [item.id, state]))
+    }));
+    
+    try {
+      markAll('uploading');
+      const response = await fileAPI.uploadBulk(batch.map(item => item.file));
+      return batch.map(item => resultForItem(item, response.results));
     } catch (error) {
-      setUploadProgress(prev => ({ ...prev, [fileItem.id]: 'error' }));
-      return { 
-        success: false, 
+      // 400 still carries per-entry results when nothing could be saved
+      const results = error.response?.data?.results;
+      if (results) {
+        return batch.map(item => resultForItem(item, results));
+      }
+      markAll('error');
+      return batch.map(item => ({
+        success: false,
         error: error.response?.data?.error || 'Error al subir el archivo',
-        fileName: fileItem.name 
-      };
+        fileName: item.name
+      }));
     }
   };
 
+  const resultForItem = (item, results) => {
+    // An archive succeeds if any of its entries was saved
+    const entries = results.filter(r => r.source === item.name);
+    const uploaded = entries.filter(r => r.status === 'uploaded');
+    const success = uploaded.length > 0;
+    
+    setUploadProgress(prev => ({ ...prev, [item.id]: success ? 'success' : 'error' }));
+    if (success && onFileUploaded) {
+      uploaded.forEach(entry => onFileUploaded(entry));
+    }
+    
+    return success
+      ? { success: true, result: uploaded, fileName: item.name }
+      : { success: false, error: entries[0]?.error || results.find(r => r.skipped)?.error || 'Error al subir el archivo', fileName: item.name };
+  };
+
   const uploadAllFiles = async () => {
     if (selectedFiles.length === 0) return;
 
@@ -118,9 +163,8 @@ const FileUpload = ({ onFileUploaded, onError }) => {
     
     const results = [];
     
-    for (const fileItem of selectedFiles) {
-      const result = await uploadSingleFile(fileItem);
-      results.push(result);
+    for (const batch of makeBatches(selectedFiles)) {
+      results.push(...await uploadBatch(batch));
     }
     
     const successCount = results.filter(r => r.success).length;
@@ -246,7 +290,7 @@ const FileUpload = ({ onFileUploaded, onError }) => {
           type="file"
           className="hidden"
           onChange={handleFileInput}
-          accept=".pdf,.doc,.docx,.docm,.dot,.dotm,.ppt,.pptx,.pptm,.pot,.potx,.potm,.rtf,.txt,.xml,.epub,.abw,.hwp,.key,.pages,.sxi,.sxw,.jpg,.jpeg,.png,.gif,.bmp,.svg,.tiff,.webp,.htm,.html,.xlsx,.xls,.xlsm,.xlsb,.csv,.ods,.numbers,.mp3,.mp4,.mpeg,.mpga,.m4a,.wav,.webm"
+          accept=".pdf,.doc,.docx,.docm,.dot,.dotm,.ppt,.pptx,.pptm,.pot,.potx,.potm,.rtf,.txt,.xml,.epub,.abw,.hwp,.key,.pages,.sxi,.sxw,.jpg,.jpeg,.png,.gif,.bmp,.svg,.tiff,.webp,.htm,.html,.xlsx,.xls,.xlsm,.xlsb,.csv,.ods,.numbers,.mp3,.mp4,.mpeg,.mpga,.m4a,.wav,.webm,.zip,.tar.gz,.tgz"
           multiple
         />
         
@@ -298,7 +342,7 @@ const FileUpload = ({ onFileUploaded, onError }) => {
               </div>
             </div>
             <p className="mt-2">Tamaño máximo: 100MB (20MB para audio)</p>
-            <p>Puedes seleccionar múltiples archivos</p>
+            <p>Puedes seleccionar múltiples archivos o un .zip / .tar.gz con muchos archivos</p>
           </div>
         </div>
       </div>
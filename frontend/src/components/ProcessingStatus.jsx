@@ -5,6 +5,8 @@ import { processingAPI } from '../services/api';
 const ProcessingStatus = ({ onProcessingComplete }) => {
   const [status, setStatus] = useState(null);
   const [isPolling, setIsPolling] = useState(false);
+  const [plan, setPlan] = useState(null);
+  const [deadLetterCount, setDeadLetterCount] = useState(0);
 
   useEffect(() => {
     let interval;
@@ -21,6 +23,20 @@ const ProcessingStatus = ({ onProcessingComplete }) => {
     };
   }, [isPolling]);
 
+  // Only files given up on can be requeued: refresh their count when a run ends or a new error shows up
+  useEffect(() => {
+    fetchDeadLetters();
+  }, [status?.is_processing, status?.errors?.length]);
+
+  const fetchDeadLetters = async () => {
+    try {
+      const result = await processingAPI.getDeadLetters();
+      setDeadLetterCount(result.dead_letters.length);
+    } catch (error) {
+      console.error('Error fetching dead letters:', error);
+    }
+  };
+
   const fetchStatus = async () => {
     try {
       const currentStatus = await processingAPI.getStatus();
@@ -45,7 +61,31 @@ const ProcessingStatus = ({ onProcessingComplete }) => {
       setStatus(prev => ({ ...prev, is_processing: true }));
     } catch (error) {
       console.error('Error starting processing:', error);
-      alert('Error al iniciar el procesamiento');
+      const retryAfter = error.response?.data?.retry_after;
+      alert(retryAfter
+        ? `${error.response.data.error}. Intenta de nuevo en ${retryAfter} segundos`
+        : 'Error al iniciar el procesamiento');
+    }
+  };
+
+  const estimateProcessing = async () => {
+    try {
+      setPlan(await processingAPI.plan());
+    } catch (error) {
+      console.error('Error planning processing:', error);
+      alert('Error al estimar el procesamiento');
+    }
+  };
+
+  const requeueFailed = async () => {
+    try {
+      const result = await processingAPI.requeue();
+      alert(result.message);
+      fetchDeadLetters();
+      setIsPolling(true);
+    } catch (error) {
+      console.error('Error requeueing files:', error);
+      alert(error.response?.data?.error || 'Error al reencolar los archivos fallidos');
     }
   };
 
@@ -76,6 +116,16 @@ const ProcessingStatus = ({ onProcessingComplete }) => {
     return `${seconds}s`;
   };
 
+  const formatSeconds = (seconds) => {
+    if (seconds === null || seconds === undefined) return '--';
+    const total = Math.round(Math.max(0, seconds));
+    const hours = Math.floor(total / 3600);
+    const minutes = Math.floor((total % 3600) / 60);
+    if (hours > 0) return `${hours}h ${minutes}m`;
+    if (minutes > 0) return `${minutes}m ${total % 60}s`;
+    return `${total}s`;
+  };
+
   const getProgressColor = (progress) => {
     if (progress < 30) return 'bg-blue-500';
     if (progress < 70) return 'bg-yellow-500';
@@ -153,6 +203,9 @@ const ProcessingStatus = ({ onProcessingComplete }) => {
             <span>
               {status.processed_files > 0 ? `Completados: ${status.processed_files}` : 'Iniciando...'}
             </span>
+            <span>
+              {status.eta_seconds != null ? `Tiempo restante estimado: ${formatSeconds(status.eta_seconds)}` : ''}
+            </span>
             <span>
               {status.total_files > 0 ? `Restantes: ${(status.total_files || 0) - (status.processed_files || 0)}` : ''}
             </span>
@@ -172,6 +225,12 @@ const ProcessingStatus = ({ onProcessingComplete }) => {
               <p className="text-sm text-blue-700 font-mono">
                 {status.current_file}
               </p>
+              {status.active_pages && status.active_pages[status.current_file] && (
+                <p className="text-xs text-blue-600 mt-1">
+                  Páginas recibidas: {status.active_pages[status.current_file].done}
+                  {status.active_pages[status.current_file].total ? ` / ${status.active_pages[status.current_file].total}` : ''}
+                </p>
+              )}
             </div>
           </div>
         </div>
@@ -211,6 +270,30 @@ const ProcessingStatus = ({ onProcessingComplete }) => {
         </div>
       )}
 
+      {/* Fair share between tenants */}
+      {status.tenants && Object.keys(status.tenants).length > 1 && (
+        <div className="mb-6 text-sm text-gray-600">
+          {Object.entries(status.tenants).map(([tenant, stats]) => (
+            <p key={tenant}>
+              {tenant}: {stats.active_files} en proceso, {stats.queued_files} en cola, {stats.completed} completados
+              {stats.avg_wait_seconds != null ? `, espera media ${formatSeconds(stats.avg_wait_seconds)}` : ''}
+              {` (${stats.files_per_minute} archivos/min)`}
+            </p>
+          ))}
+        </div>
+      )}
+
+      {/* Retries waiting for their backoff */}
+      {status.retrying && status.retrying.length > 0 && (
+        <div className="mb-6 text-sm text-gray-600">
+          {status.retrying.map((retry) => (
+            <p key={retry.file}>
+              Reintento de {retry.file} (intento {retry.attempts + 1}) en {formatSeconds(retry.retry_in)}
+            </p>
+          ))}
+        </div>
+      )}
+
       {/* Errors */}
       {status.errors && status.errors.length > 0 && (
         <div className="mb-6">
@@ -244,7 +327,42 @@ const ProcessingStatus = ({ onProcessingComplete }) => {
               <Play className="w-4 h-4 mr-2" />
               Procesar Archivos
             </button>
+
+            <button
+              onClick={estimateProcessing}
+              className="btn-secondary w-full"
+            >
+              <Clock className="w-4 h-4 mr-2" />
+              Estimar Duración y Créditos
+            </button>
+
+            {plan && (
+              <div className="p-3 bg-gray-50 rounded-lg text-sm text-gray-700">
+                <p>
+                  {plan.files} archivos, {plan.pages} páginas: ~{formatSeconds(plan.estimated_duration_seconds)} con {plan.parallelism} en paralelo
+                </p>
+                <p>Créditos estimados: {plan.estimated_credits}</p>
+                {plan.rejected > 0 && (
+                  <p className="text-error-600">{plan.rejected} archivos serían rechazados</p>
+                )}
+                {plan.unmodeled_files > 0 && (
+                  <p className="text-xs text-gray-500">
+                    {plan.unmodeled_files} archivos sin historial de latencia (estimación por defecto)
+                  </p>
+                )}
+              </div>
+            )}
             
+            {deadLetterCount > 0 && (
+              <button
+                onClick={requeueFailed}
+                className="btn-secondary w-full"
+              >
+                <AlertCircle className="w-4 h-4 mr-2" />
+                Reintentar Archivos Fallidos ({deadLetterCount})
+              </button>
+            )}
+
             {status.processed_files > 0 && (
               <button
                 onClick={consolidateFiles}
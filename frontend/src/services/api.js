@@ -2,12 +2,16 @@ import axios from 'axios';
 
 const API_BASE_URL = '/api';
 
+// Team this client uploads and processes for (fair share between tenants on the server)
+const TENANT = import.meta.env.VITE_TENANT;
+
 // Create axios instance with default config
 const api = axios.create({
   baseURL: API_BASE_URL,
   timeout: 60000, // 60 seconds for file uploads
   headers: {
     'Content-Type': 'application/json',
+    ...(TENANT ? { 'X-Tenant': TENANT } : {}),
   },
 });
 
@@ -23,13 +27,40 @@ api.interceptors.request.use(
   }
 );
 
+// Backoff when the server refuses work because it is overloaded (429/503 with Retry-After)
+const MAX_BACKOFF_RETRIES = 3;
+const MAX_BACKOFF_SECONDS = 120;
+
+const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+
+const retryAfterSeconds = (error) => {
+  const header = error.response?.headers?.['retry-after'];
+  const seconds = parseInt(header ?? error.response?.data?.retry_after, 10);
+  return Number.isNaN(seconds) ? null : seconds;
+};
+
 // Response interceptor for error handling
 api.interceptors.response.use(
   (response) => {
     console.log(`API Response: ${response.status} ${response.config.url}`);
     return response;
   },
-  (error) => {
+  async (error) => {
+    const config = error.config;
+    const status = error.response?.status;
+    const retryAfter = retryAfterSeconds(error);
+    
+    if (config && (status === 429 || status === 503) && retryAfter !== null) {
+      config.backoffRetries = (config.backoffRetries || 0) + 1;
+      if (config.backoffRetries <= MAX_BACKOFF_RETRIES && retryAfter <= MAX_BACKOFF_SECONDS) {
+        // Jitter so many waiting clients don't all come back at the same moment
+        const delay = retryAfter * 1000 * (1 + Math.random() * 0.25);
+        console.warn(`Servidor ocupado (${status}), reintentando en ${Math.round(delay / 1000)}s`, error.response.data?.load);
+        await sleep(delay);
+        return api(config);
+      }
+    }
+    
     console.error('API Response Error:', error);
     return Promise.reject(error);
   }
@@ -38,9 +69,12 @@ api.interceptors.response.use(
 // File operations
 export const fileAPI = {
   // Upload file
-  upload: async (file) => {
+  upload: async (file, priority = null) => {
     const formData = new FormData();
     formData.append('file', file);
+    if (priority !== null) {
+      formData.append('priority', priority);
+    }
     
     const response = await api.post('/files/upload', formData, {
       headers: {
@@ -50,6 +84,23 @@ export const fileAPI = {
     return response.data;
   },
 
+  // Upload several files (or .zip/.tar.gz archives) in one request
+  uploadBulk: async (files, priority = null) => {
+    const formData = new FormData();
+    files.forEach((file) => formData.append('files', file));
+    if (priority !== null) {
+      formData.append('priority', priority);
+    }
+    
+    const response = await api.post('/files/upload-bulk', formData, {
+      headers: {
+        'Content-Type': 'multipart/form-data',
+      },
+      timeout: 300000, // archives can take a while to extract
+    });
+    return response.data;
+  },
+
   // List files
   list: async () => {
     const response = await api.get('/files/list');
@@ -70,6 +121,15 @@ export const fileAPI = {
     return response.data;
   },
 
+  // Follow an output while it is converted: pages appended since `offset` (waits up to `wait` seconds)
+  tailPartial: async (filename, offset = 0, wait = 10) => {
+    const response = await api.get(`/files/partial/${filename}`, {
+      params: { offset, wait },
+      timeout: (wait + 10) * 1000,
+    });
+    return response.data;
+  },
+
   // Download all processed files as ZIP
   downloadAll: async () => {
     const response = await api.get('/files/download-all', {
@@ -111,6 +171,26 @@ export const processingAPI = {
     return response.data;
   },
 
+  // Dry run: estimated duration and credits of processing the input files
+  plan: async (changedOnly = false) => {
+    const response = await api.get('/process/plan', {
+      params: { changed: changedOnly, items: false },
+    });
+    return response.data;
+  },
+
+  // Files given up on after their retries, with the last error and attempts
+  getDeadLetters: async () => {
+    const response = await api.get('/process/dead-letter');
+    return response.data;
+  },
+
+  // Queue dead-lettered files again (all of them when files is omitted)
+  requeue: async (files) => {
+    const response = await api.post('/process/requeue', files ? { files } : {});
+    return response.data;
+  },
+
   // Consolidate files
   consolidate: async () => {
     const response = await api.post('/process/consolidate');